@@ -1,64 +1,118 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from app.api.schemas import UserCreate, UserLogin
-from app.database.database import get_db
+from app.database.executor import db_executor
 from app.models.user import User
-from app.auth.security import hash_password, verify_password, create_access_token
+from app.auth.security import create_access_token, get_current_user
+from app.auth.passwords import password_hasher, PasswordPoolSaturated
+from app.auth.token_cache import token_cache
 from datetime import timedelta
 from fastapi.security import OAuth2PasswordRequestForm
+from typing import Optional
 
 # Router initialiseren
 router = APIRouter(tags=["Auth"])
 
+# Antwoord als de wachtwoordpool vol zit (load shedding)
+POOL_SATURATED = HTTPException(
+    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+    detail="Te veel aanmeldingen tegelijk, probeer het zo opnieuw",
+    headers={"Retry-After": "1"},
+)
+
+
+def _username_exists(db: Session, username: str) -> bool:
+    return db.query(User.id).filter(User.username == username).first() is not None
+
+
+def _create_user(db: Session, username: str, hashed_password: str) -> bool:
+    db.add(User(username=username, hashed_password=hashed_password))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return False
+    return True
+
+
+def _get_password_hash(db: Session, username: str) -> Optional[str]:
+    row = db.query(User.hashed_password).filter(User.username == username).first()
+    return row[0] if row else None
+
+
+def _update_password_hash(db: Session, username: str, old_hash: str, new_hash: str):
+    # Alleen als de hash intussen niet veranderd is
+    db.query(User).filter(User.username == username, User.hashed_password == old_hash).update(
+        {User.hashed_password: new_hash}, synchronize_session=False
+    )
+    db.commit()
+
+
 @router.post("/register", status_code=status.HTTP_201_CREATED)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: UserCreate):
     """
     Registreert een nieuwe gebruiker door het wachtwoord te hashen
     en de gebruiker in de database op te slaan.
     """
-    # Controleer of de gebruikersnaam al bestaat
-    db_user = db.query(User).filter(User.username == user.username).first()
-    if db_user:
+    # Controleer of de gebruikersnaam al bestaat (vóór het dure hashen)
+    if await db_executor.run(_username_exists, user.username):
         raise HTTPException(status_code=400, detail="Gebruikersnaam bestaat al")
 
-    # Wachtwoord hashen
-    hashed_pass = hash_password(user.password)
-
-    # Nieuwe gebruiker aanmaken
-    new_user = User(username=user.username, hashed_password=hashed_pass)
+    # Wachtwoord hashen, in de wachtwoordpool
+    try:
+        hashed_pass = await password_hasher.hash(user.password)
+    except PasswordPoolSaturated:
+        raise POOL_SATURATED
 
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    # Nieuwe gebruiker aanmaken; de unieke index vangt een gelijktijdige registratie af
+    if not await db_executor.run(_create_user, user.username, hashed_pass):
+        raise HTTPException(status_code=400, detail="Gebruikersnaam bestaat al")
 
-    return {"message": f"Gebruiker '{new_user.username}' succesvol geregistreerd."}
+    return {"message": f"Gebruiker '{user.username}' succesvol geregistreerd."}
 
 
 @router.post("/token")
-def login_for_access_token(
+async def login_for_access_token(
     # OAuth2PasswordRequestForm is de standaard manier van FastAPI om login-data te ontvangen
-    form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    form_data: OAuth2PasswordRequestForm = Depends()
 ):
     """
     Verifieert inloggegevens en geeft een JWT-token terug.
     """
     # Gebruiker zoeken
-    user = db.query(User).filter(User.username == form_data.username).first()
+    hashed_password = await db_executor.run(_get_password_hash, form_data.username)
 
     # Verificatie van gebruiker en wachtwoord
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    valid, new_hash = False, None
+    if hashed_password:
+        try:
+            valid, new_hash = await password_hasher.verify_and_update(form_data.password, hashed_password)
+        except PasswordPoolSaturated:
+            raise POOL_SATURATED
+
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrecte gebruikersnaam of wachtwoord",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    # De cost factor is veranderd: sla de nieuwe hash op
+    if new_hash:
+        await db_executor.run(_update_password_hash, form_data.username, hashed_password, new_hash)
+
     # Token genereren
     access_token_expires = timedelta(minutes=30)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": form_data.username}, expires_delta=access_token_expires
     )
 
     # De response voldoet aan de OAuth2 specificatie
-    return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+    return {"access_token": access_token, "token_type": "bearer"}
+
+
+@router.get("/metrics")
+async def get_auth_stats(current_user: str = Depends(get_current_user)):
+    """Wachtwoordpool (wachtrij, looptijden) en token-cache."""
+    return {"password_pool": password_hasher.stats(), "token_cache": token_cache.stats()}
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from app.database.database import get_db
+from app.database.database import get_db, get_read_db
 from app.models.call_room import CallRoom
 from app.models.user import User
 from app.auth.security import get_current_user
@@ -39,8 +39,8 @@ class CallRoomMemberDisplay(BaseModel):
 
 
 @router.get("/call-rooms", response_model=List[CallRoomDisplay])
-async def get_call_rooms(
-    db: Session = Depends(get_db),
+def get_call_rooms(
+    db: Session = Depends(get_read_db),
     current_user: str = Depends(get_current_user)
 ):
     """Get all call rooms the user can access (public rooms + rooms they're invited to)."""
@@ -80,7 +80,7 @@ async def get_call_rooms(
 
 
 @router.post("/call-rooms", response_model=CallRoomDisplay)
-async def create_call_room(
+def create_call_room(
     room_data: CallRoomCreate,
     db: Session = Depends(get_db),
     current_user: str = Depends(get_current_user)
@@ -123,7 +123,7 @@ async def create_call_room(
 
 
 @router.post("/call-rooms/{slug}/join")
-async def join_call_room(
+def join_call_room(
     slug: str,
     db: Session = Depends(get_db),
     current_user: str = Depends(get_current_user)
@@ -146,7 +146,7 @@ async def join_call_room(
 
 
 @router.post("/call-rooms/{slug}/leave")
-async def leave_call_room(
+def leave_call_room(
     slug: str,
     db: Session = Depends(get_db),
     current_user: str = Depends(get_current_user)
@@ -169,9 +169,9 @@ async def leave_call_room(
 
 
 @router.get("/call-rooms/{slug}/members", response_model=List[CallRoomMemberDisplay])
-async def get_call_room_members(
+def get_call_room_members(
     slug: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: str = Depends(get_current_user)
 ):
     """Get all members of a call room."""
@@ -190,7 +190,7 @@ async def get_call_room_members(
 
 
 @router.post("/call-rooms/{slug}/invite/{username}")
-async def invite_to_call_room(
+def invite_to_call_room(
     slug: str,
     username: str,
     db: Session = Depends(get_db),
@@ -1,216 +1,356 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
-from app.database.database import get_db
+from app.database.database import get_read_db
+from app.database.executor import db_executor
 from app.services.connection_manager import manager
 from app.services import chat_crud # <-- NIEUW: Database functies
+from app.services.message_cache import message_cache
+from app.services.message_writer import message_writer
+from app.services.presence import presence
+from app.services.typing_indicator import typing_aggregator
+from app.services.message_codec import encode_event, encode_model, negotiate_subprotocol, receive_event
 from app.api.schemas import MessageDisplay
-import json
+from app.auth.security import get_current_user, resolve_principal
+from app.auth.token_cache import Principal
+from typing import Optional
 
 router = APIRouter(tags=["Chat"])
 
 # HTTP Route om de berichtgeschiedenis op te halen (gebruikt door de frontend bij het laden)
 @router.get("/rooms/{room_slug}/history", response_model=list[MessageDisplay])
-def get_history(room_slug: str, db: Session = Depends(get_db)):
-    """Haalt de geschiedenis van berichten op voor een kamer."""
-    return chat_crud.get_message_history(db, room_slug)
+def get_history(
+    room_slug: str,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=chat_crud.MAX_HISTORY_PAGE),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Haalt de geschiedenis van berichten op voor een kamer.
+
+    Gebruik `before=<id van het oudste bericht>` om verder terug te scrollen,
+    of `after=<id van het nieuwste bericht>` om bij te werken.
+    """
+    if before is not None and after is not None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Use either 'before' or 'after', not both")
+
+    # De laatste berichten komen uit de cache; bij een miss laden we het hele venster
+    if before is None and after is None and limit <= message_cache.window_size and manager.can_cache_room(room_slug):
+        cached = message_cache.get(room_slug, limit)
+        if cached is not None:
+            return cached
+        version = message_cache.version(room_slug)
+        messages = chat_crud.get_message_history(db, room_slug, limit=message_cache.window_size)
+        message_cache.fill(room_slug, messages, version)
+        return messages[-limit:]
+
+    return chat_crud.get_message_history(db, room_slug, limit=limit, before=before, after=after)
+
+
+@router.get("/rooms/{room_slug}/delivery-stats")
+async def get_delivery_stats(room_slug: str, current_user: str = Depends(get_current_user)):
+    """Afleverlatentie van broadcasts in een kamer (gemiddeld, p50, p99, max) en gedropte frames."""
+    return manager.get_delivery_stats(room_slug).get(room_slug, {})
+
+
+@router.get("/metrics/database")
+async def get_database_metrics(current_user: str = Depends(get_current_user)):
+    """Wachttijd/looptijd van databasewerk, group-commit batches en de vertraging van de event loop."""
+    return {**db_executor.stats(), "message_writer": message_writer.stats()}
+
+
+@router.get("/metrics/broker")
+async def get_broker_metrics(current_user: str = Depends(get_current_user)):
+    """Node-id en verkeer over de pub/sub-backplane, en de presence-spiegel."""
+    return {**manager.broker_stats(), "presence": presence.stats(), "typing": typing_aggregator.stats()}
+
+
+# Kanalen van send_to_user waarop een client van het gemultiplexte /ws zich kan abonneren
+USER_CHANNELS = ("dm", "calls")
+# Client-events die bij een kamer horen
+ROOM_EVENTS = ("typing", "message")
+
+
+def system_notice(room_slug: str, text: str):
+    """Systeemmelding in een kamer; met de kamer erbij, want een verbinding kan in meerdere kamers zitten."""
+    return encode_event({"type": "system", "room": room_slug, "text": text})
+
+
+async def _authenticate(websocket: WebSocket) -> Optional[Principal]:
+    """Het eerste frame bevat de token. Geeft None (en sluit de verbinding) als dat mislukt."""
+    # Receive the token from the client
+    auth_message = await receive_event(websocket)
+    token = auth_message.get("token")
+    print(f"[WS] Received auth message, token present: {bool(token)}")
+
+    if not token:
+        await websocket.send_text("Authentication failed: No token provided")
+        await websocket.close()
+        return None
+
+    # Verify the JWT token (meestal uit de token-cache)
+    principal = await resolve_principal(token)
+    if principal is None:
+        print("[WS] Invalid token")
+        await websocket.send_text("Authentication failed: Invalid token")
+        await websocket.close()
+        return None
+    print(f"[WS] Token verified, username: {principal.username}")
+
+    # Verify user exists and update last_seen (online-status staat in presence)
+    if not await db_executor.run(chat_crud.touch_last_seen, principal.username):
+        print(f"[WS] User not found: {principal.username}")
+        await websocket.send_text("Authentication failed: User not found")
+        await websocket.close()
+        return None
+
+    print(f"[WS] User {principal.username} authenticated successfully")
+    return principal
+
+
+async def _join_room(websocket: WebSocket, client_username: str, room_slug: str):
+    await manager.join_room(websocket, room_slug)
+    print(f"[WS] {client_username} connected to room {room_slug}")
+    await manager.broadcast(system_notice(room_slug, f"**{client_username}** is de chat binnengekomen."), room_slug)
+
+
+async def _leave_room(websocket: WebSocket, client_username: str, room_slug: str, notify: bool = True):
+    await typing_aggregator.update(room_slug, client_username, False)
+    await manager.leave_room(websocket, room_slug)
+    if notify:
+        await manager.broadcast(system_notice(room_slug, f"**{client_username}** heeft de chat verlaten."), room_slug)
+
+
+async def _close_session(websocket: WebSocket, client_username: Optional[str], present: bool, notify: bool):
+    """Opruimen na het sluiten van een verbinding, voor beide endpoints."""
+    for room_slug in list(manager.rooms_of(websocket)):
+        await _leave_room(websocket, client_username, room_slug, notify=notify and client_username is not None)
+    await manager.unregister(websocket)
+    if present:
+        await presence.disconnect(client_username)
+    if client_username:
+        await db_executor.run(chat_crud.touch_last_seen, client_username)
+
+
+async def _dispatch(client_username: str, room_slug: Optional[str], data_json: dict):
+    """
+    Afhandeling van één client-event, gedeeld door /ws/chat/{room_slug} en /ws.
+
+    `room_slug` is de kamer waar typing- en message-events bij horen.
+    """
+    # Typing indicator: samengevoegd per kamer, met de naam uit de token
+    if data_json.get('type') == 'typing':
+        await typing_aggregator.update(room_slug, client_username, bool(data_json.get("isTyping")))
+        return
+
+    # Handle WebRTC call room signaling messages
+    if data_json.get('type') == 'call-room-join':
+        # User joined a call room
+        call_room_slug = data_json.get('callRoom')
+        print(f"[SERVER] {client_username} joining call room {call_room_slug}")
+
+        # Get existing participants before adding new one
+        existing_participants = await manager.get_call_room_participants(call_room_slug)
+        print(f"[SERVER] Existing participants in {call_room_slug}: {existing_participants}")
+
+        # Add user to call room
+        await manager.join_call_room(call_room_slug, client_username)
+        print(f"[SERVER] After adding {client_username}, participants: {await manager.get_call_room_participants(call_room_slug)}")
+
+        # Send existing participants to the new joiner
+        if existing_participants:
+            try:
+                message = encode_event({"type": "existing-participants", "participants": existing_participants, "callRoom": call_room_slug})
+                print(f"[SERVER] Sending to {client_username}: {message.text}")
+                await manager.send_to_user(message, client_username, "calls")
+                print(f"[SERVER] Message sent successfully to {client_username}")
+            except Exception as e:
+                print(f"[SERVER ERROR] Failed to send existing-participants to {client_username}: {e}")
+        else:
+            print(f"[SERVER] No existing participants to send to {client_username}")
+
+        # Notify existing participants about new peer
+        try:
+            peer_joined_msg = encode_event({"type": "peer-joined", "username": client_username, "callRoom": call_room_slug})
+            print(f"[SERVER] Broadcasting peer-joined to call room {call_room_slug} (excluding {client_username}): {peer_joined_msg.text}")
+            await manager.broadcast_to_call_room(
+                peer_joined_msg,
+                call_room_slug,
+                exclude_username=client_username
+            )
+            print(f"[SERVER] peer-joined broadcast completed")
+        except Exception as e:
+            print(f"[SERVER ERROR] Failed to broadcast peer-joined: {e}")
+        return
+
+    if data_json.get('type') == 'call-room-leave':
+        # User left call room
+        call_room_slug = data_json.get('callRoom')
+        await manager.leave_call_room(call_room_slug, client_username)
+
+        # Notify others in call room
+        await manager.broadcast_to_call_room(
+            encode_event({"type": "peer-left", "username": client_username, "callRoom": call_room_slug}),
+            call_room_slug
+        )
+        return
+
+    # Handle WebRTC peer-to-peer signaling (within call room)
+    if data_json.get('type') in ['call-offer', 'call-answer', 'ice-candidate']:
+        # Forward signaling messages to the recipient
+        recipient = data_json.get('to')
+        if recipient:
+            await manager.send_to_user(encode_event(data_json), recipient, "calls")
+        return
+
+    # Check if it's a regular message
+    if data_json.get('type') == 'message':
+        content = data_json.get('content')
+        reply_to_id = data_json.get('reply_to_id')
+
+        # 1. Bericht opslaan in DB (gebundeld met andere berichten in één commit)
+        saved_message = await message_writer.submit(
+            username=client_username,
+            room_slug=room_slug,
+            content=content,
+            reply_to_id=reply_to_id
+        )
+
+        # Wie een bericht verstuurt typt niet meer
+        await typing_aggregator.update(room_slug, client_username, False)
+
+        if saved_message:
+            # 2. Formatteer de JSON voor de frontend
+            # We sturen een JSON-object, niet alleen tekst (één keer gecodeerd voor alle ontvangers)
+            broadcast_data = encode_model(saved_message)
+
+            # 3. Bericht doorsturen naar de hele kamer
+            await manager.broadcast(broadcast_data, room_slug)
 
 
 @router.websocket("/ws/chat/{room_slug}")
-async def websocket_endpoint(
-    websocket: WebSocket,
-    room_slug: str,
-    db: Session = Depends(get_db)
-):
+async def websocket_endpoint(websocket: WebSocket, room_slug: str):
+    """Eén kamer per verbinding. Nieuwe clients gebruiken /ws."""
+    # Alle databasewerk loopt via db_executor, zodat een commit de event loop niet blokkeert
     print(f"[WS] New connection attempt to room: {room_slug}")
-    # Accept the connection first to receive data
-    await websocket.accept()
+    # Accept the connection first to receive data (optioneel met het msgpack-subprotocol)
+    subprotocol = negotiate_subprotocol(websocket)
+    await websocket.accept(subprotocol=subprotocol)
     print(f"[WS] Connection accepted, waiting for auth...")
 
     client_username = None
+    present = False
 
     try:
-        # Receive the token from the client
-        auth_message = await websocket.receive_json()
-        token = auth_message.get("token")
-        print(f"[WS] Received auth message, token present: {bool(token)}")
-
-        if not token:
-            await websocket.send_text("Authentication failed: No token provided")
-            await websocket.close()
+        principal = await _authenticate(websocket)
+        if principal is None:
             return
+        client_username = principal.username
 
-        # Verify the JWT token
-        from app.auth.security import SECRET_KEY, ALGORITHM
-        from jose import jwt, JWTError
+        # Connect to the room
+        await manager.register(websocket, client_username, binary=subprotocol is not None)
+        await _join_room(websocket, client_username, room_slug)
 
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            client_username = payload.get("sub")
-            print(f"[WS] Token decoded, username: {client_username}")
-            if not client_username:
-                print("[WS] No username in token")
-                await websocket.send_text("Authentication failed: Invalid token")
-                await websocket.close()
-                return
-        except JWTError as e:
-            print(f"[WS] JWT Error: {e}")
-            await websocket.send_text("Authentication failed: Invalid token")
-            await websocket.close()
-            return
+        # Presence: eerst één snapshot voor deze client, daarna alleen wijzigingen
+        await presence.connect(client_username, principal.avatar_url)
+        present = True
+        await manager.send_personal_message(presence.snapshot(), websocket)
 
-        # Verify user exists
-        user = chat_crud.get_user_by_username(db, client_username)
-        if not user:
-            print(f"[WS] User not found: {client_username}")
-            await websocket.send_text("Authentication failed: User not found")
-            await websocket.close()
-            return
+        while True:
+            # Ontvang data als JSON (of msgpack)
+            data_json = await receive_event(websocket)
 
-        print(f"[WS] User {client_username} authenticated successfully")
+            # Elk bericht verlengt de presence-lease; de heartbeat is er alleen daarvoor
+            await presence.touch(client_username)
+            if data_json.get('type') == 'heartbeat':
+                continue
+            await _dispatch(client_username, room_slug, data_json)
 
-        # Update user online status
-        user.is_online = True
-        from datetime import datetime
-        user.last_seen = datetime.utcnow()
-        db.commit()
+    except WebSocketDisconnect:
+        await _close_session(websocket, client_username, present, notify=True)
 
-        # Connect to the room
-        await manager.connect(websocket, room_slug, client_username)
-        print(f"[WS] {client_username} connected to room {room_slug}")
-
-        # Systeemmelding
-        join_message = f"**{client_username}** is de chat binnengekomen."
-        await manager.broadcast(join_message, room_slug)
-
-        # Broadcast online status update
-        online_users = manager.get_online_users()
-        print(f"[WS] Online users: {online_users}")
-        await manager.broadcast(
-            f'{{"type":"online_status","online_users":{online_users}}}',
-            room_slug
-        )
+    except Exception as e:
+        print(f"[ERROR] WebSocket error for {client_username}: {e}")
+        import traceback
+        traceback.print_exc()
+        await _close_session(websocket, client_username, present, notify=False)
 
-        while True:
-            # Ontvang data als JSON
-            data_json = await websocket.receive_json()
-
-            # Check if it's a typing indicator
-            if data_json.get('type') == 'typing':
-                # Broadcast typing status to room
-                await manager.broadcast(
-                    f'{{"type":"typing","username":"{data_json.get("username")}","isTyping":{str(data_json.get("isTyping")).lower()}}}',
-                    room_slug
-                )
-                continue
 
-            # Handle WebRTC call room signaling messages
-            if data_json.get('type') == 'call-room-join':
-                # User joined a call room
-                call_room_slug = data_json.get('callRoom')
-                print(f"[SERVER] {client_username} joining call room {call_room_slug}")
-
-                # Get existing participants before adding new one
-                existing_participants = manager.get_call_room_participants(call_room_slug)
-                print(f"[SERVER] Existing participants in {call_room_slug}: {existing_participants}")
-
-                # Add user to call room
-                manager.join_call_room(call_room_slug, client_username)
-                print(f"[SERVER] After adding {client_username}, participants: {manager.get_call_room_participants(call_room_slug)}")
-
-                # Send existing participants to the new joiner
-                if existing_participants:
-                    try:
-                        message = f'{{"type":"existing-participants","participants":{json.dumps(existing_participants)},"callRoom":"{call_room_slug}"}}'
-                        print(f"[SERVER] Sending to {client_username}: {message}")
-                        await manager.send_to_user(message, client_username)
-                        print(f"[SERVER] Message sent successfully to {client_username}")
-                    except Exception as e:
-                        print(f"[SERVER ERROR] Failed to send existing-participants to {client_username}: {e}")
-                else:
-                    print(f"[SERVER] No existing participants to send to {client_username}")
-
-                # Notify existing participants about new peer
-                try:
-                    peer_joined_msg = f'{{"type":"peer-joined","username":"{client_username}","callRoom":"{call_room_slug}"}}'
-                    print(f"[SERVER] Broadcasting peer-joined to call room {call_room_slug} (excluding {client_username}): {peer_joined_msg}")
-                    await manager.broadcast_to_call_room(
-                        peer_joined_msg,
-                        call_room_slug,
-                        exclude_username=client_username
-                    )
-                    print(f"[SERVER] peer-joined broadcast completed")
-                except Exception as e:
-                    print(f"[SERVER ERROR] Failed to broadcast peer-joined: {e}")
-                continue
+@router.websocket("/ws")
+async def multiplexed_websocket_endpoint(websocket: WebSocket):
+    """
+    Eén verbinding per client voor alle kamers, directe berichten en call-signalering.
 
-            if data_json.get('type') == 'call-room-leave':
-                # User left call room
-                call_room_slug = data_json.get('callRoom')
-                manager.leave_call_room(call_room_slug, client_username)
+    Na de token stuurt de client bv.
+    `{"type": "subscribe", "room": "general"}` of `{"type": "subscribe", "channel": "dm"}`
+    (kanalen: dm, calls) en `unsubscribe` om weer af te melden; na een subscribe
+    op dm volgt een `unread_snapshot`. typing- en message-events hebben een
+    `room` waarop de client geabonneerd moet zijn.
+    """
+    subprotocol = negotiate_subprotocol(websocket)
+    await websocket.accept(subprotocol=subprotocol)
 
-                # Notify others in call room
-                await manager.broadcast_to_call_room(
-                    f'{{"type":"peer-left","username":"{client_username}","callRoom":"{call_room_slug}"}}',
-                    call_room_slug
-                )
+    client_username = None
+    present = False
+
+    try:
+        principal = await _authenticate(websocket)
+        if principal is None:
+            return
+        client_username = principal.username
+
+        channels = set()
+        await manager.register(websocket, client_username, binary=subprotocol is not None, channels=channels)
+        await presence.connect(client_username, principal.avatar_url)
+        present = True
+        await manager.send_personal_message(encode_event({"type": "ready", "username": client_username}), websocket)
+        await manager.send_personal_message(presence.snapshot(), websocket)
+
+        while True:
+            data_json = await receive_event(websocket)
+            await presence.touch(client_username)
+            event_type = data_json.get('type')
+            if event_type == 'heartbeat':
                 continue
 
-            # Handle WebRTC peer-to-peer signaling (within call room)
-            if data_json.get('type') in ['call-offer', 'call-answer', 'ice-candidate']:
-                # Forward signaling messages to the recipient
-                recipient = data_json.get('to')
-                if recipient:
-                    import json
-                    await manager.send_to_user(json.dumps(data_json), recipient)
+            if event_type in ('subscribe', 'unsubscribe'):
+                room_slug = data_json.get('room')
+                channel = data_json.get('channel')
+                if room_slug:
+                    if event_type == 'subscribe':
+                        await _join_room(websocket, client_username, room_slug)
+                    elif room_slug in manager.rooms_of(websocket):
+                        await _leave_room(websocket, client_username, room_slug)
+                    reply = {"type": event_type + "d", "room": room_slug}
+                elif channel in USER_CHANNELS:
+                    if event_type == 'subscribe':
+                        channels.add(channel)
+                    else:
+                        channels.discard(channel)
+                    reply = {"type": event_type + "d", "channel": channel}
+                else:
+                    reply = {"type": "error", "detail": "Unknown room or channel"}
+                await manager.send_personal_message(encode_event(reply), websocket)
+                if event_type == 'subscribe' and channel == 'dm':
+                    # Beginstand van de badges; daarna volgen `unread`-events
+                    counts = await db_executor.run(chat_crud.get_unread_counts, principal.user_id)
+                    await manager.send_personal_message(encode_event({"type": "unread_snapshot", **counts}), websocket)
                 continue
 
-            # Check if it's a regular message
-            if data_json.get('type') == 'message':
-                content = data_json.get('content')
-                reply_to_id = data_json.get('reply_to_id')
-
-                # 1. Bericht opslaan in DB
-                saved_message = chat_crud.save_message(
-                    db=db,
-                    username=client_username,
-                    room_slug=room_slug,
-                    content=content,
-                    reply_to_id=reply_to_id
+            room_slug = data_json.get('room')
+            if event_type in ROOM_EVENTS and room_slug not in manager.rooms_of(websocket):
+                await manager.send_personal_message(
+                    encode_event({"type": "error", "room": room_slug, "detail": "Not subscribed to this room"}),
+                    websocket
                 )
-
-                if saved_message:
-                    # 2. Formatteer de JSON voor de frontend
-                    # We sturen een JSON-object, niet alleen tekst
-                    broadcast_data = saved_message.model_dump_json()
-
-                    # 3. Bericht doorsturen naar de hele kamer
-                    await manager.broadcast(broadcast_data, room_slug)
+                continue
+            await _dispatch(client_username, room_slug, data_json)
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket, room_slug, client_username)
-        # Update user status in database
-        if client_username:
-            user = chat_crud.get_user_by_username(db, client_username)
-            if user:
-                user.is_online = manager.is_user_online(client_username)
-                user.last_seen = datetime.utcnow()
-                db.commit()
-        await manager.broadcast(f"**{client_username}** heeft de chat verlaten.", room_slug)
-        # Broadcast online status update
-        online_users = manager.get_online_users()
-        await manager.broadcast(
-            f'{{"type":"online_status","online_users":{online_users}}}',
-            room_slug
-        )
+        await _close_session(websocket, client_username, present, notify=True)
 
     except Exception as e:
         print(f"[ERROR] WebSocket error for {client_username}: {e}")
         import traceback
         traceback.print_exc()
-        manager.disconnect(websocket, room_slug, client_username)
-        if client_username:
-            user = chat_crud.get_user_by_username(db, client_username)
-            if user:
-                user.is_online = False
-                user.last_seen = datetime.utcnow()
-                db.commit()
\ No newline at end of file
+        await _close_session(websocket, client_username, present, notify=False)
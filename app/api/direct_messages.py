@@ -1,116 +1,191 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
-from typing import List
-from app.database.database import get_db
-from app.api.schemas import DirectMessageCreate, DirectMessageDisplay, UserInfo
+from typing import List, Optional
+from app.database.database import get_read_db
+from app.api.schemas import ConversationSummary, DirectMessageCreate, DirectMessageDisplay, UserInfo
 from app.models.user import User
 from app.models.direct_message import DirectMessage
-from app.auth.security import get_current_user
+from app.auth.security import get_current_principal
+from app.auth.token_cache import Principal
+from app.database.executor import db_executor
+from app.services import chat_crud
+from app.services.connection_manager import manager
+from app.services.message_codec import encode_event
 
 router = APIRouter(tags=["Direct Messages"])
 
 
 @router.get("/users", response_model=List[UserInfo])
-def get_all_users(db: Session = Depends(get_db)):
+def get_all_users(db: Session = Depends(get_read_db)):
     """Haal alle geregistreerde gebruikers op."""
     users = db.query(User).filter(User.is_active == True).all()
     return [UserInfo(username=user.username, is_active=user.is_active) for user in users]
 
 
-@router.post("/direct-message", status_code=status.HTTP_201_CREATED)
-async def send_direct_message(
-    message_data: DirectMessageCreate,
-    db: Session = Depends(get_db),
-    current_user: str = Depends(get_current_user)
+@router.get("/conversations", response_model=List[ConversationSummary])
+def get_conversations(
+    before: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=chat_crud.MAX_HISTORY_PAGE),
+    db: Session = Depends(get_read_db),
+    user: Principal = Depends(get_current_principal)
 ):
-    """Stuur een direct bericht naar een andere gebruiker."""
-    # Get sender
-    sender = db.query(User).filter(User.username == current_user.username).first()
-    if not sender:
-        raise HTTPException(status_code=404, detail="Sender not found")
+    """
+    De inbox: gesprekken van de huidige gebruiker, nieuwste eerst, met het
+    laatste bericht en het aantal ongelezen berichten.
+
+    Gebruik `before=<last_message_id van het laatste gesprek>` voor de volgende pagina.
+    """
+    return chat_crud.get_inbox(db, user.user_id, limit=limit, before=before)
+
 
+def _unread_event(peer: str, counts: dict) -> dict:
+    return {"type": "unread", "peer": peer, "count": counts["conversations"].get(peer, 0), "total": counts["total"]}
+
+
+def _create_direct_message(db: Session, sender: Principal, receiver_username: str, content: str):
     # Get receiver
-    receiver = db.query(User).filter(User.username == message_data.receiver_username).first()
-    if not receiver:
+    receiver_id = db.query(User.id).filter(User.username == receiver_username).scalar()
+    if receiver_id is None:
         raise HTTPException(status_code=404, detail="Receiver not found")
 
     # Can't send message to yourself
-    if sender.id == receiver.id:
+    if sender.user_id == receiver_id:
         raise HTTPException(status_code=400, detail="Cannot send message to yourself")
 
     # Create message
     new_message = DirectMessage(
-        sender_id=sender.id,
-        receiver_id=receiver.id,
-        content=message_data.content
+        sender_id=sender.user_id,
+        receiver_id=receiver_id,
+        content=content
     )
 
     db.add(new_message)
-    db.commit()
+    db.flush()
     db.refresh(new_message)
+    # Inbox en teller van de ontvanger in dezelfde transactie
+    chat_crud.record_direct_message(db, new_message)
+
+    message = DirectMessageDisplay(
+        id=new_message.id,
+        content=new_message.content,
+        timestamp=new_message.timestamp,
+        sender_username=sender.username,
+        receiver_username=receiver_username,
+        is_read=False
+    )
+    db.commit()
+    return message, chat_crud.get_unread_counts(db, receiver_id, sender.user_id)
+
+
+@router.post("/direct-message", status_code=status.HTTP_201_CREATED)
+async def send_direct_message(
+    message_data: DirectMessageCreate,
+    sender: Principal = Depends(get_current_principal)
+):
+    """Stuur een direct bericht naar een andere gebruiker; het wordt meteen via de WebSocket afgeleverd."""
+    message, unread = await db_executor.run(_create_direct_message, sender, message_data.receiver_username, message_data.content)
+
+    # Naar de ontvanger en naar de andere tabbladen van de afzender
+    frame = encode_event({"type": "direct_message", "message": message})
+    await manager.send_to_user(frame, message.receiver_username, "dm")
+    await manager.send_to_user(frame, sender.username, "dm")
+    await manager.send_to_user(encode_event(_unread_event(sender.username, unread)), message.receiver_username, "dm")
 
     return {
         "message": "Direct message sent successfully",
-        "message_id": new_message.id
+        "message_id": message.id,
+        "direct_message": message
     }
 
 
-@router.get("/direct-messages/{username}", response_model=List[DirectMessageDisplay])
-async def get_conversation(
-    username: str,
-    db: Session = Depends(get_db),
-    current_user: str = Depends(get_current_user)
-):
-    """Haal het gesprek op tussen de huidige gebruiker en een andere gebruiker."""
-    # Get current user
-    user = db.query(User).filter(User.username == current_user).first()
-    if not user:
+def _get_user_id(db: Session, username: str) -> int:
+    user_id = db.query(User.id).filter(User.username == username).scalar()
+    if user_id is None:
         raise HTTPException(status_code=404, detail="User not found")
+    return user_id
 
-    # Get other user
-    other_user = db.query(User).filter(User.username == username).first()
-    if not other_user:
-        raise HTTPException(status_code=404, detail="User not found")
 
-    # Get all messages between these two users
-    messages = db.query(DirectMessage).filter(
-        ((DirectMessage.sender_id == user.id) & (DirectMessage.receiver_id == other_user.id)) |
-        ((DirectMessage.sender_id == other_user.id) & (DirectMessage.receiver_id == user.id))
-    ).order_by(DirectMessage.timestamp).all()
+def _load_conversation(db: Session, user: Principal, username: str, before: Optional[int], limit: int):
+    other_id = _get_user_id(db, username)
 
-    # Mark messages as read if they're sent to current user
-    for msg in messages:
-        if msg.receiver_id == user.id and not msg.is_read:
-            msg.is_read = True
-    db.commit()
+    # Bij het openen van het gesprek is alles gelezen: één UPDATE van het watermerk
+    unread = None
+    if before is None and chat_crud.mark_conversation_read(db, user.user_id, other_id):
+        db.commit()
+        unread = chat_crud.get_unread_counts(db, user.user_id, other_id)
 
-    # Convert to display format
-    return [
+    rows = chat_crud.get_direct_message_page(db, user.user_id, other_id, limit=limit, before=before)
+    read_up_to, peer_read_up_to = chat_crud.get_read_watermarks(db, user.user_id, other_id)
+
+    # Convert to display format; beide gebruikersnamen zijn al bekend
+    usernames = {user.user_id: user.username, other_id: username}
+    messages = [
         DirectMessageDisplay(
-            id=msg.id,
-            content=msg.content,
-            timestamp=msg.timestamp,
-            sender_username=msg.sender.username,
-            receiver_username=msg.receiver.username,
-            is_read=msg.is_read
+            id=row.id,
+            content=row.content,
+            timestamp=row.timestamp,
+            sender_username=usernames[row.sender_id],
+            receiver_username=usernames[row.receiver_id],
+            is_read=row.id <= (read_up_to if row.receiver_id == user.user_id else peer_read_up_to)
         )
-        for msg in messages
+        for row in rows
     ]
+    return messages, unread
 
 
-@router.get("/unread-count")
-async def get_unread_count(
-    db: Session = Depends(get_db),
-    current_user: str = Depends(get_current_user)
+@router.get("/direct-messages/{username}", response_model=List[DirectMessageDisplay])
+async def get_conversation(
+    username: str,
+    before: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=chat_crud.MAX_HISTORY_PAGE),
+    user: Principal = Depends(get_current_principal)
 ):
-    """Haal het aantal ongelezen berichten op voor de huidige gebruiker."""
-    user = db.query(User).filter(User.username == current_user.username).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    """
+    Haal het gesprek op tussen de huidige gebruiker en een andere gebruiker.
+
+    Geeft de laatste `limit` berichten; gebruik `before=<id van het oudste
+    bericht>` om verder terug te laden. Zonder `before` geldt het gesprek als gelezen.
+    """
+    messages, unread = await db_executor.run(_load_conversation, user, username, before, limit)
+    if unread is not None:
+        # De badges in de andere tabbladen bijwerken
+        await manager.send_to_user(encode_event(_unread_event(username, unread)), user.username, "dm")
+    return messages
+
+
+def _mark_read(db: Session, user: Principal, username: str, up_to: Optional[int]):
+    other_id = _get_user_id(db, username)
+    if not chat_crud.mark_conversation_read(db, user.user_id, other_id, up_to):
+        return None
+    db.commit()
+    return chat_crud.get_unread_counts(db, user.user_id, other_id)
 
-    unread_count = db.query(DirectMessage).filter(
-        DirectMessage.receiver_id == user.id,
-        DirectMessage.is_read == False
-    ).count()
 
-    return {"unread_count": unread_count}
+@router.post("/direct-messages/{username}/read")
+async def mark_conversation_read(
+    username: str,
+    up_to: Optional[int] = None,
+    user: Principal = Depends(get_current_principal)
+):
+    """Markeer het gesprek als gelezen, tot en met bericht `up_to` (standaard alles)."""
+    unread = await db_executor.run(_mark_read, user, username, up_to)
+    if unread is None:
+        return {"updated": False}
+    event = _unread_event(username, unread)
+    await manager.send_to_user(encode_event(event), user.username, "dm")
+    return {"updated": True, "unread_count": event["count"], "total": event["total"]}
+
+
+@router.get("/unread-count")
+def get_unread_count(
+    db: Session = Depends(get_read_db),
+    user: Principal = Depends(get_current_principal)
+):
+    """
+    Het aantal ongelezen berichten, in totaal en per gesprekspartner.
+
+    Leest de bijgehouden tellers; wijzigingen komen ook als `unread`-event
+    over het dm-kanaal van de WebSocket, dus pollen is niet nodig.
+    """
+    counts = chat_crud.get_unread_counts(db, user.user_id)
+    return {"unread_count": counts["total"], "conversations": counts["conversations"]}
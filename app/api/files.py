@@ -1,15 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, status
-from sqlalchemy.orm import Session
-from app.database.database import get_db
-from app.auth.security import get_current_user
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response
+from sqlalchemy.orm import Session, joinedload
+from app.database.database import get_read_db
+from app.database.executor import db_executor
+from app.auth.security import get_current_user, get_current_principal_from_header_or_query
+from app.auth.token_cache import Principal
 from app.models.file_attachment import FileAttachment
 from app.models.message import Message
 from app.models.room import Room
+from app.models.room_member import RoomMember
 from app.models.user import User
-from typing import List
+from app.services.message_cache import message_cache
+from app.services import chat_crud
+from app.services.blob_store import acquire_blob, attachment_url, find_blob, new_temp_path, place_blob, store_blob
+from app.models.file_blob import FileBlob
+from app.services.upload_sessions import UploadSession, upload_sessions
+from app.services.bandwidth import bandwidth_meter
+from app.services.thumbnails import thumbnail_pipeline
+from pydantic import BaseModel
+from typing import BinaryIO, Callable, List, Optional, Tuple
+import asyncio
+import hashlib
 import os
 from pathlib import Path
-import uuid
+from urllib.parse import quote
+from weakref import WeakValueDictionary
 from datetime import datetime
 
 router = APIRouter(tags=["Files"])
@@ -17,6 +33,25 @@ router = APIRouter(tags=["Files"])
 # Maximum file size: 500MB (0.5GB)
 MAX_FILE_SIZE = 500 * 1024 * 1024  # 500MB in bytes
 
+# Uploads worden in blokken van deze grootte naar schijf geschreven
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# Downloads: blokgrootte als de server geen pathsend kent (minder event-loop-rondjes voor grote media)
+ATTACHMENT_CHUNK_SIZE = 1024 * 1024  # 1MB
+# Achter nginx: laat nginx het bestand met sendfile versturen via X-Accel-Redirect.
+# Bv. ATTACHMENT_ACCEL_REDIRECT=/_protected/ met in nginx:
+#   location /_protected/ { internal; alias /app/; }
+ATTACHMENT_ACCEL_REDIRECT = os.environ.get("ATTACHMENT_ACCEL_REDIRECT")
+# Inhoud is onveranderlijk (content-addressed), dus de browser mag hem een jaar bewaren
+ATTACHMENT_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# Types die de browser inline mag tonen; de rest (ook SVG, wegens scripts) wordt gedownload
+INLINE_CONTENT_PREFIXES = ("image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp", "video/", "audio/", "application/pdf")
+# Kamers die voor iedereen toegankelijk zijn (zie rooms.get_all_rooms)
+PUBLIC_ROOMS = ("general", "dev-team")
+
+# Maximum number of search results per page
+MAX_SEARCH_PAGE = 50
+
 # Allowed file types
 ALLOWED_CONTENT_TYPES = [
     # Images
@@ -38,24 +73,31 @@ ALLOWED_CONTENT_TYPES = [
 ]
 
 
-@router.post("/rooms/{room_slug}/upload")
-async def upload_file(
-    room_slug: str,
-    file: UploadFile = File(...),
-    content: str = Form(None),
-    db: Session = Depends(get_db),
-    current_user: str = Depends(get_current_user)
-):
-    """Upload een bestand naar een chatroom met optionele tekst."""
+def _copy_to_disk(source: BinaryIO, destination: Path) -> Tuple[int, str]:
+    """
+    Kopieert een bestand in blokken van UPLOAD_CHUNK_SIZE naar schijf,
+    terwijl het de grootte bewaakt en de SHA-256 bijhoudt. Draait in de threadpool.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with destination.open("wb") as buffer:
+        while True:
+            chunk = source.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_FILE_SIZE:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail="File size exceeds maximum allowed size of 500MB"
+                )
+            digest.update(chunk)
+            buffer.write(chunk)
+    return size, digest.hexdigest()
 
-    # Store the message content before reading file
-    message_text = content
-
-    # Check file size
-    file.file.seek(0, 2)  # Move to end of file
-    file_size = file.file.tell()
-    file.file.seek(0)  # Reset to beginning
 
+def _check_upload(content_type: str, file_size: int):
+    """Gemeenschappelijke controles voor gewone en hervatbare uploads."""
     if file_size > MAX_FILE_SIZE:
         raise HTTPException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
@@ -69,42 +111,36 @@ async def upload_file(
         )
 
     # Check content type
-    if file.content_type not in ALLOWED_CONTENT_TYPES:
+    if content_type not in ALLOWED_CONTENT_TYPES:
         raise HTTPException(
             status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-            detail=f"File type not allowed: {file.content_type}"
+            detail=f"File type not allowed: {content_type}"
         )
 
-    # Get user and room
-    user = db.query(User).filter(User.username == current_user).first()
-    room = db.query(Room).filter(Room.slug == room_slug).first()
-
-    if not user or not room:
-        raise HTTPException(status_code=404, detail="User or room not found")
-
-    # Create uploads directory
-    upload_dir = Path("static/uploads") / room_slug
-    upload_dir.mkdir(parents=True, exist_ok=True)
 
-    # Generate unique filename
-    file_extension = Path(file.filename).suffix
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = upload_dir / unique_filename
+def _create_attachment(
+    db: Session,
+    user: User,
+    room: Room,
+    room_slug: str,
+    blob: FileBlob,
+    original_filename: str,
+    content_type: str,
+    message_text: Optional[str],
+    deduplicated: bool = False
+) -> tuple:
+    """
+    Maakt het bericht + de bijlage aan voor een opgeslagen blob (via db_executor).
 
-    # Save file
-    try:
-        with file_path.open("wb") as buffer:
-            file_content = await file.read()
-            buffer.write(file_content)
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to save file: {str(e)}"
-        )
+    Geeft de MessageDisplay, het antwoord voor de client en eventueel de
+    argumenten voor de thumbnail-pipeline terug; _publish_attachment
+    verstuurt ze daarna op de event loop.
+    """
+    from app.api.schemas import MessageDisplay, FileAttachmentDisplay
 
     # Create message for file
     # Use provided message text or default message
-    message_content = message_text if message_text else f"📎 {file.filename}"
+    message_content = message_text if message_text else f"📎 {original_filename}"
 
     message = Message(
         user_id=user.id,
@@ -116,30 +152,25 @@ async def upload_file(
 
     # Create file attachment record
     attachment = FileAttachment(
-        filename=unique_filename,
-        original_filename=file.filename,
-        file_path=f"/static/uploads/{room_slug}/{unique_filename}",
-        file_size=file_size,
-        content_type=file.content_type,
+        filename=Path(blob.storage_path).name,
+        original_filename=original_filename,
+        file_path="",
+        file_size=blob.size,
+        content_type=content_type,
         message_id=message.id,
-        user_id=user.id
+        user_id=user.id,
+        blob_id=blob.id
     )
     db.add(attachment)
+    db.flush()
+    # De blob zelf staat niet onder /static; alleen de download-route geeft hem vrij
+    attachment.file_path = attachment_url(attachment.id)
+    acquire_blob(db, blob)
     db.commit()
     db.refresh(message)
 
-    # Broadcast message via WebSocket
-    from app.services.connection_manager import manager
-    from app.api.schemas import MessageDisplay, FileAttachmentDisplay
-
-    # Create message display with attachment
-    attachment_display = FileAttachmentDisplay(
-        id=attachment.id,
-        original_filename=attachment.original_filename,
-        file_path=attachment.file_path,
-        file_size=attachment.file_size,
-        content_type=attachment.content_type
-    )
+    # Create message display with attachment (een hergebruikte blob heeft al zijn thumbnail)
+    attachment_display = FileAttachmentDisplay.from_orm(attachment)
 
     message_display = MessageDisplay(
         id=message.id,
@@ -151,26 +182,479 @@ async def upload_file(
         attachments=[attachment_display]
     )
 
-    # Broadcast to WebSocket connections
-    await manager.broadcast(message_display.model_dump_json(), room_slug)
+    # Thumbnail en placeholder op de achtergrond; clients krijgen een attachment-updated
+    thumbnail_job = None
+    if thumbnail_pipeline.wants(attachment.blob, content_type):
+        thumbnail_job = (blob.id, attachment.blob.storage_path, room_slug, message.id, [attachment.id])
 
-    return {
+    result = {
         "message": "File uploaded successfully",
         "file_id": attachment.id,
         "file_url": attachment.file_path,
-        "file_size": file_size,
+        "file_size": blob.size,
+        "sha256": blob.sha256,
+        "deduplicated": deduplicated,
         "message_id": message.id
     }
+    return message_display, result, thumbnail_job
+
+
+def _store_attachment(
+    db: Session,
+    username: str,
+    room_slug: str,
+    source: Path,
+    sha256: str,
+    size: int,
+    original_filename: str,
+    content_type: str,
+    message_text: Optional[str]
+):
+    """Legt een volledig ontvangen, gehasht bestand vast als blob + bijlage (via db_executor)."""
+    user, room = _get_user_and_room(db, username, room_slug)
+    existing = find_blob(db, sha256, size)
+    blob = store_blob(db, sha256, size, Path(original_filename).suffix)
+    created = _create_attachment(
+        db, user, room, room_slug, blob, original_filename,
+        content_type, message_text, deduplicated=existing is not None
+    )
+    # Pas na de commit: zelfde inhoud al opgeslagen? Dan wordt het tijdelijke bestand weggegooid
+    place_blob(blob, source)
+    return created
+
+
+async def _publish_attachment(room_slug: str, created: tuple) -> dict:
+    """Broadcast een aangemaakte bijlage en plan zijn thumbnail in."""
+    from app.services.connection_manager import manager
+    from app.services.message_codec import encode_model
+
+    message_display, result, thumbnail_job = created
+
+    # Broadcast to WebSocket connections
+    message_cache.append(room_slug, message_display)
+    await manager.broadcast(encode_model(message_display), room_slug)
+
+    if thumbnail_job is not None:
+        thumbnail_pipeline.schedule(*thumbnail_job)
+    return result
+
+
+def _get_user_and_room(db: Session, username: str, room_slug: str) -> Tuple[User, Room]:
+    user = db.query(User).filter(User.username == username).first()
+    room = db.query(Room).filter(Room.slug == room_slug).first()
+
+    if not user or not room:
+        raise HTTPException(status_code=404, detail="User or room not found")
+    return user, room
+
+
+@router.post("/rooms/{room_slug}/upload")
+async def upload_file(
+    room_slug: str,
+    file: UploadFile = File(...),
+    content: str = Form(None),
+    current_user: str = Depends(get_current_user)
+):
+    """Upload een bestand naar een chatroom met optionele tekst."""
+
+    # Check file size
+    file.file.seek(0, 2)  # Move to end of file
+    file_size = file.file.tell()
+    file.file.seek(0)  # Reset to beginning
+
+    _check_upload(file.content_type, file_size)
+
+    # Bestaan gebruiker en kamer? Vóór het wegschrijven, zodat een 404 niets kost
+    await db_executor.run(_get_user_and_room, current_user, room_slug)
+
+    # Save file: in blokken, nooit het hele bestand in het geheugen
+    temp_path = new_temp_path()
+    try:
+        file_size, sha256 = await run_in_threadpool(_copy_to_disk, file.file, temp_path)
+        created = await db_executor.run(
+            _store_attachment, current_user, room_slug, temp_path, sha256, file_size,
+            file.filename, file.content_type, content
+        )
+    except HTTPException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    except Exception as e:
+        temp_path.unlink(missing_ok=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to save file: {str(e)}"
+        )
+
+    return await _publish_attachment(room_slug, created)
+
+
+# --- HERVATBARE UPLOADS ---
+#
+# 1. POST /rooms/{room_slug}/uploads          -> upload_id
+# 2. PUT  /uploads/{upload_id}?offset=<n>     -> ruwe bytes vanaf offset n (herhalen)
+#    GET  /uploads/{upload_id}                -> huidige offset, om na een storing te hervatten
+# 3. POST /uploads/{upload_id}/complete       -> bericht + bijlage
+
+class UploadInit(BaseModel):
+    filename: str
+    content_type: str
+    size: int
+    # Als de client de SHA-256 al kent en die inhoud al kan zien, is de upload meteen klaar
+    sha256: Optional[str] = None
+    content: Optional[str] = None
+
+
+class UploadComplete(BaseModel):
+    content: Optional[str] = None
+    sha256: Optional[str] = None  # optioneel: controleer de inhoud
+
+
+# Eén schrijver per upload-sessie tegelijk. Zwakke verwijzingen: een lock
+# verdwijnt zodra geen request hem meer vasthoudt, ook bij verlopen of
+# verlaten uploads die nooit complete_upload bereiken
+_upload_locks: "WeakValueDictionary[str, asyncio.Lock]" = WeakValueDictionary()
+
+
+def _get_upload_session(upload_id: str, current_user: str) -> UploadSession:
+    session = upload_sessions.get(upload_id)
+    if session is None or session.username != current_user:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+
+def _upload_status(session: UploadSession) -> dict:
+    return {
+        "upload_id": session.upload_id,
+        "offset": session.offset,
+        "size": session.size,
+        "chunk_size": UPLOAD_CHUNK_SIZE
+    }
+
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as source:
+        for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _attach_known_blob(
+    db: Session,
+    username: str,
+    room_slug: str,
+    sha256: str,
+    size: int,
+    original_filename: str,
+    content_type: str,
+    message_text: Optional[str]
+):
+    """
+    Plaats een bijlage voor bestaande inhoud zonder bytes te ontvangen (via db_executor).
+
+    Een sha256 van de client bewijst niet dat hij de inhoud heeft; dit mag
+    dus alleen voor blobs die de gebruiker al via een bijlage kan zien.
+    Anders None, net als bij onbekende inhoud, en volgt een gewone upload.
+    """
+    user, room = _get_user_and_room(db, username, room_slug)
+    blob = find_blob(db, sha256, size)
+    if blob is None or not _can_access_blob(db, user.id, blob):
+        return None
+    return _create_attachment(
+        db, user, room, room_slug, blob, original_filename,
+        content_type, message_text, deduplicated=True
+    )
+
+
+@router.post("/rooms/{room_slug}/uploads", status_code=status.HTTP_201_CREATED)
+async def init_upload(
+    room_slug: str,
+    upload: UploadInit,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Start een hervatbare upload. Kan de gebruiker de inhoud met de opgegeven
+    sha256 al zien, dan wordt de bijlage direct geplaatst en hoeven er geen
+    bytes verstuurd te worden.
+    """
+    _check_upload(upload.content_type, upload.size)
+
+    if upload.sha256:
+        created = await db_executor.run(
+            _attach_known_blob, current_user, room_slug, upload.sha256, upload.size,
+            upload.filename, upload.content_type, upload.content
+        )
+        if created is not None:
+            result = await _publish_attachment(room_slug, created)
+            return {**result, "complete": True}
+    else:
+        await db_executor.run(_get_user_and_room, current_user, room_slug)
+
+    session = upload_sessions.create(current_user, room_slug, upload.filename, upload.content_type, upload.size)
+    return {**_upload_status(session), "complete": False}
+
+
+@router.get("/uploads/{upload_id}")
+async def get_upload_status(upload_id: str, current_user: str = Depends(get_current_user)):
+    """Hoeveel bytes van een upload al binnen zijn."""
+    return _upload_status(_get_upload_session(upload_id, current_user))
+
+
+@router.put("/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Schrijf een blok ruwe bytes vanaf `offset`, die gelijk moet zijn aan de
+    huidige offset van de upload. De body wordt direct naar schijf gestreamd.
+    """
+    session = _get_upload_session(upload_id, current_user)
+    lock = _upload_locks.setdefault(upload_id, asyncio.Lock())
+
+    async with lock:
+        # Tijdens het wachten kan de upload afgerond of verlopen zijn; niet opnieuw aanmaken
+        session = _get_upload_session(upload_id, current_user)
+        current = session.offset
+        if offset != current:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail={"message": "Offset mismatch", "offset": current}
+            )
+
+        written = current
+        with session.part_path.open("ab") as buffer:
+            async for piece in request.stream():
+                written += len(piece)
+                if written > session.size:
+                    # Alles van dit blok terugdraaien; de client hervat vanaf `current`
+                    buffer.truncate(current)
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail="Chunk exceeds the declared upload size"
+                    )
+                await run_in_threadpool(buffer.write, piece)
+
+    return _upload_status(session)
+
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_upload(
+    upload_id: str,
+    completion: UploadComplete,
+    current_user: str = Depends(get_current_user)
+):
+    """Rond een upload af: controleer grootte (en hash) en plaats het bestand in de kamer."""
+    session = _get_upload_session(upload_id, current_user)
+    lock = _upload_locks.setdefault(upload_id, asyncio.Lock())
+
+    async with lock:
+        session = _get_upload_session(upload_id, current_user)
+        if session.offset != session.size:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail={"message": "Upload incomplete", "offset": session.offset}
+            )
+
+        sha256 = await run_in_threadpool(_hash_file, session.part_path)
+        if completion.sha256 and completion.sha256.lower() != sha256:
+            upload_sessions.delete(session)
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Checksum mismatch")
+
+        created = await db_executor.run(
+            _store_attachment, current_user, session.room_slug, session.part_path, sha256, session.size,
+            session.filename, session.content_type, completion.content
+        )
+        upload_sessions.delete(session)
+
+    return await _publish_attachment(session.room_slug, created)
+
+
+# --- DOWNLOADS ---
+
+class AttachmentResponse(FileResponse):
+    """
+    FileResponse (Range, If-Range, pathsend) die telt hoeveel bytes er echt
+    verstuurd zijn, ook bij een afgebroken download, en dat na afloop meldt.
+    """
+    chunk_size = ATTACHMENT_CHUNK_SIZE
+
+    def __init__(self, *args, on_complete: Callable[[int], None], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_complete = on_complete
+
+    async def __call__(self, scope, receive, send):
+        sent = 0
+
+        async def counting_send(message):
+            nonlocal sent
+            if message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif message["type"] == "http.response.pathsend":
+                sent += os.stat(message["path"]).st_size
+            await send(message)
+
+        try:
+            await super().__call__(scope, receive, counting_send)
+        finally:
+            self.on_complete(sent)
+
+
+def _can_access_attachment(db: Session, user_id: int, attachment: FileAttachment) -> bool:
+    if attachment.user_id == user_id:
+        return True
+    room = attachment.message.room if attachment.message else None
+    if room is None:
+        return False
+    if room.slug in PUBLIC_ROOMS:
+        return True
+    return db.query(RoomMember.id).filter(
+        RoomMember.room_id == room.id,
+        RoomMember.user_id == user_id
+    ).first() is not None
+
+
+def _can_access_blob(db: Session, user_id: int, blob: FileBlob) -> bool:
+    """Kan de gebruiker deze inhoud al downloaden via een van de bijlagen die ernaar wijzen?"""
+    attachments = db.query(FileAttachment).options(
+        joinedload(FileAttachment.message).joinedload(Message.room)
+    ).filter(FileAttachment.blob_id == blob.id)
+    return any(_can_access_attachment(db, user_id, attachment) for attachment in attachments)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Zwakke vergelijking, zoals RFC 9110 voorschrijft voor If-None-Match
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
+
+
+def _get_accessible_attachment(db: Session, attachment_id: int, principal: Principal) -> FileAttachment:
+    attachment = db.query(FileAttachment).options(
+        joinedload(FileAttachment.message).joinedload(Message.room),
+        joinedload(FileAttachment.blob)
+    ).filter(FileAttachment.id == attachment_id).first()
+
+    # Geen onderscheid tussen "bestaat niet" en "geen toegang"
+    if not attachment or not _can_access_attachment(db, principal.user_id, attachment):
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    return attachment
+
+
+@router.api_route("/attachments/{attachment_id}", methods=["GET", "HEAD"])
+def download_attachment(
+    attachment_id: int,
+    request: Request,
+    db: Session = Depends(get_read_db),
+    principal: Principal = Depends(get_current_principal_from_header_or_query)
+):
+    """
+    Download een bijlage, alleen voor leden van de kamer.
+
+    Ondersteunt Range (seeken in video/audio), een sterke ETag op de SHA-256
+    met If-None-Match, en onveranderlijke caching. Token via de
+    Authorization-header of ?token=, zodat <img>/<video> het ook kunnen.
+    """
+    attachment = _get_accessible_attachment(db, attachment_id, principal)
+
+    if attachment.blob is not None:
+        path = Path(attachment.blob.storage_path)
+        etag = f'"{attachment.blob.sha256}"'
+    else:
+        # Upload van vóór de blob store: uuid-naam, dus ook onveranderlijk
+        path = Path(attachment.file_path.lstrip("/"))
+        etag = f'"{Path(attachment.filename).stem}"'
+    db.close()
+
+    try:
+        stat_result = path.stat()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Attachment file missing")
+
+    disposition = "inline" if attachment.content_type.startswith(INLINE_CONTENT_PREFIXES) else "attachment"
+    headers = {
+        "etag": etag,
+        "cache-control": ATTACHMENT_CACHE_CONTROL,
+        "content-disposition": f"{disposition}; filename*=utf-8''{quote(attachment.original_filename)}",
+        "x-content-type-options": "nosniff",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    def account(nbytes: int):
+        bandwidth_meter.record(principal.username, attachment_id, nbytes)
+
+    if ATTACHMENT_ACCEL_REDIRECT:
+        # nginx doet Range en sendfile; wij tellen het hele bestand als bovengrens
+        headers["x-accel-redirect"] = ATTACHMENT_ACCEL_REDIRECT.rstrip("/") + "/" + path.as_posix()
+        if request.method == "GET":
+            account(stat_result.st_size)
+        return Response(headers=headers, media_type=attachment.content_type)
+
+    return AttachmentResponse(
+        path,
+        headers=headers,
+        media_type=attachment.content_type,
+        stat_result=stat_result,
+        on_complete=account
+    )
+
+
+@router.get("/attachments/{attachment_id}/thumbnail")
+def download_thumbnail(
+    attachment_id: int,
+    request: Request,
+    db: Session = Depends(get_read_db),
+    principal: Principal = Depends(get_current_principal_from_header_or_query)
+):
+    """Verkleinde WebP-versie van een afbeelding, voor de preview in de chat."""
+    attachment = _get_accessible_attachment(db, attachment_id, principal)
+    if attachment.blob is None or attachment.blob.thumbnail_path is None:
+        raise HTTPException(status_code=404, detail="No thumbnail for this attachment")
+    path = Path(attachment.blob.thumbnail_path)
+    etag = f'"{attachment.blob.sha256}-thumb"'
+    db.close()
+
+    headers = {"etag": etag, "cache-control": ATTACHMENT_CACHE_CONTROL, "x-content-type-options": "nosniff"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return AttachmentResponse(
+        path,
+        headers=headers,
+        media_type="image/webp",
+        on_complete=lambda nbytes: bandwidth_meter.record(principal.username, attachment_id, nbytes)
+    )
+
+
+@router.get("/metrics/bandwidth")
+async def get_bandwidth_stats(current_user: str = Depends(get_current_user)):
+    """Verstuurde bytes per gebruiker voor bijlage-downloads."""
+    return bandwidth_meter.stats()
 
 
 @router.get("/rooms/{room_slug}/search")
-async def search_messages(
+def search_messages(
     room_slug: str,
     q: str,
-    db: Session = Depends(get_db),
+    limit: int = Query(20, ge=1, le=MAX_SEARCH_PAGE),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_read_db),
     current_user: str = Depends(get_current_user)
 ):
-    """Zoek berichten in een specifieke chatroom."""
+    """
+    Zoek berichten in een specifieke chatroom.
+
+    Resultaten staan op relevantie; het laatste woord telt als prefix
+    ("verg" vindt "vergadering"). `snippet` bevat de treffers in <mark>-tags.
+    Pagineer met `offset`/`limit`.
+    """
 
     if not q or len(q.strip()) < 2:
         raise HTTPException(
@@ -183,31 +667,15 @@ async def search_messages(
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
 
-    # Search messages
-    search_term = f"%{q}%"
-    messages = (
-        db.query(Message)
-        .join(User, Message.user_id == User.id)
-        .filter(Message.room_id == room.id)
-        .filter(Message.content.ilike(search_term))
-        .filter(Message.is_deleted == False)
-        .order_by(Message.timestamp.desc())
-        .limit(50)
-        .all()
-    )
-
-    results = []
-    for msg in messages:
-        results.append({
-            "id": msg.id,
-            "content": msg.content,
-            "username": msg.sender.username,
-            "avatar_url": msg.sender.avatar_url,
-            "timestamp": msg.timestamp.isoformat()
-        })
+    # Eén extra resultaat ophalen om te weten of er een volgende pagina is
+    results = chat_crud.search_room_messages(db, room.id, q.strip(), limit=limit + 1, offset=offset)
+    has_more = len(results) > limit
+    results = results[:limit]
 
     return {
         "query": q,
         "count": len(results),
+        "offset": offset,
+        "next_offset": offset + limit if has_more else None,
         "results": results
     }
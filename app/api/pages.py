@@ -2,9 +2,9 @@ from fastapi import APIRouter, Request, Depends
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 from sqlalchemy.orm import Session
-from app.database.database import get_db
+from app.database.database import get_read_db
 from app.models.user import User
-from app.services.connection_manager import manager
+from app.services.presence import presence
 
 router = APIRouter(tags=["Pages"])
 
@@ -39,14 +39,17 @@ async def direct_messages_page(request: Request):
 
 
 @router.get("/api/users/online")
-async def get_online_users(db: Session = Depends(get_db)):
+def get_online_users(db: Session = Depends(get_read_db)):
     """Get list of online users with their status."""
-    online_usernames = manager.get_online_users()
-    users = db.query(User).all()
+    # Alleen de online gebruikers uit de presence-spiegel, niet de hele users-tabel
+    online_usernames = presence.online_users()
+    if not online_usernames:
+        return []
+    users = db.query(User).filter(User.username.in_(online_usernames)).all()
 
     return [{
         "username": user.username,
         "avatar_url": user.avatar_url,
-        "is_online": user.username in online_usernames,
+        "is_online": True,
         "last_seen": user.last_seen.isoformat() if user.last_seen else None
     } for user in users]
@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
 from sqlalchemy.orm import Session
 from typing import Optional
-from app.database.database import get_db
+from app.database.database import get_db, get_read_db
 from app.models.user import User
 from app.auth.security import get_current_user
 from app.api.schemas import UserBase
+from app.services.message_cache import message_cache
+from app.auth.token_cache import token_cache
 from pydantic import BaseModel
 import shutil
 import os
@@ -31,8 +33,8 @@ class UserProfile(BaseModel):
 
 
 @router.get("/profile/me", response_model=UserProfile)
-async def get_my_profile(
-    db: Session = Depends(get_db),
+def get_my_profile(
+    db: Session = Depends(get_read_db),
     current_user: str = Depends(get_current_user)
 ):
     """Haal het profiel van de ingelogde gebruiker op."""
@@ -43,7 +45,7 @@ async def get_my_profile(
 
 
 @router.get("/profile/{username}", response_model=UserProfile)
-async def get_user_profile(username: str, db: Session = Depends(get_db)):
+def get_user_profile(username: str, db: Session = Depends(get_read_db)):
     """Haal het profiel van een specifieke gebruiker op."""
     user = db.query(User).filter(User.username == username).first()
     if not user:
@@ -52,7 +54,7 @@ async def get_user_profile(username: str, db: Session = Depends(get_db)):
 
 
 @router.put("/profile/settings")
-async def update_settings(
+def update_settings(
     settings: UserSettings,
     db: Session = Depends(get_db),
     current_user: str = Depends(get_current_user)
@@ -69,12 +71,13 @@ async def update_settings(
 
     db.commit()
     db.refresh(user)
+    token_cache.invalidate_user(user.username)
 
     return {"message": "Settings updated successfully", "user": UserProfile.from_orm(user)}
 
 
 @router.post("/profile/avatar")
-async def upload_avatar(
+def upload_avatar(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
     current_user: str = Depends(get_current_user)
@@ -107,6 +110,10 @@ async def upload_avatar(
     db.commit()
     db.refresh(user)
 
+    # Gecachte berichten en tokens bevatten de oude avatar_url
+    message_cache.invalidate()
+    token_cache.invalidate_user(user.username)
+
     return {"message": "Avatar uploaded successfully", "avatar_url": user.avatar_url}
 
 
@@ -115,7 +122,7 @@ class PublicKeyRequest(BaseModel):
 
 
 @router.post("/profile/public-key")
-async def store_public_key(
+def store_public_key(
     request: PublicKeyRequest,
     db: Session = Depends(get_db),
     current_user: str = Depends(get_current_user)
@@ -130,7 +137,7 @@ async def store_public_key(
     return {"message": "Public key stored successfully"}
 
 @router.get("/profile/{username}/public-key")
-async def get_public_key(username: str, db: Session = Depends(get_db)):
+def get_public_key(username: str, db: Session = Depends(get_read_db)):
     """Get a user's public key for E2E encryption."""
     user = db.query(User).filter(User.username == username).first()
     if not user:
@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from typing import List
-from app.database.database import get_db
+from app.database.database import get_db, get_read_db
 from app.models.room import Room
 from app.models.room_member import RoomMember
 from app.models.user import User
-from app.auth.security import get_current_user
+from app.auth.security import get_current_user, get_current_principal
+from app.auth.token_cache import Principal
+from app.services.message_cache import message_cache
 from pydantic import BaseModel
 
 router = APIRouter(tags=["Rooms"])
@@ -27,20 +29,15 @@ class RoomInfo(BaseModel):
 
 @router.get("/rooms", response_model=List[RoomInfo])
 def get_all_rooms(
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
+    db: Session = Depends(get_read_db),
+    user: Principal = Depends(get_current_principal)
 ):
     """Haal alle chat kamers op waar de gebruiker lid van is."""
-    # Get user
-    user = db.query(User).filter(User.username == current_user).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
     # Get default public rooms (general and dev-team)
     default_rooms = db.query(Room).filter(Room.slug.in_(['general', 'dev-team'])).all()
 
     # Get rooms where user is a member
-    room_memberships = db.query(RoomMember).filter(RoomMember.user_id == user.id).all()
+    room_memberships = db.query(RoomMember).filter(RoomMember.user_id == user.user_id).all()
     member_rooms = [membership.room for membership in room_memberships]
 
     # Combine default rooms with member rooms (avoid duplicates)
@@ -137,7 +134,7 @@ def invite_user_to_room(
 @router.get("/rooms/{room_slug}/members")
 def get_room_members(
     room_slug: str,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user = Depends(get_current_user)
 ):
     """Haal alle members van een room op."""
@@ -166,5 +163,6 @@ def delete_room(
 
     db.delete(room)
     db.commit()
+    message_cache.invalidate(room_slug)
 
     return {"message": f"Room '{room.name}' deleted successfully"}
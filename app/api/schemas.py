@@ -29,6 +29,11 @@ class FileAttachmentDisplay(BaseModel):
     file_path: str
     file_size: int
     content_type: str
+    # Alleen voor afbeeldingen, zodra de thumbnail-pipeline klaar is
+    thumbnail_url: Optional[str] = None
+    placeholder: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -66,6 +71,18 @@ class DirectMessageDisplay(BaseModel):
         from_attributes = True
 
 
+class ConversationSummary(BaseModel):
+    peer_username: str
+    peer_avatar_url: Optional[str] = None
+    last_message_id: int
+    last_message_snippet: Optional[str] = None  # None bij een versleuteld bericht
+    last_message_at: Optional[datetime] = None
+    unread_count: int
+
+    class Config:
+        from_attributes = True
+
+
 # User list schema
 class UserInfo(BaseModel):
     username: str
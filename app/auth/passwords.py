@@ -0,0 +1,147 @@
+"""
+bcrypt in een aparte, begrensde procespool.
+
+Eén bcrypt-hash kost bij de standaard cost honderden milliseconden CPU. In de
+gedeelde threadpool zou een golf logins alle andere sync routes laten
+wachten (en door de GIL ook de event loop); daarom draait al het
+wachtwoordwerk in een eigen ProcessPoolExecutor. Staan er al
+PASSWORD_MAX_PENDING opdrachten klaar, dan weigert de pool nieuwe met
+PasswordPoolSaturated, wat de routes als 429 teruggeven.
+
+Verandert BCRYPT_ROUNDS, dan worden wachtwoorden bij de eerstvolgende
+geslaagde login opnieuw gehasht met de nieuwe cost (zie needs_rehash).
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Deque, Optional
+import asyncio
+import os
+import time
+
+import bcrypt
+
+from app.services.metrics import percentiles
+
+# bcrypt cost factor voor nieuwe hashes
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+# Aantal processen voor wachtwoordwerk
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Maximaal aantal wachtende + lopende opdrachten; daarboven 429
+PASSWORD_MAX_PENDING = int(os.environ.get("PASSWORD_MAX_PENDING", str(PASSWORD_WORKERS * 8)))
+
+SAMPLE_SIZE = 1024
+
+
+def _encode(password: str) -> bytes:
+    # Bcrypt heeft een limiet van 72 bytes voor wachtwoorden
+    return password.encode('utf-8')[:72]
+
+
+def hash_password_sync(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    """Wachtwoord hashen met bcrypt (blokkerend)."""
+    return bcrypt.hashpw(_encode(password), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+
+def verify_password_sync(plain_password: str, hashed_password: str) -> bool:
+    """Wachtwoord verifiëren (blokkerend)."""
+    return bcrypt.checkpw(_encode(plain_password), hashed_password.encode('utf-8'))
+
+
+def needs_rehash(hashed_password: str, rounds: int = BCRYPT_ROUNDS) -> bool:
+    """True als de hash met een andere cost gemaakt is dan BCRYPT_ROUNDS."""
+    try:
+        # $2b$<cost>$<salt+hash>
+        return int(hashed_password.split("$")[2]) != rounds
+    except (IndexError, ValueError):
+        return True
+
+
+def _timed(fn, *args):
+    """Draait in het werkproces; geeft ook de looptijd terug."""
+    started = time.perf_counter()
+    return fn(*args), time.perf_counter() - started
+
+
+class PasswordPoolSaturated(Exception):
+    """Er staan al te veel wachtwoordopdrachten in de rij."""
+
+
+class PasswordHasher:
+    def __init__(self, max_workers: int = PASSWORD_WORKERS, max_pending: int = PASSWORD_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        # Pas bij het eerste gebruik starten, niet al bij het importeren
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.pending = 0
+        self.max_pending_seen = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.wait_samples: Deque[float] = deque(maxlen=SAMPLE_SIZE)
+        self.run_samples: Deque[float] = deque(maxlen=SAMPLE_SIZE)
+
+    async def _submit(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordPoolSaturated()
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+
+        self.pending += 1
+        self.max_pending_seen = max(self.max_pending_seen, self.pending)
+        submitted = time.perf_counter()
+        try:
+            result, run_time = await asyncio.get_running_loop().run_in_executor(self._pool, _timed, fn, *args)
+        finally:
+            self.pending -= 1
+
+        self.completed += 1
+        self.run_samples.append(run_time)
+        self.wait_samples.append(max(0.0, time.perf_counter() - submitted - run_time))
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(hash_password_sync, password, BCRYPT_ROUNDS)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._submit(verify_password_sync, plain_password, hashed_password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str):
+        """
+        Verifieer, en geef bij een hash met een verouderde cost ook een nieuwe hash terug.
+
+        Geeft (geldig, nieuwe_hash_of_None). Is de pool vol, dan wordt het
+        opnieuw hashen overgeslagen; dat gebeurt dan bij een volgende login.
+        """
+        if not await self.verify(plain_password, hashed_password):
+            return False, None
+        if not needs_rehash(hashed_password):
+            return True, None
+        try:
+            new_hash = await self.hash(plain_password)
+        except PasswordPoolSaturated:
+            return True, None
+        self.rehashed += 1
+        return True, new_hash
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "rounds": BCRYPT_ROUNDS,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "max_pending_seen": self.max_pending_seen,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "queue_wait": percentiles(self.wait_samples),
+            "run_time": percentiles(self.run_samples),
+        }
+
+
+password_hasher = PasswordHasher()
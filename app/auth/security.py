@@ -1,11 +1,15 @@
 # app/auth/security.py
-import bcrypt
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import jwt, JWTError
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
 from app.api.schemas import UserBase # <-- IMPORT SCHEMAS VANUIT API MAP
+from app.auth.passwords import hash_password_sync, verify_password_sync
+from app.auth.token_cache import Principal, token_cache
+from app.database.database import ReadSessionLocal
+from app.models.user import User
+from starlette.concurrency import run_in_threadpool
 
 # Authenticatie instellingen
 SECRET_KEY = "MIJN_ULTRA_GEHEIME_SLEUTEL" # VERANDER DIT!
@@ -13,21 +17,16 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token") # Token endpoint
+# Zelfde schema, maar zonder automatische 401: de token mag ook als query-parameter komen
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token", auto_error=False)
 
 def hash_password(password: str) -> str:
-    """Wachtwoord hashen met bcrypt."""
-    # Bcrypt heeft een limiet van 72 bytes voor wachtwoorden
-    # We truncaten het wachtwoord zodat het niet langer is dan 72 bytes
-    password_bytes = password.encode('utf-8')[:72]
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password_bytes, salt)
-    return hashed.decode('utf-8')
+    """Wachtwoord hashen met bcrypt (blokkerend; routes gebruiken password_hasher.hash)."""
+    return hash_password_sync(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Wachtwoord verifiëren."""
-    # Truncate password to 72 bytes
-    password_bytes = plain_password.encode('utf-8')[:72]
-    return bcrypt.checkpw(password_bytes, hashed_password.encode('utf-8'))
+    """Wachtwoord verifiëren (blokkerend; routes gebruiken password_hasher.verify)."""
+    return verify_password_sync(plain_password, hashed_password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Genereer een JWT-token."""
@@ -41,19 +40,72 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-# Dependency om de actieve gebruiker op te halen via JWT
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+def _load_principal(username: str) -> Optional[Principal]:
+    db = ReadSessionLocal()
+    try:
+        user = db.query(User).filter(User.username == username).first()
+        if user is None:
+            return None
+        return Principal(
+            user_id=user.id,
+            username=user.username,
+            avatar_url=user.avatar_url,
+            is_active=user.is_active,
+            theme_preference=user.theme_preference,
+            notifications_enabled=user.notifications_enabled,
+        )
+    finally:
+        db.close()
+
+async def resolve_principal(token: Optional[str]) -> Optional[Principal]:
+    """
+    Token -> Principal, of None als de token ongeldig is of de gebruiker niet bestaat.
+
+    Meestal een cache-hit: geen handtekeningcontrole en geen databasequery.
+    """
+    if not token:
+        return None
+    principal = token_cache.get(token)
+    if principal is not None:
+        return principal
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        return None
+    username = payload.get("sub")
+    if username is None:
+        return None
+
+    generation = token_cache.generation(username)
+    principal = await run_in_threadpool(_load_principal, username)
+    if principal is None:
+        return None
+    token_cache.put(token, principal, payload.get("exp"), generation)
+    return principal
+
+async def _require_principal(token: Optional[str]) -> Principal:
+    principal = await resolve_principal(token)
+    if principal is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return principal
+
+# Dependency voor routes die meer nodig hebben dan de gebruikersnaam (id, avatar, ...)
+async def get_current_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    return await _require_principal(token)
+
+# Dependency om de actieve gebruiker op te halen via JWT
+async def get_current_user(principal: Principal = Depends(get_current_principal)) -> str:
+    return principal.username
 
-    return username
\ No newline at end of file
+# Voor URL's die de browser zelf opvraagt (<img src>, <video src>, downloadlinks),
+# waar geen Authorization-header meegestuurd kan worden: ?token=<jwt> mag ook
+async def get_current_principal_from_header_or_query(
+    header_token: Optional[str] = Depends(optional_oauth2_scheme),
+    token: Optional[str] = Query(None)
+) -> Principal:
+    return await _require_principal(header_token or token)
@@ -0,0 +1,107 @@
+"""
+Cache van geverifieerde JWT's.
+
+Elke geauthenticeerde call deed jwt.decode (HMAC-controle) en daarna meestal
+nog een User-query. De TokenCache onthoudt per token de opgeloste Principal
+tot de `exp` van de token (en hooguit AUTH_TOKEN_CACHE_TTL seconden, zodat
+een gedeactiveerde gebruiker niet eindeloos blijft hangen). Bij een
+profielwijziging gooit invalidate_user() alle tokens van die gebruiker weg.
+"""
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Set, Tuple
+import os
+import threading
+import time
+
+# Maximaal aantal tokens in de cache (LRU)
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", "10000"))
+# Maximale levensduur van een cache-entry in seconden, los van de exp van de token
+AUTH_TOKEN_CACHE_TTL = float(os.environ.get("AUTH_TOKEN_CACHE_TTL", "300"))
+
+
+class Principal(NamedTuple):
+    """De ingelogde gebruiker zoals routes hem nodig hebben, zonder databasesessie."""
+    user_id: int
+    username: str
+    avatar_url: Optional[str]
+    is_active: bool
+    theme_preference: Optional[str]
+    notifications_enabled: bool
+
+
+class TokenCache:
+    def __init__(self, max_size: int = AUTH_TOKEN_CACHE_SIZE, ttl: float = AUTH_TOKEN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[Principal, float]]" = OrderedDict()
+        self._tokens_by_user: Dict[str, Set[str]] = {}
+        # Per gebruiker opgehoogd bij invalidatie, zodat een lookup die al liep
+        # geen verouderde Principal meer in de cache kan zetten
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            principal, expires_at = entry
+            if expires_at <= time.time():
+                self._remove(token, principal.username)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return principal
+
+    def generation(self, username: str) -> int:
+        with self._lock:
+            return self._generations.get(username, 0)
+
+    def put(self, token: str, principal: Principal, exp: Optional[float], generation: int):
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, float(exp))
+        with self._lock:
+            if self._generations.get(principal.username, 0) != generation:
+                return
+            self._entries[token] = (principal, expires_at)
+            self._entries.move_to_end(token)
+            self._tokens_by_user.setdefault(principal.username, set()).add(token)
+            while len(self._entries) > self.max_size:
+                old_token, (old_principal, _) = self._entries.popitem(last=False)
+                self._forget(old_token, old_principal.username)
+
+    def invalidate_user(self, username: str):
+        """Na een profielwijziging: de volgende call van deze gebruiker leest opnieuw uit de database."""
+        with self._lock:
+            self._generations[username] = self._generations.get(username, 0) + 1
+            for token in self._tokens_by_user.pop(username, set()):
+                self._entries.pop(token, None)
+
+    def _remove(self, token: str, username: str):
+        self._entries.pop(token, None)
+        self._forget(token, username)
+
+    def _forget(self, token: str, username: str):
+        tokens = self._tokens_by_user.get(username)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[username]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+token_cache = TokenCache()
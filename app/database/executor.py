@@ -0,0 +1,90 @@
+"""
+Voert synchroon SQLAlchemy-werk uit buiten de event loop.
+
+Een commit op SQLite wacht op fsync; als dat op de event loop gebeurt,
+staan alle WebSockets in het proces zolang stil. async code roept daarom
+`await db_executor.run(functie, ...)` aan: de functie draait in een kleine,
+begrensde threadpool met een eigen sessie.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Optional
+import asyncio
+import os
+import time
+
+from app.database.database import SessionLocal
+from app.services.metrics import percentiles
+
+# Aantal threads voor databasewerk; meer gelijktijdige calls wachten in de rij
+DB_EXECUTOR_WORKERS = int(os.environ.get("DB_EXECUTOR_WORKERS", "4"))
+
+# Hoe vaak de event-loop-vertraging gemeten wordt (seconden)
+LOOP_LAG_INTERVAL = 0.1
+
+SAMPLE_SIZE = 1024
+
+
+class DatabaseExecutor:
+    """
+    Begrensde threadpool voor databasewerk, met metingen.
+
+    Naast wachttijd en looptijd van elke call meet hij de vertraging van de
+    event loop zelf: zolang die laag blijft terwijl commits traag zijn, is
+    het versturen van berichten niet meer gekoppeld aan de commit-latentie.
+    """
+    def __init__(self, max_workers: int = DB_EXECUTOR_WORKERS):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+        self.pending = 0
+        self.completed = 0
+        self.wait_samples: Deque[float] = deque(maxlen=SAMPLE_SIZE)
+        self.run_samples: Deque[float] = deque(maxlen=SAMPLE_SIZE)
+        self.loop_lag_samples: Deque[float] = deque(maxlen=SAMPLE_SIZE)
+        self._lag_task: Optional[asyncio.Task] = None
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Voer fn(db, *args, **kwargs) uit in een databasethread met een eigen sessie."""
+        loop = asyncio.get_running_loop()
+        if self._lag_task is None or self._lag_task.done():
+            self._lag_task = loop.create_task(self._measure_loop_lag())
+
+        def call():
+            started = time.perf_counter()
+            db = SessionLocal()
+            try:
+                return fn(db, *args, **kwargs), started
+            finally:
+                db.close()
+
+        submitted = time.perf_counter()
+        self.pending += 1
+        try:
+            result, started = await loop.run_in_executor(self._pool, call)
+        finally:
+            self.pending -= 1
+        finished = time.perf_counter()
+
+        self.completed += 1
+        self.wait_samples.append(started - submitted)
+        self.run_samples.append(finished - started)
+        return result
+
+    async def _measure_loop_lag(self):
+        while True:
+            expected = time.perf_counter() + LOOP_LAG_INTERVAL
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.loop_lag_samples.append(max(0.0, time.perf_counter() - expected))
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "pending": self.pending,
+            "completed": self.completed,
+            "queue_wait": percentiles(self.wait_samples),
+            "run_time": percentiles(self.run_samples),
+            "loop_lag": percentiles(self.loop_lag_samples),
+        }
+
+
+db_executor = DatabaseExecutor()
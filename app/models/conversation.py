@@ -0,0 +1,30 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from app.database.database import Base
+
+class Conversation(Base):
+    """
+    Leesstatus van één gesprek, gezien vanuit één gebruiker (owner) met een ander (peer).
+
+    last_read_message_id is het watermerk: alle berichten van peer aan owner
+    met een id tot en met dit id zijn gelezen. unread_count wordt bij elk
+    nieuw bericht opgehoogd en bij het lezen in dezelfde UPDATE herberekend.
+    De last_message_*-kolommen vatten het laatste bericht (in beide
+    richtingen) samen voor de inbox.
+    """
+    __tablename__ = "conversations"
+    __table_args__ = (
+        Index("ix_conversations_owner_peer", "owner_id", "peer_id", unique=True),
+        # Inbox: gesprekken van een gebruiker, nieuwste eerst
+        Index("ix_conversations_owner_last_message", "owner_id", "last_message_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    peer_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    last_read_message_id = Column(Integer, default=0, nullable=False)
+    unread_count = Column(Integer, default=0, nullable=False)
+
+    # Het laatste bericht in het gesprek, voor de inbox
+    last_message_id = Column(Integer, nullable=True)
+    last_message_snippet = Column(String, nullable=True)  # NULL als het bericht versleuteld is
+    last_message_at = Column(DateTime(timezone=True), nullable=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database.database import Base
@@ -6,11 +6,15 @@ from app.database.database import Base
 class DirectMessage(Base):
     """Database model voor directe berichten tussen gebruikers."""
     __tablename__ = "direct_messages"
+    __table_args__ = (
+        # Keyset-paginering van een gesprek: één index-seek per richting op (timestamp, id)
+        Index("ix_direct_messages_pair_timestamp_id", "sender_id", "receiver_id", "timestamp", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     content = Column(String, nullable=False)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
-    is_read = Column(Boolean, default=False)
+    is_read = Column(Boolean, default=False)  # niet meer bijgehouden; leesstatus staat in conversations
 
     # Foreign Keys
     sender_id = Column(Integer, ForeignKey("users.id"))
@@ -1,6 +1,7 @@
 from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, BigInteger
 from sqlalchemy.orm import relationship
 from app.database.database import Base
+from app.models.file_blob import FileBlob
 from datetime import datetime
 
 class FileAttachment(Base):
@@ -17,7 +18,28 @@ class FileAttachment(Base):
     # Foreign keys
     message_id = Column(Integer, ForeignKey("messages.id"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    blob_id = Column(Integer, ForeignKey("file_blobs.id"), nullable=True, index=True)  # NULL voor oude uploads
 
     # Relationships
     message = relationship("Message", back_populates="attachments")
     uploader = relationship("User")
+    blob = relationship(FileBlob)
+
+    # Derivaten van de (gedeelde) blob, voor FileAttachmentDisplay
+    @property
+    def thumbnail_url(self):
+        if self.blob is None or self.blob.thumbnail_path is None:
+            return None
+        return f"/api/attachments/{self.id}/thumbnail"
+
+    @property
+    def placeholder(self):
+        return self.blob.placeholder if self.blob is not None else None
+
+    @property
+    def width(self):
+        return self.blob.width if self.blob is not None else None
+
+    @property
+    def height(self):
+        return self.blob.height if self.blob is not None else None
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, String, DateTime, BigInteger
+from app.database.database import Base
+from datetime import datetime
+
+class FileBlob(Base):
+    """Eén opgeslagen bestandsinhoud, gedeeld door alle bijlagen met dezelfde SHA-256."""
+    __tablename__ = "file_blobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), unique=True, index=True, nullable=False)
+    size = Column(BigInteger, nullable=False)  # in bytes
+    storage_path = Column(String, nullable=False)  # onder BLOB_DIR, bv. data/blobs/ab/<sha256>.pdf
+    ref_count = Column(Integer, default=0, nullable=False)  # aantal bijlagen dat naar deze blob wijst
+
+    # Derivaten voor afbeeldingen (zie app/services/thumbnails.py); NULL tot ze gemaakt zijn
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    thumbnail_path = Column(String, nullable=True)
+    placeholder = Column(String, nullable=True)  # data-URI van een klein, vervaagd voorbeeld
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database.database import Base
@@ -6,9 +6,15 @@ from app.database.database import Base
 class Message(Base):
     """Database model voor een chatbericht."""
     __tablename__ = "messages"
+    __table_args__ = (
+        # Keyset-paginering van de geschiedenis per kamer op (timestamp, id)
+        Index("ix_messages_room_timestamp_id", "room_id", "timestamp", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     content = Column(String, nullable=False)
+    # Altijd door de database gezet (nooit in Python): de keyset-paginering sorteert
+    # op (timestamp, id) en mag geen twee klokken door elkaar krijgen
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
     edited_at = Column(DateTime(timezone=True), nullable=True)
     is_deleted = Column(Boolean, default=False)
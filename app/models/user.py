@@ -14,7 +14,7 @@ class User(Base):
     theme_preference = Column(String, default="dark")
     notifications_enabled = Column(Boolean, default=True)
     last_seen = Column(DateTime, default=datetime.utcnow)
-    is_online = Column(Boolean, default=False)
+    is_online = Column(Boolean, default=False)  # niet meer bijgewerkt: online-status komt uit app/services/presence.py
     public_key = Column(String, nullable=True)  # For E2E encryption
 
     # Relaties
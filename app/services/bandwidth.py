@@ -0,0 +1,50 @@
+"""
+Bandbreedte-boekhouding voor downloads van bijlagen.
+
+Elke afgeronde download meldt (gebruiker, bijlage, bytes) bij de
+BandwidthMeter. Die houdt totalen per gebruiker bij en roept daarna de
+geregistreerde hooks aan, bv. om quota af te dwingen of naar een extern
+meetsysteem te sturen. Hooks draaien na het versturen, dus een trage hook
+vertraagt de download zelf niet.
+"""
+from typing import Callable, Dict, List
+import threading
+
+# hook(username, attachment_id, nbytes)
+BandwidthHook = Callable[[str, int, int], None]
+
+
+class BandwidthMeter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.bytes_per_user: Dict[str, int] = {}
+        self.requests_per_user: Dict[str, int] = {}
+        self._hooks: List[BandwidthHook] = []
+
+    def register_hook(self, hook: BandwidthHook):
+        self._hooks.append(hook)
+
+    def record(self, username: str, attachment_id: int, nbytes: int):
+        with self._lock:
+            self.bytes_per_user[username] = self.bytes_per_user.get(username, 0) + nbytes
+            self.requests_per_user[username] = self.requests_per_user.get(username, 0) + 1
+        for hook in self._hooks:
+            try:
+                hook(username, attachment_id, nbytes)
+            except Exception as e:
+                print(f"[BandwidthMeter] Hook {hook!r} failed: {e}")
+
+    def stats(self, top: int = 20) -> dict:
+        with self._lock:
+            users = sorted(self.bytes_per_user.items(), key=lambda item: item[1], reverse=True)[:top]
+            return {
+                "total_bytes": sum(self.bytes_per_user.values()),
+                "total_requests": sum(self.requests_per_user.values()),
+                "top_users": [
+                    {"username": username, "bytes": nbytes, "requests": self.requests_per_user[username]}
+                    for username, nbytes in users
+                ],
+            }
+
+
+bandwidth_meter = BandwidthMeter()
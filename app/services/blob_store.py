@@ -0,0 +1,100 @@
+"""
+Content-addressed opslag voor bijlagen.
+
+Elke bestandsinhoud wordt één keer opgeslagen onder zijn SHA-256, in
+data/blobs/<eerste twee tekens>/<sha256><extensie>. Bijlagen
+verwijzen via blob_id naar die FileBlob; ref_count telt hoeveel bijlagen dat
+doen. Hetzelfde bestand in tien kamers kost dus maar één keer schijfruimte,
+en een upload waarvan de inhoud al bestaat schrijft niets weg. De blobs
+staan buiten static/: alleen GET /api/attachments/{id} geeft ze, na de
+toegangscontrole, vrij.
+
+Blobs zonder verwijzingen worden opgeruimd door gc_file_blobs.py.
+"""
+from pathlib import Path
+from typing import Optional
+import os
+import uuid
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.file_blob import FileBlob
+
+# Map voor blobs en hun thumbnails (niet onder /static, want niet publiek)
+BLOB_DIR = Path(os.environ.get("BLOB_DIR", "data/blobs"))
+# Bestanden die nog binnenkomen of gehasht worden, vóór ze hun definitieve naam krijgen
+BLOB_TMP_DIR = BLOB_DIR / "tmp"
+
+
+def blob_path(sha256: str, extension: str) -> Path:
+    return BLOB_DIR / sha256[:2] / f"{sha256}{extension.lower()}"
+
+
+def attachment_url(attachment_id: int) -> str:
+    """URL waaronder een bijlage (met toegangscontrole) te downloaden is."""
+    return f"/api/attachments/{attachment_id}"
+
+
+def new_temp_path() -> Path:
+    BLOB_TMP_DIR.mkdir(parents=True, exist_ok=True)
+    return BLOB_TMP_DIR / uuid.uuid4().hex
+
+
+def find_blob(db: Session, sha256: str, size: Optional[int] = None) -> Optional[FileBlob]:
+    """De blob met deze inhoud, als die al bestaat (en het bestand er nog is)."""
+    blob = db.query(FileBlob).filter(FileBlob.sha256 == sha256.lower()).first()
+    if blob is None or (size is not None and blob.size != size):
+        return None
+    if not Path(blob.storage_path).exists():
+        return None
+    return blob
+
+
+def store_blob(db: Session, sha256: str, size: int, extension: str) -> FileBlob:
+    """
+    Zoek of maak de blob-rij voor een volledig ontvangen, gehasht bestand.
+
+    De blob wordt geflusht maar niet gecommit; het bestand zelf blijft waar het
+    is tot de aanroeper na zijn commit place_blob() aanroept. Zo laat een
+    mislukte commit geen bestand achter in de blob-store waar geen rij bij hoort.
+    """
+    blob = db.query(FileBlob).filter(FileBlob.sha256 == sha256).first()
+    if blob is not None:
+        return blob
+
+    path = blob_path(sha256, extension)
+    blob = FileBlob(sha256=sha256, size=size, storage_path=path.as_posix(), ref_count=0)
+    try:
+        with db.begin_nested():
+            db.add(blob)
+    except IntegrityError:
+        # Tegelijk door een andere upload aangemaakt; het bestand is identiek
+        return db.query(FileBlob).filter(FileBlob.sha256 == sha256).one()
+    return blob
+
+
+def place_blob(blob: FileBlob, source: Path):
+    """
+    Zet `source` na de commit op de plek van de blob.
+
+    Staat het bestand er al (zelfde inhoud), dan wordt `source` weggegooid;
+    anders wordt hij verplaatst, wat ook een handmatig verwijderd bestand herstelt.
+    """
+    path = Path(blob.storage_path)
+    if path.exists():
+        source.unlink(missing_ok=True)
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    source.replace(path)
+
+
+def acquire_blob(db: Session, blob: FileBlob):
+    """Tel een nieuwe bijlage die naar `blob` wijst (atomair, in de lopende transactie)."""
+    db.execute(
+        update(FileBlob)
+        .where(FileBlob.id == blob.id)
+        .values(ref_count=FileBlob.ref_count + 1)
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,216 @@
+"""
+Pub/sub-backplane onder de ConnectionManager.
+
+Met één proces kent de ConnectionManager alle verbindingen. Draait de app met
+meerdere workers of containers, dan ziet elk proces maar een deel ervan; de
+broker verbindt ze. Elke node publiceert wat hij lokaal aflevert ook op een
+kanaal (room:<slug>, user:<naam>) en levert wat andere nodes publiceren af
+aan zijn eigen verbindingen. Gedeelde toestand, zoals de deelnemers van een
+call-room, staat in sets bij de broker.
+
+- InProcessBroker: de standaard, alles binnen één proces. Brokers die
+  dezelfde InProcessHub delen gedragen zich als losse nodes, handig om
+  meerdere nodes in één proces (bv. in een test) te draaien.
+- RedisBroker: via Redis pub/sub en sets, voor meerdere processen/machines.
+  Vereist het (optionele) `redis`-pakket.
+
+Kies met BROKER_URL, bv. `redis://localhost:6379/0`; leeg is in-process.
+"""
+from typing import Awaitable, Callable, Dict, Optional, Set
+import asyncio
+import os
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # optionele afhankelijkheid, alleen nodig voor RedisBroker
+    aioredis = None
+
+# Leeg of memory:// voor in-process; redis:// of rediss:// voor Redis
+BROKER_URL = os.environ.get("BROKER_URL", "")
+# Voorvoegsel voor kanalen en sleutels, zodat meerdere apps één Redis kunnen delen
+BROKER_PREFIX = os.environ.get("BROKER_PREFIX", "chatapp:")
+
+# callback(kanaal, bericht)
+MessageCallback = Callable[[str, str], Awaitable[None]]
+
+
+class Broker:
+    """
+    Interface van een broker. Berichten zijn strings; de ConnectionManager
+    bepaalt de inhoud (zie ConnectionManager.publish).
+    """
+
+    async def publish(self, channel: str, message: str):
+        raise NotImplementedError
+
+    def has_peers(self, channel: str) -> bool:
+        """
+        Kan een publish op dit kanaal een andere node bereiken? Zo niet, dan
+        slaat de ConnectionManager het coderen van de envelope over. Een broker
+        die het niet weet antwoordt True.
+        """
+        return True
+
+    async def subscribe(self, channel: str, callback: MessageCallback):
+        """Abonneer op een kanaal; een tweede subscribe op hetzelfde kanaal vervangt de callback."""
+        raise NotImplementedError
+
+    async def unsubscribe(self, channel: str):
+        raise NotImplementedError
+
+    async def set_add(self, key: str, member: str):
+        raise NotImplementedError
+
+    async def set_remove(self, key: str, member: str):
+        raise NotImplementedError
+
+    async def set_members(self, key: str) -> Set[str]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class InProcessHub:
+    """Het gedeelde 'netwerk' van InProcessBrokers: abonnees per kanaal en de sets."""
+    def __init__(self):
+        self.subscribers: Dict[str, Set["InProcessBroker"]] = {}
+        self.sets: Dict[str, Set[str]] = {}
+
+
+class InProcessBroker(Broker):
+    """
+    Broker binnen één proces.
+
+    Berichten gaan alleen naar de andere brokers op dezelfde hub (een node
+    krijgt zijn eigen berichten niet terug) en worden, net als bij Redis, per
+    broker in volgorde afgeleverd vanuit een eigen taak.
+    """
+    def __init__(self, hub: Optional[InProcessHub] = None):
+        self.hub = hub or InProcessHub()
+        self._callbacks: Dict[str, MessageCallback] = {}
+        self._inbox: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def publish(self, channel: str, message: str):
+        for broker in self.hub.subscribers.get(channel, ()):
+            if broker is not self:
+                broker._deliver(channel, message)
+
+    def has_peers(self, channel: str) -> bool:
+        # Met één node in het proces (de standaard) is er nooit een andere abonnee
+        return any(broker is not self for broker in self.hub.subscribers.get(channel, ()))
+
+    def _deliver(self, channel: str, message: str):
+        if self._inbox is None:
+            self._inbox = asyncio.Queue()
+            self._task = asyncio.create_task(self._pump())
+        self._inbox.put_nowait((channel, message))
+
+    async def _pump(self):
+        while True:
+            channel, message = await self._inbox.get()
+            callback = self._callbacks.get(channel)
+            if callback is None:
+                continue
+            try:
+                await callback(channel, message)
+            except Exception as e:
+                print(f"[InProcessBroker] Callback for {channel} failed: {e}")
+
+    async def subscribe(self, channel: str, callback: MessageCallback):
+        self._callbacks[channel] = callback
+        self.hub.subscribers.setdefault(channel, set()).add(self)
+
+    async def unsubscribe(self, channel: str):
+        self._callbacks.pop(channel, None)
+        subscribers = self.hub.subscribers.get(channel)
+        if subscribers is not None:
+            subscribers.discard(self)
+            if not subscribers:
+                del self.hub.subscribers[channel]
+
+    async def set_add(self, key: str, member: str):
+        self.hub.sets.setdefault(key, set()).add(member)
+
+    async def set_remove(self, key: str, member: str):
+        members = self.hub.sets.get(key)
+        if members is not None:
+            members.discard(member)
+            if not members:
+                del self.hub.sets[key]
+
+    async def set_members(self, key: str) -> Set[str]:
+        return set(self.hub.sets.get(key, ()))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self._inbox = None
+        for channel in list(self._callbacks):
+            await self.unsubscribe(channel)
+
+
+class RedisBroker(Broker):
+    """Broker via Redis: PUBLISH/SUBSCRIBE voor berichten, SADD/SREM/SMEMBERS voor sets."""
+    def __init__(self, url: str, prefix: str = BROKER_PREFIX):
+        if aioredis is None:
+            raise RuntimeError("RedisBroker vereist het 'redis'-pakket (pip install redis)")
+        self.prefix = prefix
+        self._redis = aioredis.from_url(url, decode_responses=True)
+        self._pubsub = self._redis.pubsub()
+        self._callbacks: Dict[str, MessageCallback] = {}
+        self._reader: Optional[asyncio.Task] = None
+
+    async def publish(self, channel: str, message: str):
+        await self._redis.publish(self.prefix + channel, message)
+
+    async def subscribe(self, channel: str, callback: MessageCallback):
+        self._callbacks[channel] = callback
+        await self._pubsub.subscribe(self.prefix + channel)
+        # listen() stopt zodra er geen abonnementen meer zijn; dan opnieuw starten
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self._read())
+
+    async def unsubscribe(self, channel: str):
+        self._callbacks.pop(channel, None)
+        await self._pubsub.unsubscribe(self.prefix + channel)
+
+    async def _read(self):
+        async for message in self._pubsub.listen():
+            if message["type"] != "message":
+                continue
+            channel = message["channel"][len(self.prefix):]
+            callback = self._callbacks.get(channel)
+            if callback is None:
+                continue
+            try:
+                await callback(channel, message["data"])
+            except Exception as e:
+                print(f"[RedisBroker] Callback for {channel} failed: {e}")
+
+    async def set_add(self, key: str, member: str):
+        await self._redis.sadd(self.prefix + key, member)
+
+    async def set_remove(self, key: str, member: str):
+        await self._redis.srem(self.prefix + key, member)
+
+    async def set_members(self, key: str) -> Set[str]:
+        return set(await self._redis.smembers(self.prefix + key))
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        await self._pubsub.aclose()
+        await self._redis.aclose()
+
+
+def create_broker(url: str = BROKER_URL) -> Broker:
+    """Broker op basis van BROKER_URL."""
+    if not url or url.startswith("memory://"):
+        return InProcessBroker()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroker(url)
+    raise ValueError(f"Unknown broker URL: {url}")
@@ -1,9 +1,18 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy.orm import Session, joinedload, selectinload, aliased
+from sqlalchemy import case, desc, func, select, tuple_, text, union_all, update, Integer, String, DateTime
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime
+import html
+import json
+import re
 from app.models.message import Message
+from app.models.conversation import Conversation
+from app.models.direct_message import DirectMessage
+from app.models.file_attachment import FileAttachment
 from app.models.room import Room
 from app.models.user import User
-from app.api.schemas import MessageDisplay
+from app.api.schemas import MessageDisplay, ReplyContext, FileAttachmentDisplay
+from app.services.message_cache import message_cache
 
 # --- HELPER FUNCTIES ---
 
@@ -11,6 +20,15 @@ def get_user_by_username(db: Session, username: str):
     """Haalt een gebruiker op basis van de gebruikersnaam."""
     return db.query(User).filter(User.username == username).first()
 
+def touch_last_seen(db: Session, username: str) -> bool:
+    """Werkt last_seen bij. Geeft False terug als de gebruiker niet bestaat."""
+    user = get_user_by_username(db, username)
+    if not user:
+        return False
+    user.last_seen = datetime.utcnow()
+    db.commit()
+    return True
+
 def get_room_by_slug(db: Session, room_slug: str):
     """Haalt een kamer op basis van de slug."""
     # We voegen de kamer toe als deze nog niet bestaat (voor de demo)
@@ -24,60 +42,111 @@ def get_room_by_slug(db: Session, room_slug: str):
 
 # --- CRUD FUNCTIES ---
 
-def get_message_history(db: Session, room_slug: str, limit: int = 50):
-    """Haalt de laatste N berichten uit een kamer op."""
-    room = get_room_by_slug(db, room_slug)
+# Maximaal aantal berichten per geschiedenispagina
+MAX_HISTORY_PAGE = 100
+# Lengte van de preview van het laatste bericht in de inbox
+SNIPPET_LENGTH = 100
+
+def display_load_options():
+    """
+    Laadopties voor alles wat message_to_display nodig heeft.
+
+    Een functie i.p.v. een constante: joinedload() configureert de mappers,
+    en dat mag pas als alle modellen geïmporteerd zijn.
+    """
+    return (
+        joinedload(Message.sender),
+        joinedload(Message.reply_to).joinedload(Message.sender),
+        selectinload(Message.attachments).joinedload(FileAttachment.blob),
+    )
+
+def message_to_display(msg: Message, room_slug: str) -> MessageDisplay:
+    """
+    Zet een Message om naar het schema voor de frontend.
+
+    Verwacht dat sender, reply_to.sender en attachments al geladen zijn
+    (zie get_message_history), anders valt elk veld terug op lazy loading.
+    """
+    reply_context = None
+    if msg.reply_to is not None:
+        reply_context = ReplyContext(
+            id=msg.reply_to.id,
+            username=msg.reply_to.sender.username,
+            content=msg.reply_to.content
+        )
+
+    attachments = [FileAttachmentDisplay.from_orm(att) for att in msg.attachments] if msg.attachments else []
+
+    # Handle binary content (from corrupted messages)
+    content = msg.content
+    if isinstance(content, bytes):
+        # Skip binary messages or convert to placeholder
+        content = "[Bestand - kan niet weergeven]"
+
+    return MessageDisplay(
+        id=msg.id,
+        content=content,
+        timestamp=msg.timestamp,
+        username=msg.sender.username,
+        room_slug=room_slug,
+        avatar_url=msg.sender.avatar_url,
+        reply_to=reply_context,
+        attachments=attachments
+    )
+
+def get_message_history(db: Session, room_slug: str, limit: int = 50, before: int = None, after: int = None):
+    """
+    Haalt een pagina berichten uit een kamer op, in chronologische volgorde.
+
+    Zonder cursor: de laatste `limit` berichten. Met `before`/`after` (een
+    bericht-id): de berichten direct voor of na dat bericht. Er wordt
+    gepagineerd op (timestamp, id) via de index ix_messages_room_timestamp_id,
+    dus ook diep terugscrollen blijft een index-seek in plaats van een OFFSET-scan.
+
+    Afzenders en geciteerde berichten komen mee in dezelfde query (JOIN),
+    bijlagen in één extra SELECT ... IN; het aantal queries hangt dus niet
+    af van het aantal berichten.
+    """
+    # Alleen opzoeken, niet aanmaken: dit draait ook op een alleen-lezen verbinding
+    room = db.query(Room).filter(Room.slug == room_slug).first()
     if not room:
         return []
 
-    messages = (
+    limit = max(1, min(limit, MAX_HISTORY_PAGE))
+    query = (
         db.query(Message)
-        .join(User, Message.user_id == User.id) # Join om gebruikersnaam op te halen
+        .options(*display_load_options())
         .filter(Message.room_id == room.id)
-        .order_by(desc(Message.timestamp))
-        .limit(limit)
-        .all()
     )
 
-    # We draaien de lijst om zodat het oudste bericht bovenaan staat (chronologische volgorde)
-    messages.reverse()
+    cursor_id = before if before is not None else after
+    if cursor_id is not None:
+        # De timestamp van het cursorbericht wordt in dezelfde query opgezocht
+        anchor = aliased(Message)
+        anchor_timestamp = select(anchor.timestamp).where(anchor.id == cursor_id).scalar_subquery()
+        position = tuple_(Message.timestamp, Message.id)
+        cursor = tuple_(anchor_timestamp, cursor_id)
 
-    # Converteer naar Pydantic schema voor de frontend
-    from app.api.schemas import ReplyContext
-    result = []
-    for msg in messages:
-        reply_context = None
-        if msg.reply_to_id:
-            reply_msg = db.query(Message).filter(Message.id == msg.reply_to_id).first()
-            if reply_msg:
-                reply_context = ReplyContext(
-                    id=reply_msg.id,
-                    username=reply_msg.sender.username,
-                    content=reply_msg.content
-                )
-
-        # Get attachments
-        from app.api.schemas import FileAttachmentDisplay
-        attachments = [FileAttachmentDisplay.from_orm(att) for att in msg.attachments] if msg.attachments else []
-
-        # Handle binary content (from corrupted messages)
-        content = msg.content
-        if isinstance(content, bytes):
-            # Skip binary messages or convert to placeholder
-            content = "[Bestand - kan niet weergeven]"
-
-        result.append(MessageDisplay(
-            id=msg.id,
-            content=content,
-            timestamp=msg.timestamp,
-            username=msg.sender.username,
-            room_slug=room_slug,
-            avatar_url=msg.sender.avatar_url,
-            reply_to=reply_context,
-            attachments=attachments
-        ))
+    if after is not None:
+        messages = (
+            query.filter(position > cursor)
+            .order_by(Message.timestamp, Message.id)
+            .limit(limit)
+            .all()
+        )
+    else:
+        if before is not None:
+            query = query.filter(position < cursor)
+        messages = (
+            query.order_by(desc(Message.timestamp), desc(Message.id))
+            .limit(limit)
+            .all()
+        )
+        # We draaien de lijst om zodat het oudste bericht bovenaan staat (chronologische volgorde)
+        messages.reverse()
 
-    return result
+    # Converteer naar Pydantic schema voor de frontend
+    return [message_to_display(msg, room_slug) for msg in messages]
 
 def save_message(db: Session, username: str, room_slug: str, content: str, reply_to_id: int = None):
     """Slaat een nieuw bericht op in de database."""
@@ -96,33 +165,362 @@ def save_message(db: Session, username: str, room_slug: str, content: str, reply
     )
 
     db.add(new_message)
+    db.flush()
+    message_id = new_message.id
     db.commit()
-    db.refresh(new_message)
 
-    # Get reply context if this is a reply
-    reply_context = None
-    if reply_to_id:
-        reply_msg = db.query(Message).filter(Message.id == reply_to_id).first()
-        if reply_msg:
-            from app.api.schemas import ReplyContext
-            reply_context = ReplyContext(
-                id=reply_msg.id,
-                username=reply_msg.sender.username,
-                content=reply_msg.content
-            )
-
-    # Get attachments
-    from app.api.schemas import FileAttachmentDisplay
-    attachments = [FileAttachmentDisplay.from_orm(att) for att in new_message.attachments] if new_message.attachments else []
+    # Alles in één query terughalen, net als bij de geschiedenis
+    new_message = (
+        db.query(Message)
+        .options(*display_load_options())
+        .filter(Message.id == message_id)
+        .one()
+    )
 
     # Retourneer het Pydantic object voor onmiddellijke verzending
-    return MessageDisplay(
-        id=new_message.id,
-        content=new_message.content,
-        timestamp=new_message.timestamp,
-        username=user.username,
-        room_slug=room_slug,
-        avatar_url=user.avatar_url,
-        reply_to=reply_context,
-        attachments=attachments
-    )
\ No newline at end of file
+    display = message_to_display(new_message, room_slug)
+    message_cache.append(room_slug, display)
+    return display
+
+def _resolve_rooms(db: Session, room_slugs: set) -> dict:
+    """
+    Kamers per slug, zoals get_room_by_slug, maar zonder tussentijdse commit:
+    ontbrekende kamers worden in de lopende transactie toegevoegd en vallen
+    dus weg als die teruggedraaid wordt.
+    """
+    rooms = {room.slug: room for room in db.query(Room).filter(Room.slug.in_(room_slugs))}
+    for slug in room_slugs - rooms.keys():
+        rooms[slug] = Room(name=slug.capitalize(), slug=slug)
+        db.add(rooms[slug])
+    return rooms
+
+def save_messages_batch(db: Session, pending: list):
+    """
+    Slaat een batch berichten (uit alle kamers) op in één transactie.
+
+    `pending` is een lijst dicts met username, room_slug, content en
+    reply_to_id. De berichten krijgen oplopende id's in volgorde van de
+    lijst; de timestamp zet de database, net als op elk ander insert-pad
+    (server_default), zodat (timestamp, id) overal de invoegvolgorde is.
+    Geeft per item een MessageDisplay terug, of None als gebruiker/kamer
+    niet bestaat.
+
+    De commit is de laatste databasestap: faalt er iets, dan is er niets
+    opgeslagen en kan de aanroeper de berichten los opnieuw proberen.
+    """
+    try:
+        usernames = {item["username"] for item in pending}
+        users = {user.username: user for user in db.query(User).filter(User.username.in_(usernames))}
+        rooms = _resolve_rooms(db, {item["room_slug"] for item in pending})
+
+        new_messages = []
+        for item in pending:
+            user = users.get(item["username"])
+            room = rooms.get(item["room_slug"])
+            if not user or not room:
+                print("Fout: Gebruiker of kamer niet gevonden.")
+                new_messages.append(None)
+                continue
+            new_messages.append(Message(
+                user_id=user.id,
+                room=room,
+                content=item["content"],
+                reply_to_id=item.get("reply_to_id")
+            ))
+
+        db.add_all([msg for msg in new_messages if msg is not None])
+        db.flush()
+        message_ids = [msg.id if msg is not None else None for msg in new_messages]
+
+        # Alles in één query terughalen, net als bij de geschiedenis (nog vóór de commit)
+        loaded = {
+            msg.id: msg
+            for msg in db.query(Message)
+            .options(*display_load_options())
+            .filter(Message.id.in_([message_id for message_id in message_ids if message_id is not None]))
+        }
+        result = [
+            message_to_display(loaded[message_id], item["room_slug"]) if message_id is not None else None
+            for item, message_id in zip(pending, message_ids)
+        ]
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    for item, display in zip(pending, result):
+        if display is not None:
+            message_cache.append(item["room_slug"], display)
+    return result
+
+# --- ZOEKEN ---
+
+# Markeringen rond treffers in een snippet; worden na het escapen <mark>-tags
+_HIGHLIGHT_START = "\x02"
+_HIGHLIGHT_END = "\x03"
+
+_fts_available = None
+
+def has_search_index(db: Session) -> bool:
+    """Bestaat de FTS5-index (zie migrate_message_search.py)? Eén keer per proces gecontroleerd."""
+    global _fts_available
+    if _fts_available is None:
+        if db.get_bind().dialect.name != "sqlite":
+            _fts_available = False
+        else:
+            _fts_available = db.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'")
+            ).first() is not None
+    return _fts_available
+
+def _fts_query(q: str, room_id: int):
+    """Zet invoer van de gebruiker om naar een veilige FTS5-query; het laatste woord als prefix."""
+    terms = re.findall(r"\w+", q)
+    if not terms:
+        return None
+    words = " ".join(f'"{term}"' for term in terms) + "*"
+    return f'room_id : "{room_id}" AND ({words})'
+
+def _highlight(snippet: str) -> str:
+    escaped = html.escape(snippet)
+    return escaped.replace(_HIGHLIGHT_START, "<mark>").replace(_HIGHLIGHT_END, "</mark>")
+
+def search_room_messages(db: Session, room_id: int, q: str, limit: int = 20, offset: int = 0):
+    """
+    Zoekt berichten in een kamer, gesorteerd op relevantie (bm25).
+
+    Gebruikt de FTS5-index als die er is; anders (bv. PostgreSQL of een
+    niet-gemigreerde database) een LIKE-zoekopdracht op nieuwste eerst.
+    Geeft dicts terug met o.a. een HTML-veilige `snippet` met <mark>-treffers.
+    """
+    if has_search_index(db):
+        match = _fts_query(q, room_id)
+        if match is None:
+            return []
+        rows = db.execute(
+            text("""
+                SELECT m.id, m.content, m.timestamp, u.username, u.avatar_url,
+                       snippet(messages_fts, 0, :start, :end, '…', 16) AS snippet
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                JOIN users u ON u.id = m.user_id
+                WHERE messages_fts MATCH :match AND m.is_deleted = 0
+                ORDER BY bm25(messages_fts, 1.0, 0.0)
+                LIMIT :limit OFFSET :offset
+            """).columns(id=Integer, content=String, timestamp=DateTime, username=String, avatar_url=String, snippet=String),
+            {"start": _HIGHLIGHT_START, "end": _HIGHLIGHT_END, "match": match, "limit": limit, "offset": offset}
+        )
+        return [{
+            "id": row.id,
+            "content": row.content,
+            "snippet": _highlight(row.snippet),
+            "username": row.username,
+            "avatar_url": row.avatar_url,
+            "timestamp": row.timestamp.isoformat()
+        } for row in rows]
+
+    messages = (
+        db.query(Message)
+        .options(joinedload(Message.sender))
+        .filter(Message.room_id == room_id)
+        .filter(Message.content.ilike(f"%{q}%"))
+        .filter(Message.is_deleted == False)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+    return [{
+        "id": msg.id,
+        "content": msg.content,
+        "snippet": html.escape(msg.content),
+        "username": msg.sender.username,
+        "avatar_url": msg.sender.avatar_url,
+        "timestamp": msg.timestamp.isoformat()
+    } for msg in messages]
+
+
+# --- DIRECTE BERICHTEN ---
+
+def get_direct_message_page(db: Session, user_id: int, other_id: int, limit: int = 50, before: int = None):
+    """
+    Eén pagina van een gesprek tussen twee gebruikers, in chronologische volgorde.
+
+    Zonder cursor de laatste `limit` berichten, met `before` (een bericht-id)
+    de berichten daarvoor. Elke richting (A->B en B->A) is een index-seek op
+    ix_direct_messages_pair_timestamp_id met LIMIT; de UNION ALL van die twee
+    wordt nog eens op `limit` afgekapt. De kosten hangen dus niet af van de
+    lengte van het gesprek. Geeft rijen (id, content, timestamp, sender_id,
+    receiver_id) terug, zonder relaties te laden; de leesstatus volgt uit
+    get_read_watermarks.
+    """
+    limit = max(1, min(limit, MAX_HISTORY_PAGE))
+    columns = (
+        DirectMessage.id, DirectMessage.content, DirectMessage.timestamp,
+        DirectMessage.sender_id, DirectMessage.receiver_id,
+    )
+    if before is not None:
+        anchor = aliased(DirectMessage)
+        anchor_timestamp = select(anchor.timestamp).where(anchor.id == before).scalar_subquery()
+
+    def direction(sender_id: int, receiver_id: int):
+        query = select(*columns).where(
+            DirectMessage.sender_id == sender_id,
+            DirectMessage.receiver_id == receiver_id,
+        )
+        if before is not None:
+            query = query.where(tuple_(DirectMessage.timestamp, DirectMessage.id) < tuple_(anchor_timestamp, before))
+        # SQLite staat LIMIT binnen een UNION alleen in een subquery toe
+        subquery = query.order_by(desc(DirectMessage.timestamp), desc(DirectMessage.id)).limit(limit).subquery()
+        return select(subquery)
+
+    page = union_all(direction(user_id, other_id), direction(other_id, user_id)).subquery()
+    rows = db.execute(
+        select(page).order_by(desc(page.c.timestamp), desc(page.c.id)).limit(limit)
+    ).all()
+    rows.reverse()
+    return rows
+
+
+
+# --- LEESSTATUS VAN DIRECTE BERICHTEN ---
+
+def _upsert_conversation(db: Session, owner_id: int, peer_id: int, update_values: dict, insert_values: dict):
+    """Werk de conversations-rij van (owner, peer) bij, of maak hem aan als die er nog niet is."""
+    stmt = (
+        update(Conversation)
+        .where(Conversation.owner_id == owner_id, Conversation.peer_id == peer_id)
+        .values(**update_values)
+        .execution_options(synchronize_session=False)
+    )
+    if db.execute(stmt).rowcount:
+        return
+    try:
+        with db.begin_nested():
+            db.add(Conversation(owner_id=owner_id, peer_id=peer_id, **insert_values))
+    except IntegrityError:
+        # Tegelijk door een ander bericht aangemaakt
+        db.execute(stmt)
+
+def message_snippet(content: str):
+    """Preview voor de inbox; None als het bericht end-to-end versleuteld is."""
+    if content.startswith("{"):
+        try:
+            if json.loads(content).get("encrypted"):
+                return None
+        except (ValueError, AttributeError):
+            pass
+    return content[:SNIPPET_LENGTH]
+
+def record_direct_message(db: Session, message: DirectMessage):
+    """
+    Verwerk een nieuw (geflusht) bericht in de conversations-rijen van beide
+    gebruikers: de samenvatting voor de inbox, en bij de ontvanger de teller
+    van ongelezen berichten. In de lopende transactie.
+    """
+    summary = {
+        "last_message_id": message.id,
+        "last_message_snippet": message_snippet(message.content),
+        "last_message_at": message.timestamp,
+    }
+    # Alleen overschrijven als dit bericht nieuwer is (gelijktijdige transacties)
+    newer = func.coalesce(Conversation.last_message_id, 0) < message.id
+    update_summary = {
+        key: case((newer, value), else_=getattr(Conversation, key))
+        for key, value in summary.items()
+    }
+    _upsert_conversation(
+        db, message.receiver_id, message.sender_id,
+        {"unread_count": Conversation.unread_count + 1, **update_summary},
+        {"unread_count": 1, "last_read_message_id": 0, **summary},
+    )
+    _upsert_conversation(
+        db, message.sender_id, message.receiver_id,
+        update_summary,
+        {"unread_count": 0, "last_read_message_id": 0, **summary},
+    )
+
+def mark_conversation_read(db: Session, owner_id: int, peer_id: int, up_to: int = None) -> bool:
+    """
+    Zet het watermerk van owner in het gesprek met peer tot en met `up_to`
+    (zonder `up_to`: het laatste bericht van peer) en herbereken unread_count,
+    in één UPDATE. Geeft True terug als er iets veranderde.
+    """
+    incoming = (DirectMessage.sender_id == peer_id, DirectMessage.receiver_id == owner_id)
+    if up_to is None:
+        watermark = select(func.max(DirectMessage.id)).where(*incoming).scalar_subquery()
+    else:
+        watermark = case(
+            (Conversation.last_read_message_id > up_to, Conversation.last_read_message_id),
+            else_=up_to,
+        )
+    stmt = (
+        update(Conversation)
+        .where(Conversation.owner_id == owner_id, Conversation.peer_id == peer_id)
+        .where(Conversation.unread_count > 0)
+        .values(
+            last_read_message_id=watermark,
+            unread_count=select(func.count()).where(*incoming, DirectMessage.id > watermark).scalar_subquery(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if up_to is not None:
+        stmt = stmt.where(Conversation.last_read_message_id < up_to)
+    return db.execute(stmt).rowcount > 0
+
+def get_read_watermarks(db: Session, user_id: int, other_id: int):
+    """(tot waar user_id heeft gelezen, tot waar other_id heeft gelezen) in hun gesprek."""
+    rows = db.execute(
+        select(Conversation.owner_id, Conversation.last_read_message_id).where(
+            ((Conversation.owner_id == user_id) & (Conversation.peer_id == other_id))
+            | ((Conversation.owner_id == other_id) & (Conversation.peer_id == user_id))
+        )
+    ).all()
+    watermarks = {row.owner_id: row.last_read_message_id for row in rows}
+    return watermarks.get(user_id, 0), watermarks.get(other_id, 0)
+
+def get_unread_counts(db: Session, owner_id: int, peer_id: int = None) -> dict:
+    """
+    Ongelezen berichten van een gebruiker: het totaal en per gesprekspartner
+    (alleen gesprekken met ongelezen berichten). Met `peer_id` alleen dat gesprek.
+    """
+    query = (
+        select(User.username, Conversation.unread_count)
+        .join(User, User.id == Conversation.peer_id)
+        .where(Conversation.owner_id == owner_id, Conversation.unread_count > 0)
+    )
+    if peer_id is not None:
+        query = query.where(Conversation.peer_id == peer_id)
+    conversations = {row.username: row.unread_count for row in db.execute(query)}
+    if peer_id is None:
+        total = sum(conversations.values())
+    else:
+        total = db.execute(
+            select(func.coalesce(func.sum(Conversation.unread_count), 0)).where(Conversation.owner_id == owner_id)
+        ).scalar()
+    return {"total": total, "conversations": conversations}
+
+def get_inbox(db: Session, owner_id: int, limit: int = 50, before: int = None):
+    """
+    De gesprekken van een gebruiker, nieuwste eerst, met het laatste bericht
+    en het aantal ongelezen berichten. Eén query over
+    ix_conversations_owner_last_message; `before` is het last_message_id van
+    het laatst getoonde gesprek.
+    """
+    query = (
+        select(
+            User.username.label("peer_username"),
+            User.avatar_url.label("peer_avatar_url"),
+            Conversation.last_message_id,
+            Conversation.last_message_snippet,
+            Conversation.last_message_at,
+            Conversation.unread_count,
+        )
+        .join(User, User.id == Conversation.peer_id)
+        .where(Conversation.owner_id == owner_id, Conversation.last_message_id.is_not(None))
+        .order_by(desc(Conversation.last_message_id))
+        .limit(max(1, min(limit, MAX_HISTORY_PAGE)))
+    )
+    if before is not None:
+        query = query.where(Conversation.last_message_id < before)
+    return db.execute(query).all()
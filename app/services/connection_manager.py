@@ -1,114 +1,489 @@
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict, List, Set
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set, Union
+from collections import deque
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from app.services.broker import Broker, InProcessBroker, create_broker
+from app.services.message_cache import message_cache
+from app.services.message_codec import Frame, as_frame, dumps
+from app.services.metrics import percentiles
+
+# Maximum number of frames that may wait in a single connection's outbox
+OUTBOX_MAX_SIZE = int(os.environ.get("WS_OUTBOX_MAX_SIZE", "256"))
+
+# What happens when a slow client's outbox is full:
+#   drop_oldest - discard the oldest queued frame and enqueue the new one
+#   drop_newest - discard the new frame
+#   disconnect  - close the slow client (code 1013, "try again later")
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "disconnect")
+OUTBOX_OVERFLOW_POLICY = os.environ.get("WS_OUTBOX_OVERFLOW_POLICY", "drop_oldest")
+
+# Number of recent latency samples kept per room for the percentiles
+LATENCY_SAMPLE_SIZE = 1024
+
+# Unieke naam van dit proces op de broker; berichten van de eigen node worden overgeslagen
+NODE_ID = os.environ.get("NODE_ID") or uuid.uuid4().hex[:12]
+
+# Kanaal voor gebeurtenissen die elke node moet zien (zie register_handler)
+CLUSTER_CHANNEL = "cluster"
+
+# handler(data, channel) voor een envelope van een andere node
+EnvelopeHandler = Callable[[object, str], Awaitable[None]]
+
+
+class DeliveryStats:
+    """Delivery latency (enqueue until send completed) for one room."""
+    def __init__(self, sample_size: int = LATENCY_SAMPLE_SIZE):
+        self.delivered = 0
+        self.dropped = 0
+        self.disconnected = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.samples: Deque[float] = deque(maxlen=sample_size)
+
+    def record(self, latency: float):
+        self.delivered += 1
+        self.total_latency += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+        self.samples.append(latency)
+
+    def snapshot(self) -> dict:
+        return {
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "disconnected": self.disconnected,
+            "avg_ms": (self.total_latency / self.delivered) * 1000 if self.delivered else 0.0,
+            **percentiles(self.samples),
+            # Over alle leveringen, niet alleen de bewaarde samples
+            "max_ms": self.max_latency * 1000,
+        }
+
+
+class Outbox:
+    """
+    Bounded outbound queue plus writer task for a single WebSocket, so a slow
+    client only ever delays its own frames.
+    """
+    def __init__(self, websocket: WebSocket, manager: "ConnectionManager", max_size: int, binary: bool = False):
+        self.websocket = websocket
+        self.manager = manager
+        # True voor clients met het msgpack-subprotocol
+        self.binary = binary
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self.closed = False
+        self.task = asyncio.create_task(self._writer())
+
+    def offer(self, frame: Frame, room_slug: Optional[str]) -> bool:
+        """Queue a frame without waiting. Returns False if the frame was not queued."""
+        if self.closed:
+            return False
+        item = (frame, room_slug, time.perf_counter())
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        policy = self.manager.overflow_policy
+        if policy == "drop_oldest":
+            dropped = self.queue.get_nowait()
+            self.manager._record_drop(dropped[1])
+            self.queue.put_nowait(item)
+            return True
+        if policy == "drop_newest":
+            self.manager._record_drop(room_slug)
+            return False
+
+        # disconnect
+        self.manager._drop_slow_connection(self, room_slug)
+        return False
+
+    async def _writer(self):
+        while True:
+            frame, room_slug, enqueued_at = await self.queue.get()
+            try:
+                if self.binary:
+                    await self.websocket.send_bytes(frame.binary)
+                else:
+                    await self.websocket.send_text(frame.text)
+            except Exception:
+                # De verbinding is weg; disconnect() ruimt de rest op
+                self.closed = True
+                return
+            if room_slug is not None:
+                self.manager._record_delivery(room_slug, time.perf_counter() - enqueued_at)
+
+    def close(self):
+        self.closed = True
+        self.task.cancel()
+
 
 class ConnectionManager:
     """
     Beheert actieve WebSocket-verbindingen, gegroepeerd per kamer.
+
+    Uitgaande berichten gaan via een begrensde wachtrij per verbinding
+    (zie Outbox), zodat broadcast() nooit op een trage client wacht.
+
+    Alles wat de manager lokaal aflevert publiceert hij ook op de broker
+    (room:<slug>, user:<naam>), als envelope {"origin", "kind", "data"}.
+    Envelopes van andere nodes gaan naar de handler voor hun `kind`;
+    "frame" levert de tekst af aan de lokale verbindingen van die kamer,
+    "user_frame" aan die van de gebruiker. Call-room-deelnemers staan in
+    broker-sets; wie er online is houdt app.services.presence bij.
+
+    Een verbinding kan in meerdere kamers zitten (het gemultiplexte /ws):
+    register() meldt hem aan, join_room()/leave_room() schakelen kamers en
+    unregister() ruimt alles op. connect()/disconnect() zijn de vorm met één
+    kamer per verbinding.
     """
-    def __init__(self):
+    def __init__(
+        self,
+        outbox_size: int = OUTBOX_MAX_SIZE,
+        overflow_policy: str = OUTBOX_OVERFLOW_POLICY,
+        broker: Optional[Broker] = None,
+        node_id: str = NODE_ID,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.outbox_size = outbox_size
+        self.overflow_policy = overflow_policy
+        self.broker = broker or create_broker()
+        self.node_id = node_id
         # Dict: {room_slug: [WebSocket, WebSocket, ...]}
         self.active_connections: Dict[str, List[WebSocket]] = {}
-        # Track online users: {username: Set of room_slugs}
-        self.online_users: Dict[str, Set[str]] = {}
         # Track websocket to username mapping for direct messaging
         self.websocket_to_username: Dict[WebSocket, str] = {}
-        # Track call room participants: {call_room_slug: Set of usernames}
-        self.call_room_participants: Dict[str, Set[str]] = {}
+        # Reverse index: {username: Set of WebSockets}, for targeted delivery
+        self.user_connections: Dict[str, Set[WebSocket]] = {}
+        # Kamers per websocket, en de kanalen van send_to_user die hij wil (None = alle)
+        self.websocket_rooms: Dict[WebSocket, Set[str]] = {}
+        self.websocket_channels: Dict[WebSocket, Optional[Set[str]]] = {}
+        # Outbound queue + writer task per websocket
+        self.outboxes: Dict[WebSocket, Outbox] = {}
+        # Delivery latency per room
+        self.delivery_stats: Dict[str, DeliveryStats] = {}
+        # Envelope handlers per kind
+        self._handlers: Dict[str, EnvelopeHandler] = {"frame": self._handle_frame, "user_frame": self._handle_user_frame}
+        # Kanalen waarop we geabonneerd zijn
+        self._subscriptions: Set[str] = set()
+        # Pas in de event loop aanmaken (Python 3.9 bindt een Lock bij het aanmaken aan een loop)
+        self._broker_lock: Optional[asyncio.Lock] = None
+        self._started = False
+        self.envelopes_published = 0
+        self.envelopes_received = 0
+
+    async def start(self):
+        """Abonneer op het clusterkanaal; connect() doet dit ook als het nog niet gebeurd is."""
+        if self._started:
+            return
+        self._started = True
+        await self.broker.subscribe(CLUSTER_CHANNEL, self._on_envelope)
+
+    async def close(self):
+        self._subscriptions.clear()
+        self._started = False
+        await self.broker.close()
+
+    def register_handler(self, kind: str, handler: EnvelopeHandler):
+        """Registreer een handler voor envelopes van andere nodes met deze `kind`."""
+        self._handlers[kind] = handler
+
+    async def publish(self, kind: str, data, channel: str = CLUSTER_CHANNEL):
+        """Publiceer een envelope voor de andere nodes (niet voor deze)."""
+        if not self.broker.has_peers(channel):
+            # Geen andere node luistert: ook niet coderen
+            return
+        self.envelopes_published += 1
+        await self.broker.publish(channel, dumps({"origin": self.node_id, "kind": kind, "data": data}))
+
+    async def _on_envelope(self, channel: str, message: str):
+        envelope = json.loads(message)
+        if envelope.get("origin") == self.node_id:
+            return
+        handler = self._handlers.get(envelope.get("kind"))
+        if handler is None:
+            return
+        self.envelopes_received += 1
+        await handler(envelope.get("data"), channel)
+
+    async def _handle_frame(self, text: str, channel: str):
+        kind, _, name = channel.partition(":")
+        if kind == "room":
+            # Berichten die op een andere node opgeslagen zijn ook in onze cache
+            message_cache.apply_remote(name, text)
+            self._deliver_room(Frame(text), name)
+
+    def can_cache_room(self, room_slug: str) -> bool:
+        """
+        Mag de berichtcache deze kamer bewaren? Alleen als deze node elk nieuw
+        bericht erin ziet: met de in-process broker altijd, anders alleen
+        zolang hij op room:<slug> geabonneerd is (zie _handle_frame).
+        """
+        return isinstance(self.broker, InProcessBroker) or f"room:{room_slug}" in self._subscriptions
 
-    async def connect(self, websocket: WebSocket, room_slug: str, username: str = None):
-        """Voegt een nieuwe verbinding toe aan een kamer."""
+    async def _handle_user_frame(self, data: list, channel: str):
+        user_channel, text = data
+        self._deliver_user(Frame(text), channel.partition(":")[2], user_channel)
+
+    def _lock(self) -> asyncio.Lock:
+        if self._broker_lock is None:
+            self._broker_lock = asyncio.Lock()
+        return self._broker_lock
+
+    async def _sync_room(self, room_slug: str):
+        """Abonneer op room:<slug> zolang er lokale verbindingen in die kamer zijn."""
+        async with self._lock():
+            channel = f"room:{room_slug}"
+            wanted = room_slug in self.active_connections
+            if wanted and channel not in self._subscriptions:
+                self._subscriptions.add(channel)
+                await self.broker.subscribe(channel, self._on_envelope)
+            elif not wanted and channel in self._subscriptions:
+                self._subscriptions.discard(channel)
+                await self.broker.unsubscribe(channel)
+                if not self.can_cache_room(room_slug):
+                    # Vanaf nu missen we berichten van andere nodes
+                    message_cache.invalidate(room_slug)
+
+    async def _sync_user(self, username: str):
+        """Abonneer op user:<naam> zolang de gebruiker hier verbonden is."""
+        async with self._lock():
+            channel = f"user:{username}"
+            wanted = username in self.user_connections
+            if wanted and channel not in self._subscriptions:
+                self._subscriptions.add(channel)
+                await self.broker.subscribe(channel, self._on_envelope)
+            elif not wanted and channel in self._subscriptions:
+                self._subscriptions.discard(channel)
+                await self.broker.unsubscribe(channel)
+
+    async def register(
+        self,
+        websocket: WebSocket,
+        username: str = None,
+        binary: bool = False,
+        channels: Optional[Set[str]] = None,
+    ):
+        """
+        Meldt een (geauthenticeerde) verbinding aan, nog zonder kamer.
+
+        `binary` geeft aan dat de client het msgpack-subprotocol heeft
+        afgesproken (zie message_codec.negotiate_subprotocol). `channels`
+        beperkt wat send_to_user aan deze verbinding aflevert (bv. {"dm"});
+        None betekent alles. De set wordt niet gekopieerd: de aanroeper kan
+        hem later aanpassen.
+        """
         # Don't accept here - it should be done before authentication
-        if room_slug not in self.active_connections:
-            self.active_connections[room_slug] = []
-        self.active_connections[room_slug].append(websocket)
+        await self.start()
+        if websocket not in self.outboxes:
+            self.outboxes[websocket] = Outbox(websocket, self, self.outbox_size, binary)
+            self.websocket_rooms[websocket] = set()
+            self.websocket_channels[websocket] = channels
 
-        # Track online status
         if username:
-            if username not in self.online_users:
-                self.online_users[username] = set()
-            self.online_users[username].add(room_slug)
-            # Map websocket to username
+            # Map websocket to username (and back)
             self.websocket_to_username[websocket] = username
+            if username not in self.user_connections:
+                self.user_connections[username] = set()
+            self.user_connections[username].add(websocket)
+            await self._sync_user(username)
 
-    def disconnect(self, websocket: WebSocket, room_slug: str, username: str = None):
-        """Verwijdert een verbinding uit een kamer."""
+    async def unregister(self, websocket: WebSocket):
+        """Verwijdert een verbinding uit alle kamers en stopt de writer."""
+        for room_slug in list(self.websocket_rooms.get(websocket, ())):
+            await self.leave_room(websocket, room_slug)
+        self.websocket_rooms.pop(websocket, None)
+        self.websocket_channels.pop(websocket, None)
+
+        ws_username = self.websocket_to_username.pop(websocket, None)
+        if ws_username is not None:
+            sockets = self.user_connections.get(ws_username)
+            if sockets is not None:
+                sockets.discard(websocket)
+                if not sockets:
+                    del self.user_connections[ws_username]
+            await self._sync_user(ws_username)
+
+        outbox = self.outboxes.pop(websocket, None)
+        if outbox is not None:
+            outbox.close()
+
+    async def join_room(self, websocket: WebSocket, room_slug: str):
+        """Voegt een aangemelde verbinding toe aan een kamer."""
+        rooms = self.websocket_rooms.setdefault(websocket, set())
+        if room_slug in rooms:
+            return
+        rooms.add(room_slug)
+        if room_slug not in self.active_connections:
+            self.active_connections[room_slug] = []
+        self.active_connections[room_slug].append(websocket)
+        await self._sync_room(room_slug)
+
+    async def leave_room(self, websocket: WebSocket, room_slug: str):
+        """Haalt een verbinding uit één kamer; de verbinding zelf blijft bestaan."""
+        self.websocket_rooms.get(websocket, set()).discard(room_slug)
         if room_slug in self.active_connections and websocket in self.active_connections[room_slug]:
             self.active_connections[room_slug].remove(websocket)
             if not self.active_connections[room_slug]:
                 del self.active_connections[room_slug] # Verwijder de lijst als deze leeg is
+        await self._sync_room(room_slug)
 
-        # Update online status
-        if username and username in self.online_users:
-            self.online_users[username].discard(room_slug)
-            if not self.online_users[username]:
-                del self.online_users[username]
-
-        # Remove websocket mapping
-        if websocket in self.websocket_to_username:
-            del self.websocket_to_username[websocket]
+    def rooms_of(self, websocket: WebSocket) -> Set[str]:
+        return self.websocket_rooms.get(websocket, set())
 
-    def is_user_online(self, username: str) -> bool:
-        """Check if a user is online in any room."""
-        return username in self.online_users and len(self.online_users[username]) > 0
+    async def connect(self, websocket: WebSocket, room_slug: str, username: str = None, binary: bool = False):
+        """Voegt een nieuwe verbinding toe aan een kamer (één kamer per WebSocket)."""
+        await self.register(websocket, username, binary)
+        await self.join_room(websocket, room_slug)
 
-    def get_online_users(self) -> List[str]:
-        """Get list of all online usernames."""
-        return list(self.online_users.keys())
+    async def disconnect(self, websocket: WebSocket, room_slug: str, username: str = None):
+        """Verwijdert een verbinding uit een kamer, en helemaal zodra hij in geen enkele kamer meer zit."""
+        await self.leave_room(websocket, room_slug)
+        if not self.websocket_rooms.get(websocket):
+            await self.unregister(websocket)
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
+    async def send_personal_message(self, message: Union[Frame, str], websocket: WebSocket):
         """Stuurt een bericht naar één specifieke client."""
-        await websocket.send_text(message)
+        frame = as_frame(message)
+        outbox = self.outboxes.get(websocket)
+        if outbox:
+            outbox.offer(frame, None)
+        else:
+            await websocket.send_text(frame.text)
 
-    async def broadcast(self, message: str, room_slug: str):
-        """Stuurt een bericht naar alle clients in een specifieke kamer."""
+    async def broadcast(self, message: Union[Frame, str], room_slug: str):
+        """
+        Stuurt een bericht naar alle clients in een specifieke kamer.
+
+        Het bericht wordt één keer gecodeerd en alleen in de outbox van elke
+        verbinding gezet; de writer-taken versturen het gelijktijdig.
+        """
+        message = as_frame(message)
+        self._deliver_room(message, room_slug)
+        await self.publish("frame", message.text, f"room:{room_slug}")
+
+    def broadcast_local(self, message: Union[Frame, str], room_slug: Optional[str] = None):
+        """
+        Alleen naar de verbindingen op deze node (niet via de broker): in één
+        kamer, of zonder room_slug één keer naar elke verbinding.
+        """
+        message = as_frame(message)
+        if room_slug is not None:
+            self._deliver_room(message, room_slug)
+            return
+        for outbox in list(self.outboxes.values()):
+            outbox.offer(message, None)
+
+    def _deliver_room(self, message: Frame, room_slug: str):
         if room_slug in self.active_connections:
-            for connection in self.active_connections[room_slug]:
-                # We gebruiken try/except voor het geval de verbinding net gesloten is
-                try:
-                    await connection.send_text(message)
-                except RuntimeError:
-                    # Log de fout of behandel deze, de disconnect() zal later de verbinding verwijderen
-                    pass
-
-    async def send_to_user(self, message: str, username: str):
-        """Send a message to a specific user across all their connections."""
+            for connection in list(self.active_connections[room_slug]):
+                outbox = self.outboxes.get(connection)
+                if outbox:
+                    outbox.offer(message, room_slug)
+
+    def broker_stats(self) -> dict:
+        return {
+            "node_id": self.node_id,
+            "broker": type(self.broker).__name__,
+            "subscriptions": len(self._subscriptions),
+            "envelopes_published": self.envelopes_published,
+            "envelopes_received": self.envelopes_received,
+        }
+
+    def get_delivery_stats(self, room_slug: Optional[str] = None) -> Dict[str, dict]:
+        """Delivery latency per room (or for one room)."""
+        if room_slug is not None:
+            stats = self.delivery_stats.get(room_slug)
+            return {room_slug: stats.snapshot()} if stats else {}
+        return {slug: stats.snapshot() for slug, stats in self.delivery_stats.items()}
+
+    def _stats_for(self, room_slug: str) -> DeliveryStats:
+        if room_slug not in self.delivery_stats:
+            self.delivery_stats[room_slug] = DeliveryStats()
+        return self.delivery_stats[room_slug]
+
+    def _record_delivery(self, room_slug: str, latency: float):
+        self._stats_for(room_slug).record(latency)
+
+    def _record_drop(self, room_slug: Optional[str]):
+        if room_slug is not None:
+            self._stats_for(room_slug).dropped += 1
+
+    def _drop_slow_connection(self, outbox: Outbox, room_slug: Optional[str]):
+        """
+        Overflow policy 'disconnect': stop sending to the client and close it.
+
+        De kamers en de gebruiker blijven staan: de endpoint krijgt daarna een
+        WebSocketDisconnect en ruimt via de gewone weg op (verlaat-melding,
+        typing-status, unregister).
+        """
+        websocket = outbox.websocket
+        if outbox.closed:
+            return
+        print(f"[ConnectionManager] Disconnecting slow client {self.websocket_to_username.get(websocket)}")
+        outbox.close()
+        if room_slug is not None:
+            self._stats_for(room_slug).disconnected += 1
+
+        async def close():
+            try:
+                await websocket.close(code=1013)
+            except Exception:
+                pass
+        asyncio.create_task(close())
+
+    async def send_to_user(self, message: Union[Frame, str], username: str, channel: Optional[str] = None):
+        """
+        Send a message to a specific user across all their connections.
+
+        Met `channel` (bv. "dm" of "calls") alleen naar verbindingen die dat
+        kanaal willen; verbindingen zonder kanaalfilter krijgen alles.
+        """
+        message = as_frame(message)
+        sent_count = self._deliver_user(message, username, channel)
+        await self.publish("user_frame", [channel, message.text], f"user:{username}")
+        print(f"[ConnectionManager] Sent message to {username} via {sent_count} local websocket(s)")
+
+    def _deliver_user(self, message: Frame, username: str, channel: Optional[str] = None) -> int:
         sent_count = 0
-        for websocket, ws_username in self.websocket_to_username.items():
-            if ws_username == username:
-                try:
-                    await websocket.send_text(message)
-                    sent_count += 1
-                except RuntimeError:
-                    pass
-        print(f"[ConnectionManager] Sent message to {username} via {sent_count} websocket(s)")
-
-    def join_call_room(self, call_room_slug: str, username: str):
+        for websocket in list(self.user_connections.get(username, ())):
+            channels = self.websocket_channels.get(websocket)
+            if channel is not None and channels is not None and channel not in channels:
+                continue
+            outbox = self.outboxes.get(websocket)
+            if outbox and outbox.offer(message, None):
+                sent_count += 1
+        return sent_count
+
+    async def join_call_room(self, call_room_slug: str, username: str):
         """Add user to call room participants."""
-        if call_room_slug not in self.call_room_participants:
-            self.call_room_participants[call_room_slug] = set()
-        self.call_room_participants[call_room_slug].add(username)
+        await self.broker.set_add(f"call:{call_room_slug}", username)
 
-    def leave_call_room(self, call_room_slug: str, username: str):
+    async def leave_call_room(self, call_room_slug: str, username: str):
         """Remove user from call room participants."""
-        if call_room_slug in self.call_room_participants:
-            self.call_room_participants[call_room_slug].discard(username)
-            if not self.call_room_participants[call_room_slug]:
-                del self.call_room_participants[call_room_slug]
+        await self.broker.set_remove(f"call:{call_room_slug}", username)
 
-    def get_call_room_participants(self, call_room_slug: str) -> List[str]:
+    async def get_call_room_participants(self, call_room_slug: str) -> List[str]:
         """Get list of usernames in a call room."""
-        return list(self.call_room_participants.get(call_room_slug, set()))
+        return list(await self.broker.set_members(f"call:{call_room_slug}"))
 
-    async def broadcast_to_call_room(self, message: str, call_room_slug: str, exclude_username: str = None):
+    async def broadcast_to_call_room(self, message: Union[Frame, str], call_room_slug: str, exclude_username: str = None):
         """Send message to all participants in a call room."""
-        print(f"[ConnectionManager] Broadcasting to call room {call_room_slug}, participants: {self.call_room_participants.get(call_room_slug, set())}, excluding: {exclude_username}")
-        if call_room_slug in self.call_room_participants:
-            for username in self.call_room_participants[call_room_slug]:
-                if exclude_username and username == exclude_username:
-                    print(f"[ConnectionManager] Skipping {username} (excluded)")
-                    continue
-                print(f"[ConnectionManager] Sending to {username}")
-                await self.send_to_user(message, username)
+        message = as_frame(message)
+        participants = await self.get_call_room_participants(call_room_slug)
+        print(f"[ConnectionManager] Broadcasting to call room {call_room_slug}, participants: {participants}, excluding: {exclude_username}")
+        for username in participants:
+            if exclude_username and username == exclude_username:
+                print(f"[ConnectionManager] Skipping {username} (excluded)")
+                continue
+            print(f"[ConnectionManager] Sending to {username}")
+            await self.send_to_user(message, username, "calls")
 
 
 manager = ConnectionManager() # Instantie van de manager voor gebruik in de router
\ No newline at end of file
@@ -0,0 +1,126 @@
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+import json
+import os
+import threading
+
+from app.api.schemas import MessageDisplay
+
+# Aantal recente berichten dat per kamer in het geheugen blijft
+HOT_WINDOW_SIZE = int(os.environ.get("MESSAGE_CACHE_WINDOW", "50"))
+# Maximaal aantal kamers in de cache; de minst recent gebruikte valt eruit
+MAX_CACHED_ROOMS = int(os.environ.get("MESSAGE_CACHE_ROOMS", "256"))
+
+
+class RecentMessageCache:
+    """
+    Ringbuffer met de laatste berichten per kamer, zodat het openen van een
+    kamer de database niet raakt.
+
+    Een kamer komt in de cache via fill() (na een geschiedenis-query), blijft
+    actueel via append() en apply_remote() (berichten van andere nodes) en
+    gaat eruit via invalidate() of LRU-eviction.
+    """
+    def __init__(self, window_size: int = HOT_WINDOW_SIZE, max_rooms: int = MAX_CACHED_ROOMS):
+        self.window_size = window_size
+        self.max_rooms = max_rooms
+        self._rooms: "OrderedDict[str, Deque[MessageDisplay]]" = OrderedDict()
+        # Versie per kamer (+ een globale epoch voor invalidate()), zodat een
+        # fill() die tegelijk met een nieuw bericht liep geen verouderde lijst terugzet
+        self._versions: Dict[str, int] = {}
+        self._epoch = 0
+        # get() draait in de threadpool, append() op de event loop
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, room_slug: str, limit: int) -> Optional[List[MessageDisplay]]:
+        """De laatste `limit` berichten, of None als de kamer niet in de cache zit."""
+        with self._lock:
+            messages = self._rooms.get(room_slug)
+            if messages is None or limit > self.window_size:
+                self.misses += 1
+                return None
+            self._rooms.move_to_end(room_slug)
+            self.hits += 1
+            return list(messages)[-limit:]
+
+    def version(self, room_slug: str) -> tuple:
+        """Versie om vóór het laden uit de database mee te geven aan fill()."""
+        with self._lock:
+            return (self._epoch, self._versions.get(room_slug, 0))
+
+    def fill(self, room_slug: str, messages: List[MessageDisplay], version: tuple):
+        """Zet de laatste berichten van een kamer in de cache (uit de database geladen)."""
+        with self._lock:
+            if version != (self._epoch, self._versions.get(room_slug, 0)):
+                return
+            self._rooms[room_slug] = deque(messages[-self.window_size:], maxlen=self.window_size)
+            self._rooms.move_to_end(room_slug)
+            while len(self._rooms) > self.max_rooms:
+                self._rooms.popitem(last=False)
+
+    def append(self, room_slug: str, message: MessageDisplay):
+        """Voeg een nieuw bericht toe; het oudste valt eruit als het venster vol is."""
+        with self._lock:
+            self._versions[room_slug] = self._versions.get(room_slug, 0) + 1
+            messages = self._rooms.get(room_slug)
+            if messages is not None:
+                messages.append(message)
+
+    def apply_remote(self, room_slug: str, text: str):
+        """
+        Verwerk een frame dat een andere node in deze kamer broadcastte.
+
+        Een nieuw bericht wordt toegevoegd (tenzij fill() het al uit de
+        database had); een gebeurtenis over een opgeslagen bericht (met
+        message_id, bv. attachment-updated) gooit de kamer weg. Het frame
+        wordt alleen gedecodeerd als de kamer in de cache zit.
+        """
+        with self._lock:
+            self._versions[room_slug] = self._versions.get(room_slug, 0) + 1
+            if room_slug not in self._rooms:
+                return
+
+        message = None
+        try:
+            payload = json.loads(text)
+            if isinstance(payload, dict) and "type" not in payload:
+                message = MessageDisplay.model_validate(payload)
+            elif not isinstance(payload, dict) or "message_id" not in payload:
+                return
+        except ValueError:
+            pass
+
+        with self._lock:
+            messages = self._rooms.get(room_slug)
+            if messages is None:
+                return
+            if message is None:
+                self._versions[room_slug] += 1
+                del self._rooms[room_slug]
+            elif all(cached.id != message.id for cached in messages):
+                messages.append(message)
+
+    def invalidate(self, room_slug: Optional[str] = None):
+        """Gooi één kamer (of alles) weg, bv. na een bewerking of verwijdering."""
+        with self._lock:
+            if room_slug is None:
+                self._epoch += 1
+                self._rooms.clear()
+            else:
+                self._versions[room_slug] = self._versions.get(room_slug, 0) + 1
+                self._rooms.pop(room_slug, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "rooms": len(self._rooms),
+            }
+
+
+message_cache = RecentMessageCache() # Gedeelde instantie, net als de ConnectionManager
@@ -0,0 +1,106 @@
+"""
+Codering van WebSocket-berichten.
+
+Elke gebeurtenis wordt één keer gecodeerd tot een Frame, dat de
+ConnectionManager ongewijzigd aan alle ontvangers geeft. Als orjson
+geïnstalleerd is wordt dat gebruikt voor JSON; als msgpack geïnstalleerd is
+kunnen clients het compacte binaire subprotocol "chat.msgpack" aanvragen.
+"""
+from datetime import datetime
+from typing import Any, Optional, Union
+import json
+
+from fastapi import WebSocket, WebSocketDisconnect
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # optionele snelle encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optioneel binair subprotocol
+    msgpack = None
+
+MSGPACK_SUBPROTOCOL = "chat.msgpack"
+
+
+def _default(value: Any):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> str:
+    """Compacte JSON, via orjson als dat beschikbaar is."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=_default)
+
+
+class Frame:
+    """
+    Eén gecodeerde gebeurtenis, gedeeld door alle ontvangers.
+
+    `text` is de JSON-tekst (of een platte systeemmelding); de msgpack-vorm
+    wordt pas gemaakt als een binaire client hem nodig heeft, en daarna hergebruikt.
+    """
+    __slots__ = ("text", "_payload", "_binary")
+
+    def __init__(self, text: str, payload: Any = None):
+        self.text = text
+        self._payload = payload
+        self._binary: Optional[bytes] = None
+
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            payload = self._payload
+            if payload is None:
+                try:
+                    payload = json.loads(self.text)
+                except ValueError:
+                    payload = self.text
+            elif isinstance(payload, BaseModel):
+                payload = payload.model_dump(mode="json")
+            self._binary = msgpack.packb(payload, default=_default)
+        return self._binary
+
+
+def encode_event(event: dict) -> Frame:
+    """Codeer een gebeurtenis (dict) zoals {"type": "typing", ...}."""
+    return Frame(dumps(event), event)
+
+
+def encode_model(model: BaseModel) -> Frame:
+    """Codeer een Pydantic-model, bv. een MessageDisplay."""
+    return Frame(model.model_dump_json(), model)
+
+
+def as_frame(message: Union[Frame, str]) -> Frame:
+    """Accepteer zowel een Frame als een al gecodeerde string."""
+    if isinstance(message, Frame):
+        return message
+    return Frame(message)
+
+
+def negotiate_subprotocol(websocket: WebSocket) -> Optional[str]:
+    """Het subprotocol om mee te accepteren, of None voor gewone JSON-tekstframes."""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+async def receive_event(websocket: WebSocket) -> Any:
+    """Ontvang één gebeurtenis, als JSON-tekst of (binair) msgpack."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    if message.get("bytes") is not None:
+        if msgpack is not None:
+            return msgpack.unpackb(message["bytes"])
+        return json.loads(message["bytes"])
+    return json.loads(message["text"])
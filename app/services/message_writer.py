@@ -0,0 +1,109 @@
+"""
+Group commit voor chatberichten.
+
+In plaats van één commit (en dus één fsync) per bericht verzamelt de
+MessageWriteQueue berichten uit alle kamers en schrijft ze elke paar
+milliseconden, of zodra er genoeg zijn, in één transactie weg. submit()
+geeft pas antwoord als de batch gecommit is; pas dan wordt er gebroadcast.
+"""
+from typing import List, Optional, Tuple
+import asyncio
+import os
+
+from app.api.schemas import MessageDisplay
+from app.database.executor import db_executor
+from app.services import chat_crud
+
+# Maximale tijd dat een bericht op zijn batch wacht (milliseconden)
+FLUSH_INTERVAL_MS = float(os.environ.get("CHAT_WRITE_FLUSH_INTERVAL_MS", "5"))
+# Maximaal aantal berichten per transactie
+MAX_BATCH_SIZE = int(os.environ.get("CHAT_WRITE_MAX_BATCH", "500"))
+# Maximaal aantal wachtende berichten voordat submit() zelf moet wachten
+MAX_PENDING = int(os.environ.get("CHAT_WRITE_MAX_PENDING", "10000"))
+
+
+class MessageWriteQueue:
+    """Asynchrone write-behind wachtrij die berichten in batches commit."""
+    def __init__(self, flush_interval_ms: float = FLUSH_INTERVAL_MS, max_batch_size: int = MAX_BATCH_SIZE):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.messages = 0
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue(maxsize=MAX_PENDING)
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, username: str, room_slug: str, content: str, reply_to_id: int = None) -> Optional[MessageDisplay]:
+        """Zet een bericht in de rij en wacht tot het duurzaam opgeslagen is."""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        item = {"username": username, "room_slug": room_slug, "content": content, "reply_to_id": reply_to_id}
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]):
+        try:
+            results = await db_executor.run(chat_crud.save_messages_batch, [item for item, _ in batch])
+        except Exception as e:
+            if len(batch) > 1:
+                # De batch is teruggedraaid; los opnieuw, zodat alleen het foute bericht faalt
+                print(f"[MessageWriteQueue] Batch of {len(batch)} failed, retrying one by one: {e}")
+                for entry in batch:
+                    await self._flush([entry])
+                return
+            print(f"[MessageWriteQueue] Message failed: {e}")
+            _, future = batch[0]
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.messages += len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def close(self):
+        """Schrijf wat nog in de rij staat weg en stop (bij het afsluiten van de app)."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        remaining = []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        if remaining:
+            await self._flush(remaining)
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "messages": self.messages,
+            "avg_batch_size": self.messages / self.batches if self.batches else 0.0,
+            "pending": self._queue.qsize() if self._queue else 0,
+        }
+
+
+message_writer = MessageWriteQueue()
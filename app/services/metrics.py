@@ -0,0 +1,16 @@
+"""
+Kleine hulpfuncties voor de statistieken die services via /api/... tonen.
+"""
+from typing import Iterable
+
+
+def percentiles(samples: Iterable[float]) -> dict:
+    """p50, p99 en maximum van een reeks tijden in seconden, in milliseconden."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {"p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    return {
+        "p50_ms": ordered[int(0.50 * (len(ordered) - 1))] * 1000,
+        "p99_ms": ordered[int(0.99 * (len(ordered) - 1))] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
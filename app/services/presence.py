@@ -0,0 +1,304 @@
+"""
+Presence: wie is er online, over alle nodes.
+
+Elke node houdt een lease bij per lokaal verbonden gebruiker. Een lease
+blijft geldig zolang de client iets stuurt (minstens de heartbeat van de
+frontend); na PRESENCE_TTL seconden stilte geldt de gebruiker als offline,
+ook als de TCP-verbinding nog half openstaat.
+
+Wijzigingen gaan als envelope over het clusterkanaal van de broker, en elke
+node houdt daarmee een spiegel bij: per node de set gebruikers die daar
+online is. Een gebruiker is online als minstens één node hem heeft. Nodes
+sturen elke PRESENCE_INTERVAL seconden een heartbeat met het aantal leden;
+een node die drie intervallen stil blijft (gecrasht) valt met al zijn
+gebruikers uit de spiegel. Klopt het aantal niet met de spiegel, dan wordt
+de volledige set van die node opgevraagd.
+
+Alleen echte overgangen (eerste node online, laatste node weg) gaan naar
+de lokale clients, en niet meteen: wijzigingen binnen PRESENCE_COALESCE_MS
+worden samengevoegd (online en weer offline binnen het venster valt weg)
+tot één `presence_join`, `presence_leave` of, bij meerdere, één
+`presence_batch` met `joined` en `left`. Een nieuwe verbinding krijgt eerst
+één `presence_snapshot` met de stand van de laatst verstuurde wijzigingen.
+"""
+from typing import Dict, List, Optional, Set
+import asyncio
+import os
+import time
+
+from app.services.connection_manager import ConnectionManager, manager
+from app.services.message_codec import Frame, encode_event
+
+# Seconden zonder bericht of heartbeat van een client voordat die als offline geldt
+PRESENCE_TTL = float(os.environ.get("PRESENCE_TTL", "75"))
+# Interval van de node-heartbeat en de controle op verlopen leases
+PRESENCE_INTERVAL = float(os.environ.get("PRESENCE_INTERVAL", "10"))
+# Een node zonder heartbeat gedurende zoveel intervallen geldt als weg
+NODE_MISSED_HEARTBEATS = 3
+# Venster waarin presence-wijzigingen tot één frame worden samengevoegd
+PRESENCE_COALESCE_MS = float(os.environ.get("PRESENCE_COALESCE_MS", "250"))
+
+
+class _Lease:
+    __slots__ = ("connections", "last_seen", "avatar_url", "expired")
+
+    def __init__(self, avatar_url: Optional[str]):
+        self.connections = 0
+        self.last_seen = time.monotonic()
+        self.avatar_url = avatar_url
+        self.expired = False
+
+
+class PresenceService:
+    def __init__(
+        self,
+        manager: ConnectionManager,
+        ttl: float = PRESENCE_TTL,
+        interval: float = PRESENCE_INTERVAL,
+        coalesce_window: float = PRESENCE_COALESCE_MS / 1000,
+    ):
+        self.manager = manager
+        self.node_id = manager.node_id
+        self.ttl = ttl
+        self.interval = interval
+        self.coalesce_window = coalesce_window
+        # Lokale leases: {username: _Lease}
+        self._leases: Dict[str, _Lease] = {}
+        # Spiegel van het cluster: {node_id: {username, ...}} en per gebruiker het aantal nodes
+        self._nodes: Dict[str, Set[str]] = {}
+        self._node_seen: Dict[str, float] = {}
+        self._counts: Dict[str, int] = {}
+        self._avatars: Dict[str, Optional[str]] = {}
+        self._task: Optional[asyncio.Task] = None
+        # Wat de clients al weten: {username: avatar_url}, en de snapshot daarvan
+        self._published: Dict[str, Optional[str]] = {}
+        self._snapshot: Optional[Frame] = None
+        # Wijzigingen in het huidige venster: {username: online}
+        self._pending: Dict[str, bool] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.expired_leases = 0
+        self.expired_nodes = 0
+        self.frames_sent = 0
+        self.changes_netted = 0
+
+        manager.register_handler("presence", self._on_presence)
+        manager.register_handler("presence_heartbeat", self._on_heartbeat)
+        manager.register_handler("presence_sync", self._on_sync_request)
+        manager.register_handler("presence_state", self._on_state)
+
+    async def start(self):
+        """Start de heartbeat en vraag de andere nodes om hun leden."""
+        if self._task is not None:
+            return
+        await self.manager.start()
+        self._task = asyncio.create_task(self._run())
+        await self.manager.publish("presence_sync", {"node": None})
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        # Laat de andere nodes meteen weten dat onze gebruikers weg zijn
+        if self._leases:
+            await self.manager.publish("presence_state", {"node": self.node_id, "users": []})
+        self._leases.clear()
+
+    # --- Lokale verbindingen ---
+
+    async def connect(self, username: str, avatar_url: Optional[str] = None):
+        if self._task is None:
+            await self.start()
+        lease = self._leases.get(username)
+        if lease is None:
+            lease = self._leases[username] = _Lease(avatar_url)
+        lease.connections += 1
+        lease.avatar_url = avatar_url
+        await self.touch(username)
+        if lease.connections == 1 and not lease.expired:
+            await self._local_change(username, True)
+
+    async def disconnect(self, username: str):
+        lease = self._leases.get(username)
+        if lease is None:
+            return
+        lease.connections -= 1
+        if lease.connections > 0:
+            return
+        del self._leases[username]
+        if not lease.expired:
+            await self._local_change(username, False)
+
+    async def touch(self, username: str):
+        """Een bericht of heartbeat van de client: verleng de lease (en kom terug na verloop)."""
+        lease = self._leases.get(username)
+        if lease is None:
+            return
+        lease.last_seen = time.monotonic()
+        if lease.expired:
+            lease.expired = False
+            await self._local_change(username, True)
+
+    async def _local_change(self, username: str, online: bool):
+        avatar_url = self._leases[username].avatar_url if online else None
+        self._apply(self.node_id, username, online, avatar_url)
+        await self.manager.publish("presence", {
+            "node": self.node_id, "username": username, "online": online, "avatar_url": avatar_url,
+        })
+
+    # --- Spiegel van het cluster ---
+
+    def is_online(self, username: str) -> bool:
+        return username in self._counts
+
+    def online_users(self) -> List[str]:
+        return list(self._counts)
+
+    def _apply(self, node: str, username: str, online: bool, avatar_url: Optional[str] = None):
+        members = self._nodes.setdefault(node, set())
+        if online:
+            if username in members:
+                return
+            members.add(username)
+            self._avatars[username] = avatar_url
+            count = self._counts.get(username, 0) + 1
+            self._counts[username] = count
+            if count == 1:
+                self._emit(username, True)
+        else:
+            if username not in members:
+                return
+            members.discard(username)
+            count = self._counts.get(username, 0) - 1
+            if count > 0:
+                self._counts[username] = count
+                return
+            self._counts.pop(username, None)
+            self._avatars.pop(username, None)
+            self._emit(username, False)
+
+    def _emit(self, username: str, online: bool):
+        """Een overgang; wordt aan het eind van het venster naar alle clients op deze node gestuurd."""
+        self._pending[username] = online
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.coalesce_window, self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        joined, left = [], []
+        for username, online in self._pending.items():
+            # Online en weer offline (of andersom) binnen het venster: de clients merken niets
+            if online == (username in self._published):
+                self.changes_netted += 1
+                continue
+            if online:
+                avatar_url = self._avatars.get(username)
+                self._published[username] = avatar_url
+                joined.append({"username": username, "avatar_url": avatar_url})
+            else:
+                self._published.pop(username, None)
+                left.append(username)
+        self._pending.clear()
+        if not joined and not left:
+            return
+
+        self._snapshot = None
+        if len(joined) == 1 and not left:
+            event = {"type": "presence_join", **joined[0]}
+        elif len(left) == 1 and not joined:
+            event = {"type": "presence_leave", "username": left[0]}
+        else:
+            event = {"type": "presence_batch", "joined": joined, "left": left}
+        self.frames_sent += 1
+        self.manager.broadcast_local(encode_event(event))
+
+    def snapshot(self) -> Frame:
+        """
+        Alle online gebruikers voor een nieuwe verbinding.
+
+        Komt overeen met de verstuurde wijzigingen, zodat de client daarna
+        alleen de volgende presence_join/leave/batch nodig heeft. Wordt
+        hergebruikt tot de volgende flush.
+        """
+        if self._snapshot is None:
+            self._snapshot = encode_event({
+                "type": "presence_snapshot",
+                "users": [{"username": username, "avatar_url": avatar_url} for username, avatar_url in self._published.items()],
+            })
+        return self._snapshot
+
+    def _drop_node(self, node: str):
+        for username in list(self._nodes.get(node, ())):
+            self._apply(node, username, False)
+        self._nodes.pop(node, None)
+        self._node_seen.pop(node, None)
+
+    async def _on_presence(self, data: dict, channel: str):
+        self._node_seen[data["node"]] = time.monotonic()
+        self._apply(data["node"], data["username"], data["online"], data.get("avatar_url"))
+
+    async def _on_heartbeat(self, data: dict, channel: str):
+        node = data["node"]
+        self._node_seen[node] = time.monotonic()
+        if len(self._nodes.get(node, ())) != data["count"]:
+            await self.manager.publish("presence_sync", {"node": node})
+
+    async def _on_sync_request(self, data: dict, channel: str):
+        if data["node"] in (None, self.node_id):
+            await self.manager.publish("presence_state", {
+                "node": self.node_id,
+                "users": [[username, lease.avatar_url] for username, lease in self._leases.items() if not lease.expired],
+            })
+
+    async def _on_state(self, data: dict, channel: str):
+        node = data["node"]
+        self._node_seen[node] = time.monotonic()
+        users = {username: avatar_url for username, avatar_url in data["users"]}
+        for username in self._nodes.get(node, set()) - users.keys():
+            self._apply(node, username, False)
+        for username, avatar_url in users.items():
+            self._apply(node, username, True, avatar_url)
+
+    # --- Periodiek ---
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self._tick()
+            except Exception as e:
+                print(f"[Presence] Tick failed: {e}")
+
+    async def _tick(self):
+        now = time.monotonic()
+        # Clients die te lang niets stuurden
+        for username, lease in list(self._leases.items()):
+            if not lease.expired and now - lease.last_seen > self.ttl:
+                lease.expired = True
+                self.expired_leases += 1
+                await self._local_change(username, False)
+        # Nodes die niet meer van zich laten horen
+        node_ttl = self.interval * NODE_MISSED_HEARTBEATS
+        for node, seen in list(self._node_seen.items()):
+            if node != self.node_id and now - seen > node_ttl:
+                self.expired_nodes += 1
+                self._drop_node(node)
+        await self.manager.publish("presence_heartbeat", {
+            "node": self.node_id, "count": len(self._nodes.get(self.node_id, ())),
+        })
+
+    def stats(self) -> dict:
+        return {
+            "online": len(self._counts),
+            "local_leases": len(self._leases),
+            "nodes": len([node for node, members in self._nodes.items() if members]),
+            "expired_leases": self.expired_leases,
+            "expired_nodes": self.expired_nodes,
+            "frames_sent": self.frames_sent,
+            "changes_netted": self.changes_netted,
+        }
+
+
+presence = PresenceService(manager)
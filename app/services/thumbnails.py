@@ -0,0 +1,158 @@
+"""
+Thumbnails en blur-placeholders voor afbeeldingen.
+
+Na een upload zet files.py de blob in de rij van de ThumbnailPipeline. Een
+kleine pool workers verkleint de afbeelding tot een WebP-thumbnail naast de
+blob (<sha256>.thumb.webp) en maakt een piepklein, vervaagd voorbeeld dat
+als data-URI in de berichtpayload past. Daarna worden de afmetingen en
+paden op de FileBlob opgeslagen, de berichtcache van de kamer ververst en
+een "attachment-updated" gebeurtenis gebroadcast zodat open clients de
+thumbnail meteen gebruiken.
+
+De thumbnail staat net als de blob buiten static/; alleen
+GET /api/attachments/{id}/thumbnail geeft hem vrij.
+
+Pillow is optioneel: zonder Pillow worden er geen derivaten gemaakt en
+tonen clients gewoon het origineel.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import List, Set
+import asyncio
+import base64
+import os
+
+try:
+    from PIL import Image, ImageFilter, ImageOps
+except ImportError:  # optionele afhankelijkheid
+    Image = None
+
+from sqlalchemy.orm import Session
+
+from app.database.executor import db_executor
+from app.models.file_blob import FileBlob
+from app.services.blob_store import BLOB_DIR
+
+# Aantal workers voor het verkleinen (Pillow geeft de GIL vrij tijdens decoderen/schalen)
+THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", "2"))
+# Langste zijde van een thumbnail in pixels
+THUMBNAIL_MAX_SIZE = int(os.environ.get("THUMBNAIL_MAX_SIZE", "320"))
+THUMBNAIL_QUALITY = 80
+# Langste zijde van de blur-placeholder
+PLACEHOLDER_SIZE = 16
+
+# Formaten waarvoor een thumbnail zin heeft (SVG is al klein en vector)
+THUMBNAIL_CONTENT_TYPES = ("image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp")
+
+
+def thumbnail_path_for(storage_path: str) -> Path:
+    """Altijd onder BLOB_DIR, ook voor een blob die nog op een oude plek staat."""
+    sha256 = Path(storage_path).name.split(".")[0]
+    return BLOB_DIR / sha256[:2] / f"{sha256}.thumb.webp"
+
+
+def render_derivatives(storage_path: str) -> dict:
+    """
+    Maak thumbnail en placeholder voor één afbeelding (blokkerend, draait in een worker).
+
+    Geeft width/height van het origineel, thumbnail_path en placeholder terug.
+    """
+    with Image.open(storage_path) as original:
+        image = ImageOps.exif_transpose(original)
+        width, height = image.size
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+
+        thumbnail = image.copy()
+        thumbnail.thumbnail((THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE), Image.LANCZOS)
+        thumbnail_path = thumbnail_path_for(storage_path)
+        thumbnail_path.parent.mkdir(parents=True, exist_ok=True)
+        thumbnail.save(thumbnail_path, "WEBP", quality=THUMBNAIL_QUALITY, method=4)
+
+        tiny = thumbnail.copy()
+        tiny.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.BILINEAR)
+        tiny = tiny.filter(ImageFilter.GaussianBlur(1))
+        buffer = BytesIO()
+        tiny.save(buffer, "WEBP", quality=40)
+        placeholder = "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+    return {
+        "width": width,
+        "height": height,
+        "thumbnail_path": thumbnail_path.as_posix(),
+        "placeholder": placeholder,
+    }
+
+
+def _save_derivatives(db: Session, blob_id: int, derivatives: dict):
+    db.query(FileBlob).filter(FileBlob.id == blob_id).update(derivatives, synchronize_session=False)
+    db.commit()
+
+
+class ThumbnailPipeline:
+    """Begrensde pool die derivaten maakt zonder de event loop of uploads op te houden."""
+    def __init__(self, max_workers: int = THUMBNAIL_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumb")
+        self._in_progress: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None
+
+    def wants(self, blob: FileBlob, content_type: str) -> bool:
+        return self.enabled and blob.thumbnail_path is None and content_type in THUMBNAIL_CONTENT_TYPES
+
+    def schedule(self, blob_id: int, storage_path: str, room_slug: str, message_id: int, attachment_ids: List[int]):
+        """Plan derivaten voor een blob in; dubbel inplannen van dezelfde blob is een no-op."""
+        if blob_id in self._in_progress:
+            return
+        self._in_progress.add(blob_id)
+        task = asyncio.create_task(self._process(blob_id, storage_path, room_slug, message_id, attachment_ids))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, blob_id: int, storage_path: str, room_slug: str, message_id: int, attachment_ids: List[int]):
+        loop = asyncio.get_running_loop()
+        try:
+            derivatives = await loop.run_in_executor(self._pool, render_derivatives, storage_path)
+            await db_executor.run(_save_derivatives, blob_id, derivatives)
+        except Exception as e:
+            self.failed += 1
+            print(f"[ThumbnailPipeline] Blob {blob_id} failed: {e}")
+            return
+        finally:
+            self._in_progress.discard(blob_id)
+        self.completed += 1
+
+        from app.services.connection_manager import manager
+        from app.services.message_cache import message_cache
+        from app.services.message_codec import encode_event
+
+        # De gecachte berichten hebben nog geen thumbnail
+        message_cache.invalidate(room_slug)
+        for attachment_id in attachment_ids:
+            await manager.broadcast(encode_event({
+                "type": "attachment-updated",
+                "room": room_slug,
+                "message_id": message_id,
+                "attachment_id": attachment_id,
+                "thumbnail_url": f"/api/attachments/{attachment_id}/thumbnail",
+                "placeholder": derivatives["placeholder"],
+                "width": derivatives["width"],
+                "height": derivatives["height"],
+            }), room_slug)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "in_progress": len(self._in_progress),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+thumbnail_pipeline = ThumbnailPipeline()
@@ -0,0 +1,143 @@
+"""
+Samengevoegde typing-indicator per kamer.
+
+Clients sturen `typing` bij het begin van typen, daarna zolang ze typen hooguit
+om de paar seconden opnieuw, en `isTyping: false` als ze stoppen. De
+TypingAggregator houdt per kamer bij wie er typt (met een vervaltijd van
+TYPING_TTL seconden, zodat een weggevallen client vanzelf verdwijnt) en stuurt
+hooguit één frame per TYPING_INTERVAL_MS per kamer, alleen als de groep
+veranderd is:
+
+    {"type": "typing", "room": "<slug>", "users": ["alice", "bob"]}
+
+Start en stop van een lokale gebruiker gaan als envelope over room:<slug>,
+zodat elke node dezelfde groep ziet en zijn eigen clients bijwerkt.
+"""
+from typing import Dict, List, Optional
+import asyncio
+import os
+import time
+
+from app.services.connection_manager import ConnectionManager, manager
+from app.services.message_codec import encode_event
+
+# Seconden na de laatste typing-event waarna iemand niet meer als typend geldt
+TYPING_TTL = float(os.environ.get("TYPING_TTL", "5"))
+# Minimale tijd tussen twee typing-frames in dezelfde kamer
+TYPING_INTERVAL_MS = float(os.environ.get("TYPING_INTERVAL_MS", "500"))
+
+
+class _RoomTyping:
+    __slots__ = ("typists", "published", "last_sent", "last_flush", "handle")
+
+    def __init__(self):
+        # {username: vervaltijd}
+        self.typists: Dict[str, float] = {}
+        # Lokale gebruikers: wanneer hun start voor het laatst naar de andere nodes ging
+        self.published: Dict[str, float] = {}
+        self.last_sent: List[str] = []
+        self.last_flush = 0.0
+        self.handle: Optional[asyncio.TimerHandle] = None
+
+
+class TypingAggregator:
+    def __init__(self, manager: ConnectionManager, ttl: float = TYPING_TTL, interval: float = TYPING_INTERVAL_MS / 1000):
+        self.manager = manager
+        self.ttl = ttl
+        self.interval = interval
+        self._rooms: Dict[str, _RoomTyping] = {}
+        self.events_received = 0
+        self.frames_sent = 0
+        manager.register_handler("typing", self._on_remote)
+
+    async def update(self, room_slug: str, username: str, is_typing: bool):
+        """Een typing-event van een lokale client (gebruikersnaam uit de authenticatie)."""
+        self.events_received += 1
+        room = self._rooms.get(room_slug)
+        if room is None:
+            if not is_typing:
+                return
+            room = self._rooms[room_slug] = _RoomTyping()
+
+        now = time.monotonic()
+        if is_typing:
+            started = username not in room.typists
+            room.typists[username] = now + self.ttl
+            # De andere nodes laten hun kopie ook verlopen; verleng die op tijd
+            if started or now - room.published.get(username, 0.0) > self.ttl / 2:
+                room.published[username] = now
+                await self.manager.publish("typing", {"username": username, "typing": True}, f"room:{room_slug}")
+            if not started:
+                return
+        else:
+            if room.typists.pop(username, None) is None:
+                return
+            room.published.pop(username, None)
+            await self.manager.publish("typing", {"username": username, "typing": False}, f"room:{room_slug}")
+        self._request_flush(room_slug, room)
+
+    async def _on_remote(self, data: dict, channel: str):
+        room_slug = channel.partition(":")[2]
+        room = self._rooms.get(room_slug)
+        if room is None:
+            if not data["typing"]:
+                return
+            room = self._rooms[room_slug] = _RoomTyping()
+        if data["typing"]:
+            started = data["username"] not in room.typists
+            room.typists[data["username"]] = time.monotonic() + self.ttl
+            if not started:
+                return
+        elif room.typists.pop(data["username"], None) is None:
+            return
+        self._request_flush(room_slug, room)
+
+    def _request_flush(self, room_slug: str, room: _RoomTyping):
+        """Meteen versturen, of zodra het interval sinds het vorige frame om is."""
+        loop = asyncio.get_running_loop()
+        due = room.last_flush + self.interval
+        if room.handle is not None:
+            if room.handle.when() <= loop.time() + max(0.0, due - time.monotonic()):
+                return
+            room.handle.cancel()
+            room.handle = None
+        delay = due - time.monotonic()
+        if delay <= 0:
+            self._flush(room_slug)
+        else:
+            room.handle = loop.call_later(delay, self._flush, room_slug)
+
+    def _flush(self, room_slug: str):
+        room = self._rooms.get(room_slug)
+        if room is None:
+            return
+        room.handle = None
+        now = time.monotonic()
+        for username in [username for username, expires in room.typists.items() if expires <= now]:
+            del room.typists[username]
+            room.published.pop(username, None)
+
+        users = sorted(room.typists)
+        if users != room.last_sent:
+            room.last_sent = users
+            room.last_flush = now
+            self.frames_sent += 1
+            self.manager.broadcast_local(encode_event({"type": "typing", "room": room_slug, "users": users}), room_slug)
+
+        if room.typists:
+            # Wakker worden als de eerstvolgende vervalt
+            delay = max(self.interval, min(room.typists.values()) - now)
+            room.handle = asyncio.get_running_loop().call_later(delay, self._flush, room_slug)
+        elif not room.last_sent:
+            del self._rooms[room_slug]
+
+    def stats(self) -> dict:
+        return {
+            "rooms": len(self._rooms),
+            "typing": sum(len(room.typists) for room in self._rooms.values()),
+            "events_received": self.events_received,
+            "frames_sent": self.frames_sent,
+        }
+
+
+typing_aggregator = TypingAggregator(manager)
@@ -0,0 +1,115 @@
+"""
+Opslag voor hervatbare uploads.
+
+Elke upload-sessie bestaat uit een .part-bestand met de tot nu toe
+ontvangen bytes en een .json-bestand met de metadata. De offset van een
+sessie is simpelweg de grootte van het .part-bestand, zodat een client na
+een verbroken verbinding altijd verder kan vanaf wat echt op schijf staat,
+ook na een herstart van de server.
+"""
+from pathlib import Path
+from typing import Optional
+import json
+import os
+import time
+import uuid
+
+# Map voor onvoltooide uploads (niet onder /static, want niet publiek)
+UPLOAD_SESSION_DIR = Path(os.environ.get("UPLOAD_SESSION_DIR", "data/upload_sessions"))
+# Onvoltooide uploads worden na deze tijd opgeruimd (seconden)
+UPLOAD_SESSION_TTL = int(os.environ.get("UPLOAD_SESSION_TTL", str(24 * 60 * 60)))
+
+
+class UploadSession:
+    def __init__(self, upload_id: str, username: str, room_slug: str, filename: str,
+                 content_type: str, size: int, created_at: float, directory: Path):
+        self.upload_id = upload_id
+        self.username = username
+        self.room_slug = room_slug
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.created_at = created_at
+        self.part_path = directory / f"{upload_id}.part"
+        self.meta_path = directory / f"{upload_id}.json"
+
+    @property
+    def offset(self) -> int:
+        """Aantal bytes dat al op schijf staat."""
+        try:
+            return self.part_path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def to_dict(self) -> dict:
+        return {
+            "upload_id": self.upload_id,
+            "username": self.username,
+            "room_slug": self.room_slug,
+            "filename": self.filename,
+            "content_type": self.content_type,
+            "size": self.size,
+            "created_at": self.created_at,
+        }
+
+
+class UploadSessionStore:
+    def __init__(self, directory: Path = UPLOAD_SESSION_DIR, ttl: int = UPLOAD_SESSION_TTL):
+        self.directory = directory
+        self.ttl = ttl
+
+    def create(self, username: str, room_slug: str, filename: str, content_type: str, size: int) -> UploadSession:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.expire_stale()
+        session = UploadSession(
+            upload_id=uuid.uuid4().hex,
+            username=username,
+            room_slug=room_slug,
+            filename=filename,
+            content_type=content_type,
+            size=size,
+            created_at=time.time(),
+            directory=self.directory,
+        )
+        session.part_path.touch()
+        session.meta_path.write_text(json.dumps(session.to_dict()))
+        return session
+
+    def get(self, upload_id: str) -> Optional[UploadSession]:
+        """De sessie, of None als hij niet bestaat of ouder is dan de TTL."""
+        session = self._load(upload_id)
+        if session is not None and self._expired(session):
+            self.delete(session)
+            return None
+        return session
+
+    def _load(self, upload_id: str) -> Optional[UploadSession]:
+        # upload_id komt uit de URL; alleen hex toestaan voorkomt paden buiten de map
+        if not upload_id.isalnum():
+            return None
+        meta_path = self.directory / f"{upload_id}.json"
+        try:
+            data = json.loads(meta_path.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+        return UploadSession(directory=self.directory, **data)
+
+    def delete(self, session: UploadSession):
+        for path in (session.part_path, session.meta_path):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def expire_stale(self):
+        """Ruim sessies op die langer dan de TTL onvoltooid zijn gebleven."""
+        for meta_path in self.directory.glob("*.json"):
+            session = self._load(meta_path.stem)
+            if session is not None and self._expired(session):
+                self.delete(session)
+
+    def _expired(self, session: UploadSession) -> bool:
+        return session.created_at < time.time() - self.ttl
+
+
+upload_sessions = UploadSessionStore()
@@ -0,0 +1,85 @@
+"""
+Ruim blobs op waar geen bijlage meer naar verwijst.
+
+Herberekent eerst ref_count uit file_attachments (zodat een gemist
+ophogen/verlagen niets kan lekken), verwijdert dan blobs met ref_count 0 die
+ouder zijn dan de grace-periode, en gooit achtergebleven tijdelijke
+uploadbestanden weg.
+
+Gebruik: python gc_file_blobs.py [--grace-hours 1] [--dry-run]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import delete, func, select, update
+
+from app.database.database import SessionLocal
+# Import all models to ensure relationships are properly set up
+from app.models.user import User
+from app.models.message import Message
+from app.models.room import Room
+from app.models.room_member import RoomMember
+from app.models.call_room import CallRoom
+from app.models.direct_message import DirectMessage
+from app.models.file_attachment import FileAttachment
+from app.models.file_blob import FileBlob
+from app.services.blob_store import BLOB_TMP_DIR
+
+
+def collect_garbage(grace_hours: float = 1.0, dry_run: bool = False):
+    db = SessionLocal()
+    try:
+        references = (
+            select(func.count(FileAttachment.id))
+            .where(FileAttachment.blob_id == FileBlob.id)
+            .scalar_subquery()
+        )
+        db.execute(update(FileBlob).values(ref_count=references).execution_options(synchronize_session=False))
+
+        # Een net aangemaakte blob kan nog op zijn eerste bijlage wachten
+        cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+        garbage = db.query(FileBlob).filter(FileBlob.ref_count == 0, FileBlob.created_at < cutoff).all()
+
+        freed = 0
+        doomed = []
+        for blob in garbage:
+            print(f"🗑️  {blob.sha256} ({blob.size} bytes) {blob.storage_path}")
+            if dry_run:
+                continue
+            # Alleen verwijderen als de blob nog steeds ongebruikt is
+            deleted = db.execute(
+                delete(FileBlob).where(FileBlob.id == blob.id, FileBlob.ref_count == 0)
+            ).rowcount
+            if deleted:
+                doomed.extend(path for path in (blob.storage_path, blob.thumbnail_path) if path)
+                freed += blob.size
+
+        if dry_run:
+            db.rollback()
+        else:
+            db.commit()
+
+        # Bestanden pas na de commit weg: faalt die, dan verwijzen de rijen nog naar iets
+        for path in doomed:
+            Path(path).unlink(missing_ok=True)
+
+        stale = 0
+        if BLOB_TMP_DIR.exists() and not dry_run:
+            for temp_file in BLOB_TMP_DIR.iterdir():
+                if temp_file.stat().st_mtime < time.time() - grace_hours * 3600:
+                    temp_file.unlink(missing_ok=True)
+                    stale += 1
+
+        print(f"✅ {len(garbage)} unreferenced blobs, {freed / (1024 * 1024):.2f}MB freed, {stale} stale temp files removed")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verwijder ongebruikte bijlage-blobs")
+    parser.add_argument("--grace-hours", type=float, default=1.0)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    collect_garbage(args.grace_hours, args.dry_run)
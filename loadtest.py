@@ -0,0 +1,491 @@
+"""
+Belastingstest van de chat: WebSockets, signalering en uploads.
+
+Start de app (main:app) in een eigen uvicorn-proces tegen een tijdelijke
+SQLite-database en laat N gebruikers verdeeld over M kamers achter elkaar:
+
+- verbinden (token, subscribe op hun kamer en het calls-kanaal),
+- berichten sturen in hun kamer,
+- typing-events sturen,
+- verbreken en opnieuw verbinden (presence-churn),
+- ICE-candidates naar een partner sturen (call-signalering),
+- bestanden uploaden naar hun kamer.
+
+Per fase meet het script doorvoer, de fan-out-latentie (van versturen tot
+ontvangst bij elke ontvanger, p50/p99/max) en het aantal SQL-statements per
+operatie; daarnaast het geheugen van de server per verbinding. Het rapport
+is JSON met gesorteerde sleutels, zodat je twee commits kunt diffen.
+
+De clients draaien in dit proces op één event loop; de latenties bevatten
+dus ook hun eigen wachttijd. Vergelijk runs met dezelfde instellingen.
+
+Gebruik: python loadtest.py [--users 50] [--rooms 5] [--messages 20] [--output rapport.json]
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from pathlib import Path
+
+import websockets
+
+from app.services.metrics import percentiles
+
+REPO_DIR = Path(__file__).resolve().parent
+STATS_PATH = "/_loadtest/stats"
+
+
+def _percentiles(samples) -> dict:
+    return {key: round(value, 3) for key, value in percentiles(samples).items()}
+
+
+def _rss_kb() -> int:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource  # geen /proc: piekgeheugen (KB op Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# --- SERVER (kindproces) ---
+
+def serve(port: int):
+    """Draai main:app met een teller van SQL-statements en een stats-route."""
+    sys.path.insert(0, str(REPO_DIR))
+    import uvicorn
+    from sqlalchemy import event
+    import main
+    from app.database.database import engine, read_engine
+    from app.services.connection_manager import manager
+
+    lock = threading.Lock()
+    counts = {"statements": 0}
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        with lock:
+            counts["statements"] += 1
+
+    for counted_engine in {engine, read_engine}:
+        event.listen(counted_engine, "before_cursor_execute", count_statement)
+
+    @main.app.get(STATS_PATH, include_in_schema=False)
+    def loadtest_stats():
+        gc.collect()
+        with lock:
+            statements = counts["statements"]
+        return {"sql_statements": statements, "rss_kb": _rss_kb(), "connections": len(manager.websocket_rooms)}
+
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+# --- OPZET ---
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def prepare_database(users: int, rooms: int):
+    """Schema, kamers en gebruikers in de (tijdelijke) database; geeft [(naam, token, kamer)] terug."""
+    sys.path.insert(0, str(REPO_DIR))
+    import main  # noqa: F401  (registreert alle modellen)
+    from app.database.database import Base, SessionLocal, engine
+    from app.auth.security import create_access_token
+    from app.models.room import Room
+    from app.models.room_member import RoomMember
+    from app.models.user import User
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        room_rows = [Room(name=f"Load {i}", slug=f"load-{i}") for i in range(rooms)]
+        user_rows = [User(username=f"load{i}", hashed_password="!") for i in range(users)]
+        db.add_all(room_rows + user_rows)
+        db.flush()
+        db.add_all(
+            RoomMember(room_id=room_rows[i % rooms].id, user_id=user.id)
+            for i, user in enumerate(user_rows)
+        )
+        db.commit()
+    finally:
+        db.close()
+    engine.dispose()
+
+    return [
+        (f"load{i}", create_access_token({"sub": f"load{i}"}), f"load-{i % rooms}")
+        for i in range(users)
+    ]
+
+
+# --- CLIENTS ---
+
+class Tracker:
+    """Verzendtijden per markering en de gemeten fan-out-latenties."""
+    def __init__(self):
+        self.sent = {}
+        self.latencies = []
+        self.received = 0
+
+    def mark(self) -> str:
+        tag = uuid.uuid4().hex[:12]
+        self.sent[tag] = time.perf_counter()
+        return tag
+
+    def receive(self, tag):
+        sent_at = self.sent.get(tag)
+        if sent_at is not None:
+            self.latencies.append(time.perf_counter() - sent_at)
+            self.received += 1
+
+    def reset(self):
+        self.sent.clear()
+        self.latencies = []
+        self.received = 0
+
+
+class LoadClient:
+    def __init__(self, url: str, username: str, token: str, room: str, tracker: Tracker):
+        self.url = url
+        self.username = username
+        self.token = token
+        self.room = room
+        self.tracker = tracker
+        self.ws = None
+        self.reader = None
+        self.subscribed = None
+
+    async def connect(self) -> float:
+        """Verbind en abonneer; geeft de tijd tot de bevestiging van de kamer terug."""
+        started = time.perf_counter()
+        self.subscribed = asyncio.get_running_loop().create_future()
+        self.ws = await websockets.connect(self.url, max_size=None)
+        await self.ws.send(json.dumps({"token": self.token}))
+        await self.ws.send(json.dumps({"type": "subscribe", "room": self.room}))
+        await self.ws.send(json.dumps({"type": "subscribe", "channel": "calls"}))
+        self.reader = asyncio.create_task(self._read())
+        await self.subscribed
+        return time.perf_counter() - started
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+            await self.reader
+            self.ws = None
+
+    async def send(self, event: dict):
+        await self.ws.send(json.dumps(event))
+
+    async def _read(self):
+        try:
+            async for raw in self.ws:
+                try:
+                    event = json.loads(raw)
+                except ValueError:
+                    continue
+                kind = event.get("type", "message") if isinstance(event, dict) else "other"
+                if kind == "subscribed" and event.get("room") == self.room and not self.subscribed.done():
+                    self.subscribed.set_result(True)
+                elif kind == "message":
+                    self.tracker.receive(event.get("content"))
+                elif kind == "ice-candidate":
+                    self.tracker.receive(event.get("candidate", {}).get("tag"))
+        except websockets.ConnectionClosed:
+            pass
+
+
+class LoadTest:
+    def __init__(self, args, base_url: str, accounts):
+        self.args = args
+        self.base_url = base_url
+        self.tracker = Tracker()
+        ws_url = base_url.replace("http://", "ws://") + "/api/ws"
+        self.clients = [LoadClient(ws_url, username, token, room, self.tracker) for username, token, room in accounts]
+        self.room_sizes = {}
+        for client in self.clients:
+            self.room_sizes[client.room] = self.room_sizes.get(client.room, 0) + 1
+
+    def _stats(self) -> dict:
+        with urllib.request.urlopen(self.base_url + STATS_PATH) as response:
+            return json.loads(response.read())
+
+    async def stats(self) -> dict:
+        return await asyncio.to_thread(self._stats)
+
+    async def _wait_for(self, expected: int, timeout: float):
+        deadline = time.perf_counter() + timeout
+        while self.tracker.received < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+
+    async def phase(self, name: str, work, expected: int = 0) -> dict:
+        """Voer `work` uit (een coroutine die het aantal operaties teruggeeft) en meet."""
+        self.tracker.reset()
+        # Achtergrondwerk van de vorige fase (commits, presence) laten uitlopen
+        await asyncio.sleep(self.args.settle)
+        before = await self.stats()
+        started = time.perf_counter()
+        ops, latencies = await work()
+        if expected:
+            await self._wait_for(expected, self.args.timeout)
+        duration = time.perf_counter() - started
+        await asyncio.sleep(self.args.settle)
+        after = await self.stats()
+
+        statements = after["sql_statements"] - before["sql_statements"]
+        if latencies is None:
+            latencies = self.tracker.latencies
+        result = {
+            "ops": ops,
+            "duration_s": round(duration, 3),
+            "ops_per_s": round(ops / duration, 1) if duration else 0.0,
+            "sql_statements": statements,
+            "sql_per_op": round(statements / ops, 3) if ops else 0.0,
+        }
+        if latencies:
+            result["latency"] = _percentiles(latencies)
+        if expected:
+            result["deliveries"] = self.tracker.received
+            result["deliveries_per_s"] = round(self.tracker.received / duration, 1) if duration else 0.0
+            result["missing_deliveries"] = expected - self.tracker.received
+        print(f"[loadtest] {name}: {ops} ops in {duration:.2f}s", file=sys.stderr)
+        return result
+
+    async def _gather(self, coroutines, limit: int = 0):
+        if limit:
+            semaphore = asyncio.Semaphore(limit)
+
+            async def limited(coroutine):
+                async with semaphore:
+                    return await coroutine
+            coroutines = [limited(coroutine) for coroutine in coroutines]
+        return await asyncio.gather(*coroutines)
+
+    # --- Fasen ---
+
+    async def connect_all(self):
+        times = await self._gather([client.connect() for client in self.clients], limit=50)
+        return len(self.clients), times
+
+    async def send_messages(self):
+        async def run(client):
+            for _ in range(self.args.messages):
+                await client.send({"type": "message", "room": client.room, "content": self.tracker.mark()})
+                await asyncio.sleep(self.args.interval)
+        await self._gather([run(client) for client in self.clients])
+        return len(self.clients) * self.args.messages, None
+
+    async def send_typing(self):
+        async def run(client):
+            for _ in range(self.args.typing):
+                await client.send({"type": "typing", "room": client.room, "isTyping": True})
+                await asyncio.sleep(self.args.interval)
+                await client.send({"type": "typing", "room": client.room, "isTyping": False})
+                await asyncio.sleep(self.args.interval)
+        await self._gather([run(client) for client in self.clients])
+        return len(self.clients) * self.args.typing * 2, None
+
+    async def churn(self):
+        churning = self.clients[:max(1, int(len(self.clients) * self.args.churn))]
+
+        async def run(client):
+            await client.close()
+            await asyncio.sleep(self.args.interval)
+            return await client.connect()
+        times = await self._gather([run(client) for client in churning], limit=50)
+        return len(churning), times
+
+    async def relay_ice(self):
+        async def run(client, peer):
+            for _ in range(self.args.ice):
+                await client.send({
+                    "type": "ice-candidate",
+                    "to": peer.username,
+                    "candidate": {"candidate": "candidate:0 1 UDP 2122252543 10.0.0.1 50000 typ host", "tag": self.tracker.mark()},
+                })
+                await asyncio.sleep(self.args.interval)
+        pairs = [(client, self.clients[i ^ 1]) for i, client in enumerate(self.clients) if (i ^ 1) < len(self.clients)]
+        await self._gather([run(client, peer) for client, peer in pairs])
+        return len(pairs) * self.args.ice, None
+
+    def _upload(self, client: LoadClient, tag: str) -> float:
+        boundary = uuid.uuid4().hex
+        payload = os.urandom(self.args.upload_size // 2).hex().encode()
+        body = b"".join([
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"content\"\r\n\r\n{tag}\r\n".encode(),
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{tag}.txt\"\r\n"
+            f"Content-Type: text/plain\r\n\r\n".encode(),
+            payload,
+            f"\r\n--{boundary}--\r\n".encode(),
+        ])
+        request = urllib.request.Request(
+            f"{self.base_url}/api/rooms/{client.room}/upload",
+            data=body,
+            headers={
+                "Authorization": f"Bearer {client.token}",
+                "Content-Type": f"multipart/form-data; boundary={boundary}",
+            },
+        )
+        started = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            response.read()
+        return time.perf_counter() - started
+
+    async def upload_files(self):
+        async def run(i):
+            client = self.clients[i % len(self.clients)]
+            return await asyncio.to_thread(self._upload, client, self.tracker.mark())
+        self.upload_request_times = await self._gather([run(i) for i in range(self.args.uploads)], limit=self.args.upload_concurrency)
+        return self.args.uploads, None
+
+    def _expected_room_deliveries(self, per_client: int) -> int:
+        return sum(self.room_sizes[client.room] for client in self.clients) * per_client
+
+    async def run(self) -> dict:
+        idle = await self.stats()
+        phases = {}
+        phases["connect"] = await self.phase("connect", self.connect_all)
+        connected = await self.stats()
+
+        phases["messages"] = await self.phase("messages", self.send_messages, self._expected_room_deliveries(self.args.messages))
+        if self.args.typing:
+            phases["typing"] = await self.phase("typing", self.send_typing)
+        if self.args.churn:
+            phases["presence_churn"] = await self.phase("presence_churn", self.churn)
+        if self.args.ice:
+            pairs = len(self.clients) - len(self.clients) % 2
+            phases["ice_relay"] = await self.phase("ice_relay", self.relay_ice, pairs * self.args.ice)
+        if self.args.uploads:
+            expected = sum(self.room_sizes[self.clients[i % len(self.clients)].room] for i in range(self.args.uploads))
+            phases["uploads"] = await self.phase("uploads", self.upload_files, expected)
+            phases["uploads"]["request_latency"] = _percentiles(self.upload_request_times)
+            phases["uploads"]["bytes"] = self.args.uploads * self.args.upload_size
+
+        await self._gather([client.close() for client in self.clients])
+        return {
+            "memory": {
+                "rss_idle_kb": idle["rss_kb"],
+                "rss_connected_kb": connected["rss_kb"],
+                "connections": connected["connections"],
+                "per_connection_kb": round((connected["rss_kb"] - idle["rss_kb"]) / max(1, connected["connections"]), 2),
+            },
+            "phases": phases,
+        }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _wait_for_server(base_url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("De server is gestopt tijdens het opstarten")
+        try:
+            with urllib.request.urlopen(base_url + STATS_PATH, timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("De server startte niet op tijd")
+
+
+def main(args):
+    workdir = Path(tempfile.mkdtemp(prefix="chatapp-loadtest-"))
+    # Uploads en static/ relatief aan de werkmap; de templates uit de repository
+    (workdir / "static").mkdir()
+    (workdir / "templates").symlink_to(REPO_DIR / "templates")
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{workdir / 'loadtest.db'}"}
+    os.environ.update(env)
+    os.chdir(workdir)
+
+    process = None
+    log = open(workdir / "server.log", "w")
+    try:
+        accounts = prepare_database(args.users, args.rooms)
+        port = _free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        process = subprocess.Popen(
+            [sys.executable, str(Path(__file__).resolve()), "--serve", str(port)],
+            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=log,
+        )
+        _wait_for_server(base_url, process)
+
+        results = asyncio.run(LoadTest(args, base_url, accounts).run())
+        report = {
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "config": {
+                "users": args.users,
+                "rooms": args.rooms,
+                "messages_per_user": args.messages,
+                "typing_per_user": args.typing,
+                "churn_fraction": args.churn,
+                "ice_per_user": args.ice,
+                "uploads": args.uploads,
+                "upload_size": args.upload_size,
+                "interval_s": args.interval,
+            },
+            **results,
+        }
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if args.output:
+            Path(args.output).write_text(output + "\n")
+        else:
+            print(output)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        log.close()
+        os.chdir(REPO_DIR)
+        if args.keep:
+            print(f"[loadtest] Werkmap: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Belastingstest van de chat tegen een tijdelijke database")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rooms", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=20, help="berichten per gebruiker")
+    parser.add_argument("--typing", type=int, default=10, help="typing-start/stop-paren per gebruiker")
+    parser.add_argument("--churn", type=float, default=0.2, help="deel van de gebruikers dat opnieuw verbindt")
+    parser.add_argument("--ice", type=int, default=20, help="ICE-candidates per gebruiker")
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--upload-size", type=int, default=64 * 1024, help="bytes per upload")
+    parser.add_argument("--upload-concurrency", type=int, default=8)
+    parser.add_argument("--interval", type=float, default=0.05, help="seconden tussen twee events van één client")
+    parser.add_argument("--settle", type=float, default=0.5, help="wachttijd tussen fasen (seconden)")
+    parser.add_argument("--timeout", type=float, default=30, help="maximale wachttijd op afleveringen per fase")
+    parser.add_argument("--output", help="schrijf het rapport naar dit bestand i.p.v. stdout")
+    parser.add_argument("--keep", action="store_true", help="werkmap (database, uploads, server.log) bewaren")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve)
+    else:
+        main(args)
@@ -1,5 +1,5 @@
 from fastapi import FastAPI
-from fastapi.responses import RedirectResponse
+from fastapi.responses import PlainTextResponse, RedirectResponse
 import uvicorn
 from fastapi.staticfiles import StaticFiles
 from app.database.database import engine, Base, SessionLocal
@@ -37,6 +37,32 @@ def ensure_default_rooms():
     finally:
         db.close()
 
+# Schrijf berichten die nog in de group-commit rij staan weg bij het afsluiten
+@app.on_event("shutdown")
+async def flush_message_writer():
+    from app.services.message_writer import message_writer
+    await message_writer.close()
+
+# Stop de processen van de wachtwoordpool
+@app.on_event("shutdown")
+def stop_password_pool():
+    from app.auth.passwords import password_hasher
+    password_hasher.shutdown()
+
+# Verbind met de pub/sub-backplane, zodat deze node ook berichten van andere nodes krijgt,
+# en start de presence-heartbeat
+@app.on_event("startup")
+async def start_broker():
+    from app.services.presence import presence
+    await presence.start()
+
+@app.on_event("shutdown")
+async def stop_broker():
+    from app.services.connection_manager import manager
+    from app.services.presence import presence
+    await presence.close()
+    await manager.close()
+
 app.include_router(auth.router, prefix="/auth")
 app.include_router(chat.router, prefix="/api")
 app.include_router(direct_messages.router, prefix="/api")
@@ -50,9 +76,9 @@ app.include_router(pages.router)
 @app.get("/")
 def read_root():
     return RedirectResponse(url="/login")
-@app.route('/ads.txt')
+@app.get('/ads.txt', response_class=PlainTextResponse)
 def ads_txt():
-    return "google.com, pub-0000000000000000, DIRECT, f08c47fec0942fa0", 200, {'Content-Type': 'text/plain'}
+    return "google.com, pub-0000000000000000, DIRECT, f08c47fec0942fa0"
 
 
 if __name__ == "__main__":
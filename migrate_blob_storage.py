@@ -0,0 +1,77 @@
+"""
+Database migration: blobs en thumbnails uit static/ halen.
+
+static/ wordt zonder toegangscontrole geserveerd, dus blobs in
+static/uploads/blobs/ waren voor iedereen met de URL te downloaden. Dit
+script verplaatst ze (met thumbnails en tijdelijke bestanden) naar
+BLOB_DIR (standaard data/blobs/), past storage_path en thumbnail_path aan
+en laat file_path van elke bijlage naar GET /api/attachments/{id} wijzen.
+"""
+import sqlite3
+from pathlib import Path
+
+from app.services.blob_store import BLOB_DIR
+
+OLD_BLOB_DIR = Path("static/uploads/blobs")
+
+
+def move_files() -> int:
+    """Verplaats alle bestanden onder OLD_BLOB_DIR naar dezelfde plek onder BLOB_DIR."""
+    moved = 0
+    if not OLD_BLOB_DIR.exists():
+        return moved
+    for source in sorted(OLD_BLOB_DIR.rglob("*")):
+        if not source.is_file():
+            continue
+        target = BLOB_DIR / source.relative_to(OLD_BLOB_DIR)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        source.replace(target)
+        moved += 1
+    # Lege mappen opruimen, diepste eerst
+    for directory in sorted(OLD_BLOB_DIR.rglob("*"), reverse=True):
+        if directory.is_dir() and not any(directory.iterdir()):
+            directory.rmdir()
+    if not any(OLD_BLOB_DIR.iterdir()):
+        OLD_BLOB_DIR.rmdir()
+    return moved
+
+
+def migrate():
+    conn = sqlite3.connect('chat_app.db')
+    cursor = conn.cursor()
+
+    try:
+        moved = move_files()
+        print(f"✅ {moved} files moved from {OLD_BLOB_DIR} to {BLOB_DIR}")
+
+        old_prefix = OLD_BLOB_DIR.as_posix() + "/"
+        new_prefix = BLOB_DIR.as_posix() + "/"
+        cursor.execute("PRAGMA table_info(file_blobs)")
+        columns = [column[1] for column in cursor.fetchall()]
+        for column in ("storage_path", "thumbnail_path"):
+            if column not in columns:
+                continue
+            cursor.execute(
+                f"UPDATE file_blobs SET {column} = ? || substr({column}, ?) WHERE {column} LIKE ?",
+                (new_prefix, len(old_prefix) + 1, old_prefix + "%")
+            )
+            print(f"✅ Updated {column} of {cursor.rowcount} blobs")
+
+        cursor.execute(
+            "UPDATE file_attachments SET file_path = '/api/attachments/' || id "
+            "WHERE blob_id IS NOT NULL AND file_path != '/api/attachments/' || id"
+        )
+        print(f"✅ file_path of {cursor.rowcount} attachments points to /api/attachments/{{id}}")
+
+        conn.commit()
+
+    except sqlite3.Error as e:
+        print(f"❌ Error: {e}")
+        raise
+    finally:
+        conn.close()
+
+    print("✅ Migration complete!")
+
+if __name__ == "__main__":
+    migrate()
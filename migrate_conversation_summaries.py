@@ -0,0 +1,67 @@
+"""
+Database migration: samenvatting van het laatste bericht per gesprek (inbox).
+
+Voegt last_message_id, last_message_snippet en last_message_at toe aan
+conversations (zie migrate_conversations.py), maakt de rijen aan voor
+gesprekken waarin een gebruiker alleen zelf berichten stuurde, en vult de
+samenvatting uit direct_messages.
+"""
+import sqlite3
+
+from app.services.chat_crud import message_snippet
+
+def migrate():
+    conn = sqlite3.connect('chat_app.db')
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("PRAGMA table_info(conversations)")
+        columns = [column[1] for column in cursor.fetchall()]
+        for name, definition in [
+            ('last_message_id', 'INTEGER'),
+            ('last_message_snippet', 'VARCHAR'),
+            ('last_message_at', 'DATETIME'),
+        ]:
+            if name not in columns:
+                cursor.execute(f"ALTER TABLE conversations ADD COLUMN {name} {definition}")
+                print(f"✅ Added {name} column to conversations")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS ix_conversations_owner_last_message
+            ON conversations (owner_id, last_message_id)
+        """)
+
+        # De kant van de afzender
+        cursor.execute("""
+            INSERT OR IGNORE INTO conversations (owner_id, peer_id, last_read_message_id, unread_count)
+            SELECT DISTINCT sender_id, receiver_id, 0, 0 FROM direct_messages
+        """)
+
+        cursor.execute("""
+            SELECT c.id, m.id, m.content, m.timestamp
+            FROM conversations c
+            JOIN direct_messages m ON m.id = (
+                SELECT MAX(id) FROM direct_messages
+                WHERE (sender_id = c.owner_id AND receiver_id = c.peer_id)
+                   OR (sender_id = c.peer_id AND receiver_id = c.owner_id)
+            )
+        """)
+        rows = cursor.fetchall()
+        cursor.executemany(
+            "UPDATE conversations SET last_message_id = ?, last_message_snippet = ?, last_message_at = ? WHERE id = ?",
+            [(message_id, message_snippet(content), timestamp, conversation_id)
+             for conversation_id, message_id, content, timestamp in rows]
+        )
+
+        conn.commit()
+        print(f"✅ Summaries filled for {len(rows)} conversations")
+
+    except sqlite3.Error as e:
+        print(f"❌ Error: {e}")
+        raise
+    finally:
+        conn.close()
+
+    print("✅ Migration complete!")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,58 @@
+"""
+Database migration: leesstatus van directe berichten per gesprek.
+
+Maakt de conversations tabel aan (watermerk last_read_message_id en teller
+unread_count per gebruiker en gesprekspartner) en vult hem uit de bestaande
+direct_messages: het watermerk is het laatste gelezen bericht, de teller het
+aantal berichten daarna.
+"""
+import sqlite3
+
+def migrate():
+    conn = sqlite3.connect('chat_app.db')
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                owner_id INTEGER NOT NULL REFERENCES users (id),
+                peer_id INTEGER NOT NULL REFERENCES users (id),
+                last_read_message_id INTEGER NOT NULL DEFAULT 0,
+                unread_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_conversations_owner_peer ON conversations (owner_id, peer_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_conversations_id ON conversations (id)")
+        print("✅ conversations table created")
+
+        # Bestaande gesprekken
+        cursor.execute("""
+            INSERT OR IGNORE INTO conversations (owner_id, peer_id, last_read_message_id, unread_count)
+            SELECT receiver_id, sender_id, COALESCE(MAX(CASE WHEN is_read THEN id END), 0), 0
+            FROM direct_messages
+            GROUP BY receiver_id, sender_id
+        """)
+        print(f"✅ {cursor.rowcount} conversations added")
+        cursor.execute("""
+            UPDATE conversations SET unread_count = (
+                SELECT COUNT(*) FROM direct_messages
+                WHERE direct_messages.sender_id = conversations.peer_id
+                  AND direct_messages.receiver_id = conversations.owner_id
+                  AND direct_messages.id > conversations.last_read_message_id
+            )
+        """)
+
+        conn.commit()
+        print("✅ Unread counters filled")
+
+    except sqlite3.Error as e:
+        print(f"❌ Error: {e}")
+        raise
+    finally:
+        conn.close()
+
+    print("✅ Migration complete!")
+
+if __name__ == "__main__":
+    migrate()
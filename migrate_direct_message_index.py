@@ -0,0 +1,28 @@
+"""
+Database migration: Add composite index on direct_messages(sender_id, receiver_id, timestamp, id) for paginated conversations
+"""
+import sqlite3
+
+def migrate():
+    conn = sqlite3.connect('chat_app.db')
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS ix_direct_messages_pair_timestamp_id
+            ON direct_messages (sender_id, receiver_id, timestamp, id)
+        """)
+
+        conn.commit()
+        print("✅ ix_direct_messages_pair_timestamp_id index created")
+
+    except sqlite3.Error as e:
+        print(f"❌ Error: {e}")
+        raise
+    finally:
+        conn.close()
+
+    print("✅ Migration complete!")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,101 @@
+"""
+Database migration: content-addressed opslag voor bijlagen.
+
+Maakt de file_blobs tabel en de kolom file_attachments.blob_id aan, en zet
+bestaande uploads in static/uploads/<kamer>/ om naar blobs in BLOB_DIR
+(buiten static/). Dubbele bestanden worden daarbij samengevoegd en de
+kopieën verwijderd.
+"""
+import hashlib
+import sqlite3
+from pathlib import Path
+
+from app.services.blob_store import BLOB_DIR, attachment_url
+
+
+def sha256_of(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def migrate():
+    conn = sqlite3.connect('chat_app.db')
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS file_blobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sha256 VARCHAR(64) NOT NULL,
+                size BIGINT NOT NULL,
+                storage_path VARCHAR NOT NULL,
+                ref_count INTEGER NOT NULL DEFAULT 0,
+                created_at DATETIME
+            )
+        """)
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_file_blobs_sha256 ON file_blobs (sha256)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_file_blobs_id ON file_blobs (id)")
+        print("✅ file_blobs table created")
+
+        cursor.execute("PRAGMA table_info(file_attachments)")
+        columns = [column[1] for column in cursor.fetchall()]
+        if 'blob_id' not in columns:
+            cursor.execute("ALTER TABLE file_attachments ADD COLUMN blob_id INTEGER REFERENCES file_blobs (id)")
+            print("✅ Added blob_id column to file_attachments")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_file_attachments_blob_id ON file_attachments (blob_id)")
+
+        # Bestaande uploads omzetten
+        cursor.execute("SELECT id, file_path FROM file_attachments WHERE blob_id IS NULL")
+        converted = 0
+        for attachment_id, file_path in cursor.fetchall():
+            source = Path(file_path.lstrip("/"))
+            if not source.is_file():
+                print(f"⚠️  Missing file for attachment {attachment_id}: {file_path}")
+                continue
+
+            sha256 = sha256_of(source)
+            cursor.execute("SELECT id, storage_path FROM file_blobs WHERE sha256 = ?", (sha256,))
+            row = cursor.fetchone()
+            if row:
+                blob_id, storage_path = row
+                source.unlink()
+            else:
+                target = BLOB_DIR / sha256[:2] / f"{sha256}{source.suffix.lower()}"
+                target.parent.mkdir(parents=True, exist_ok=True)
+                source.replace(target)
+                storage_path = target.as_posix()
+                cursor.execute(
+                    "INSERT INTO file_blobs (sha256, size, storage_path, ref_count, created_at) "
+                    "VALUES (?, ?, ?, 0, CURRENT_TIMESTAMP)",
+                    (sha256, target.stat().st_size, storage_path)
+                )
+                blob_id = cursor.lastrowid
+
+            cursor.execute(
+                "UPDATE file_attachments SET blob_id = ?, filename = ?, file_path = ? WHERE id = ?",
+                (blob_id, Path(storage_path).name, attachment_url(attachment_id), attachment_id)
+            )
+            converted += 1
+
+        cursor.execute("""
+            UPDATE file_blobs SET ref_count = (
+                SELECT COUNT(*) FROM file_attachments WHERE file_attachments.blob_id = file_blobs.id
+            )
+        """)
+
+        conn.commit()
+        print(f"✅ {converted} existing attachments moved to the blob store")
+
+    except sqlite3.Error as e:
+        print(f"❌ Error: {e}")
+        raise
+    finally:
+        conn.close()
+
+    print("✅ Migration complete!")
+
+if __name__ == "__main__":
+    migrate()
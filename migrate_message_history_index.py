@@ -0,0 +1,28 @@
+"""
+Database migration: Add composite index on messages(room_id, timestamp, id) for paginated history
+"""
+import sqlite3
+
+def migrate():
+    conn = sqlite3.connect('chat_app.db')
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS ix_messages_room_timestamp_id
+            ON messages (room_id, timestamp, id)
+        """)
+
+        conn.commit()
+        print("✅ ix_messages_room_timestamp_id index created")
+
+    except sqlite3.Error as e:
+        print(f"❌ Error: {e}")
+        raise
+    finally:
+        conn.close()
+
+    print("✅ Migration complete!")
+
+if __name__ == "__main__":
+    migrate()
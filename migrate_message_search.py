@@ -0,0 +1,61 @@
+"""
+Database migration: Full-text search index (SQLite FTS5) on messages
+
+messages_fts is an external-content table: it stores only the index, the text
+itself stays in messages. Triggers keep it in sync with every insert, update
+and delete, including the batched inserts of the message writer.
+"""
+import sqlite3
+
+def migrate():
+    conn = sqlite3.connect('chat_app.db')
+    cursor = conn.cursor()
+
+    try:
+        # room_id is indexed as well, so a search within one room is an
+        # intersection of two posting lists instead of a filter afterwards
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                content,
+                room_id,
+                content='messages',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+        """)
+
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, content, room_id) VALUES (new.id, new.content, new.room_id);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, content, room_id) VALUES ('delete', old.id, old.content, old.room_id);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content, room_id ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, content, room_id) VALUES ('delete', old.id, old.content, old.room_id);
+                INSERT INTO messages_fts (rowid, content, room_id) VALUES (new.id, new.content, new.room_id);
+            END
+        """)
+
+        # Index existing messages
+        cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+        conn.commit()
+        print("✅ messages_fts index created")
+        print("✅ messages_fts sync triggers created")
+
+    except sqlite3.Error as e:
+        print(f"❌ Error: {e}")
+        raise
+    finally:
+        conn.close()
+
+    print("✅ Migration complete!")
+
+if __name__ == "__main__":
+    migrate()
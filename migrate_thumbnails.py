@@ -0,0 +1,62 @@
+"""
+Database migration: kolommen voor thumbnails/placeholders op file_blobs.
+
+Maakt daarna (als Pillow geïnstalleerd is) de derivaten voor bestaande
+afbeeldingen, zodat ook oude berichten met thumbnails laden.
+"""
+import sqlite3
+
+from app.services.thumbnails import Image, THUMBNAIL_CONTENT_TYPES, render_derivatives
+
+def migrate():
+    conn = sqlite3.connect('chat_app.db')
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("PRAGMA table_info(file_blobs)")
+        columns = [column[1] for column in cursor.fetchall()]
+
+        for name, sql_type in [("width", "INTEGER"), ("height", "INTEGER"),
+                               ("thumbnail_path", "VARCHAR"), ("placeholder", "VARCHAR")]:
+            if name not in columns:
+                cursor.execute(f"ALTER TABLE file_blobs ADD COLUMN {name} {sql_type}")
+                print(f"✅ Added {name} column to file_blobs")
+        conn.commit()
+
+        if Image is None:
+            print("⚠️  Pillow not installed, skipping thumbnails for existing images")
+            return
+
+        placeholders = ",".join("?" for _ in THUMBNAIL_CONTENT_TYPES)
+        cursor.execute(f"""
+            SELECT DISTINCT file_blobs.id, file_blobs.storage_path
+            FROM file_blobs JOIN file_attachments ON file_attachments.blob_id = file_blobs.id
+            WHERE file_blobs.thumbnail_path IS NULL AND file_attachments.content_type IN ({placeholders})
+        """, THUMBNAIL_CONTENT_TYPES)
+
+        created = 0
+        for blob_id, storage_path in cursor.fetchall():
+            try:
+                derivatives = render_derivatives(storage_path)
+            except Exception as e:
+                print(f"⚠️  Blob {blob_id}: {e}")
+                continue
+            cursor.execute(
+                "UPDATE file_blobs SET width = ?, height = ?, thumbnail_path = ?, placeholder = ? WHERE id = ?",
+                (derivatives["width"], derivatives["height"], derivatives["thumbnail_path"], derivatives["placeholder"], blob_id)
+            )
+            created += 1
+
+        conn.commit()
+        print(f"✅ Thumbnails created for {created} existing images")
+
+    except sqlite3.Error as e:
+        print(f"❌ Error: {e}")
+        raise
+    finally:
+        conn.close()
+
+    print("✅ Migration complete!")
+
+if __name__ == "__main__":
+    migrate()
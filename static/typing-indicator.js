@@ -7,12 +7,17 @@ class TypingIndicator {
         this.typingUsers = new Set();
         this.typingTimeout = null;
         this.isTyping = false;
+        this.lastSent = 0;
     }
 
     // Call this when user starts typing
     startTyping() {
-        if (!this.isTyping) {
+        // Zolang we typen hooguit elke 2 seconden opnieuw melden; de server
+        // laat een typend iemand na 5 seconden zonder melding vanzelf vallen
+        const now = Date.now();
+        if (!this.isTyping || now - this.lastSent > 2000) {
             this.isTyping = true;
+            this.lastSent = now;
             this.sendTypingStatus(true);
         }
 
@@ -36,22 +41,16 @@ class TypingIndicator {
         if (this.ws && this.ws.readyState === WebSocket.OPEN) {
             this.ws.send(JSON.stringify({
                 type: 'typing',
-                username: this.username,
+                room: this.roomSlug,
                 isTyping: isTyping
             }));
         }
     }
 
-    // Call this when receiving typing status from server
-    handleTypingStatus(username, isTyping) {
-        if (username === this.username) return; // Ignore own typing
-
-        if (isTyping) {
-            this.typingUsers.add(username);
-        } else {
-            this.typingUsers.delete(username);
-        }
-
+    // Call this when receiving the combined typing frame from the server
+    handleTypingUsers(users) {
+        // Ignore own typing
+        this.typingUsers = new Set(users.filter(user => user !== this.username));
         this.updateTypingDisplay();
     }
 
@@ -0,0 +1,129 @@
+"""
+Downloads via /api/attachments/{id}: sterke ETag op de SHA-256, 304 bij
+If-None-Match, en Range-verzoeken (206 / 416).
+"""
+import hashlib
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.api import files
+from app.auth.security import get_current_principal_from_header_or_query
+from app.auth.token_cache import Principal
+from app.database.database import Base, get_read_db
+from app.models.call_room import CallRoom  # noqa: F401 (mappers van User)
+from app.models.conversation import Conversation  # noqa: F401
+from app.models.direct_message import DirectMessage  # noqa: F401
+from app.models.file_attachment import FileAttachment
+from app.models.file_blob import FileBlob
+from app.models.message import Message
+from app.models.room import Room
+from app.models.room_member import RoomMember  # noqa: F401
+from app.models.user import User
+
+CONTENT = bytes(range(256)) * 40
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+@pytest.fixture
+def client(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'attachments.db'}")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+
+    path = tmp_path / "blobs" / SHA256[:2] / f"{SHA256}.pdf"
+    path.parent.mkdir(parents=True)
+    path.write_bytes(CONTENT)
+
+    session = Session()
+    user = User(username="alice", hashed_password="x")
+    room = Room(name="General", slug="general")
+    session.add_all([user, room])
+    session.flush()
+    message = Message(content="bijlage", user_id=user.id, room_id=room.id)
+    blob = FileBlob(sha256=SHA256, size=len(CONTENT), storage_path=path.as_posix(), ref_count=1)
+    session.add_all([message, blob])
+    session.flush()
+    session.add(FileAttachment(
+        filename=f"{SHA256}.pdf", original_filename="verslag.pdf", file_path="/api/attachments/1",
+        file_size=len(CONTENT), content_type="application/pdf", message_id=message.id,
+        user_id=user.id, blob_id=blob.id,
+    ))
+    session.commit()
+    principal = Principal(user.id, user.username, None, True, "dark", True)
+    session.close()
+
+    def read_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(files.router, prefix="/api")
+    app.dependency_overrides[get_read_db] = read_db
+    app.dependency_overrides[get_current_principal_from_header_or_query] = lambda: principal
+    yield TestClient(app)
+    engine.dispose()
+
+
+def test_full_download_has_a_strong_etag(client):
+    response = client.get("/api/attachments/1")
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["etag"] == f'"{SHA256}"'
+    assert response.headers["accept-ranges"] == "bytes"
+    assert "immutable" in response.headers["cache-control"]
+    assert response.headers["content-disposition"] == "inline; filename*=utf-8''verslag.pdf"
+
+
+@pytest.mark.parametrize("if_none_match", [f'"{SHA256}"', f'W/"{SHA256}"', f'"iets-anders", "{SHA256}"', "*"])
+def test_matching_if_none_match_gives_304(client, if_none_match):
+    response = client.get("/api/attachments/1", headers={"If-None-Match": if_none_match})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == f'"{SHA256}"'
+
+
+def test_other_etag_gives_the_file(client):
+    response = client.get("/api/attachments/1", headers={"If-None-Match": '"iets-anders"'})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+def test_range_request(client):
+    response = client.get("/api/attachments/1", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.content == CONTENT[100:200]
+    assert response.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+
+    response = client.get("/api/attachments/1", headers={"Range": "bytes=-10"})
+    assert response.status_code == 206
+    assert response.content == CONTENT[-10:]
+
+
+def test_range_with_if_range(client):
+    # Klopt de ETag niet meer, dan het hele bestand in plaats van een stuk
+    response = client.get("/api/attachments/1", headers={"Range": "bytes=0-9", "If-Range": '"oud"'})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+    response = client.get("/api/attachments/1", headers={"Range": "bytes=0-9", "If-Range": f'"{SHA256}"'})
+    assert response.status_code == 206
+    assert response.content == CONTENT[:10]
+
+
+def test_unsatisfiable_range(client):
+    response = client.get("/api/attachments/1", headers={"Range": f"bytes={len(CONTENT) + 10}-"})
+    assert response.status_code == 416
+
+
+def test_head_has_no_body(client):
+    response = client.head("/api/attachments/1")
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["content-length"] == str(len(CONTENT))
@@ -0,0 +1,104 @@
+"""
+Brokers: InProcessBroker altijd; RedisBroker alleen met het redis-pakket
+en een bereikbare server in REDIS_URL (bv. redis://localhost:6379/15).
+"""
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from app.services.broker import InProcessBroker, InProcessHub, RedisBroker, aioredis
+from app.services.connection_manager import ConnectionManager
+
+REDIS_URL = os.environ.get("REDIS_URL")
+
+
+async def _exchange(a, b):
+    """Publiceer van a naar b en geef terug wat b ontving (en of a iets terugkreeg)."""
+    received = asyncio.Queue()
+    echoed = asyncio.Queue()
+
+    async def on_b(channel, message):
+        received.put_nowait((channel, message))
+
+    async def on_a(channel, message):
+        echoed.put_nowait((channel, message))
+
+    await b.subscribe("room:general", on_b)
+    await a.subscribe("room:general", on_a)
+    await a.publish("room:general", "hallo")
+    result = await asyncio.wait_for(received.get(), 5)
+    await asyncio.sleep(0.05)
+    return result, echoed.empty()
+
+
+def test_in_process_broker_delivers_to_other_nodes_only():
+    async def main():
+        hub = InProcessHub()
+        a, b = InProcessBroker(hub), InProcessBroker(hub)
+        try:
+            result, no_echo = await _exchange(a, b)
+            assert result == ("room:general", "hallo")
+            assert no_echo
+        finally:
+            await a.close()
+            await b.close()
+
+    asyncio.run(main())
+
+
+def test_in_process_broker_has_peers():
+    async def main():
+        hub = InProcessHub()
+        a, b = InProcessBroker(hub), InProcessBroker(hub)
+
+        async def callback(channel, message):
+            pass
+
+        await a.subscribe("room:general", callback)
+        assert not a.has_peers("room:general")
+        await b.subscribe("room:general", callback)
+        assert a.has_peers("room:general")
+        await b.unsubscribe("room:general")
+        assert not a.has_peers("room:general")
+        await a.close()
+
+    asyncio.run(main())
+
+
+def test_manager_skips_envelope_without_peers():
+    async def main():
+        manager = ConnectionManager(broker=InProcessBroker())
+        await manager.start()
+        await manager.broadcast("x", "general")
+        await manager.send_to_user("x", "alice")
+        assert manager.envelopes_published == 0
+        await manager.close()
+
+    asyncio.run(main())
+
+
+@pytest.mark.skipif(aioredis is None or not REDIS_URL, reason="redis-pakket of REDIS_URL ontbreekt")
+def test_redis_broker_publish_and_sets():
+    async def main():
+        prefix = f"test-{uuid.uuid4().hex}:"
+        a, b = RedisBroker(REDIS_URL, prefix), RedisBroker(REDIS_URL, prefix)
+        try:
+            assert a.has_peers("room:general")
+            result, no_echo = await _exchange(a, b)
+            assert result == ("room:general", "hallo")
+            # Redis levert ook aan de afzender; de ConnectionManager filtert op origin
+            assert not no_echo
+
+            await a.set_add("call:c1", "alice")
+            await b.set_add("call:c1", "bob")
+            assert await a.set_members("call:c1") == {"alice", "bob"}
+            await a.set_remove("call:c1", "alice")
+            await a.set_remove("call:c1", "bob")
+            assert await b.set_members("call:c1") == set()
+        finally:
+            await a.close()
+            await b.close()
+
+    asyncio.run(main())
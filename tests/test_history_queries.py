@@ -0,0 +1,136 @@
+"""
+Regressietests voor get_message_history: het aantal queries per pagina is
+constant (kamer, berichten met afzender en reply, bijlagen), hoe groot de
+pagina ook is en hoeveel berichten bijlagen of replies hebben; en de
+keyset-cursors before/after lopen zonder gaten of dubbelingen door de
+geschiedenis, ook bij gelijke timestamps.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event, update
+from sqlalchemy.orm import sessionmaker
+
+from app.database.database import Base
+from app.models.call_room import CallRoom  # noqa: F401 (mappers van User)
+from app.models.conversation import Conversation  # noqa: F401
+from app.models.direct_message import DirectMessage  # noqa: F401
+from app.models.file_attachment import FileAttachment
+from app.models.file_blob import FileBlob
+from app.models.message import Message
+from app.models.room import Room
+from app.models.room_member import RoomMember  # noqa: F401
+from app.models.user import User
+from app.services import chat_crud
+
+MESSAGES = 120
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'history.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    users = [User(username=f"user{i}", hashed_password="x") for i in range(3)]
+    room = Room(name="General", slug="general")
+    session.add_all(users + [room])
+    session.flush()
+
+    start = datetime(2024, 1, 1)
+    messages = []
+    for i in range(MESSAGES):
+        message = Message(
+            content=f"bericht {i}",
+            timestamp=start + timedelta(seconds=i),
+            user_id=users[i % len(users)].id,
+            room_id=room.id,
+            # Elk derde bericht is een reply op het vorige
+            reply_to_id=messages[-1].id if messages and i % 3 == 0 else None,
+        )
+        session.add(message)
+        session.flush()
+        messages.append(message)
+
+        if i % 2 == 0:
+            blob = FileBlob(sha256=f"{i:064x}", size=10, storage_path=f"data/blobs/{i}.png", ref_count=1,
+                            thumbnail_path=f"data/blobs/{i}.thumb.webp" if i % 4 == 0 else None)
+            session.add(blob)
+            session.flush()
+            session.add(FileAttachment(
+                filename=f"{i}.png", original_filename=f"{i}.png", file_path=f"/api/attachments/{i}",
+                file_size=10, content_type="image/png", message_id=message.id,
+                user_id=message.user_id, blob_id=blob.id,
+            ))
+    session.commit()
+    session.close()
+
+    yield engine, sessionmaker(bind=engine)
+    engine.dispose()
+
+
+@contextmanager
+def count_statements(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.mark.parametrize("limit", [5, 50, 100])
+def test_history_query_count_is_constant(db, limit):
+    engine, Session = db
+    session = Session()
+    try:
+        with count_statements(engine) as statements:
+            history = chat_crud.get_message_history(session, "general", limit=limit)
+            # Alles wat de frontend leest moet al geladen zijn
+            payload = [message.model_dump() for message in history]
+    finally:
+        session.close()
+
+    assert len(payload) == limit
+    assert any(message["reply_to"] for message in payload)
+    assert any(message["attachments"] for message in payload)
+    assert any(attachment["thumbnail_url"] for message in payload for attachment in message["attachments"])
+    assert len(statements) == 3, statements
+
+
+def _page_ids(session, **cursor):
+    return [message.id for message in chat_crud.get_message_history(session, "general", limit=7, **cursor)]
+
+
+def test_keyset_cursors_walk_the_whole_history(db):
+    engine, Session = db
+    session = Session()
+    try:
+        # Gelijke timestamps: dan beslist het id
+        session.execute(update(Message).where(Message.id <= 40).values(timestamp=datetime(2023, 12, 31)))
+        session.commit()
+        expected = [message.id for message in session.query(Message).order_by(Message.timestamp, Message.id)]
+
+        backwards = _page_ids(session)
+        while True:
+            page = _page_ids(session, before=backwards[0])
+            if not page:
+                break
+            assert page == sorted(page)
+            backwards = page + backwards
+        assert backwards == expected
+
+        forwards = _page_ids(session, after=expected[0])
+        while True:
+            page = _page_ids(session, after=forwards[-1])
+            if not page:
+                break
+            forwards += page
+        assert [expected[0]] + forwards == expected
+    finally:
+        session.close()
@@ -0,0 +1,98 @@
+"""
+De inbox (/api/conversations): samenvatting van het laatste bericht per
+gesprek, nieuwste eerst, en paginering met before=<last_message_id>.
+"""
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.api import direct_messages
+from app.api.schemas import ConversationSummary
+from app.auth.token_cache import Principal
+from app.database.database import Base
+from app.models.call_room import CallRoom  # noqa: F401 (mappers van User)
+from app.models.conversation import Conversation  # noqa: F401
+from app.models.direct_message import DirectMessage  # noqa: F401
+from app.models.file_attachment import FileAttachment  # noqa: F401
+from app.models.file_blob import FileBlob  # noqa: F401
+from app.models.message import Message  # noqa: F401
+from app.models.room import Room  # noqa: F401
+from app.models.room_member import RoomMember  # noqa: F401
+from app.models.user import User
+
+PEERS = ["bob", "carol", "dave", "erin", "frank"]
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'inbox.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([User(username=name, hashed_password="x") for name in ["alice"] + PEERS])
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def users(db):
+    return {user.username: Principal(user.id, user.username, None, True, "dark", True) for user in db.query(User)}
+
+
+def _send(db, sender: Principal, receiver: str, content: str) -> int:
+    message, _ = direct_messages._create_direct_message(db, sender, receiver, content)
+    return message.id
+
+
+def _inbox(db, user: Principal, **kwargs):
+    rows = direct_messages.get_conversations(db=db, user=user, **{"before": None, "limit": 50, **kwargs})
+    return [ConversationSummary.model_validate(row) for row in rows]
+
+
+def test_inbox_summarises_the_latest_message_per_conversation(db, users):
+    alice = users["alice"]
+    _send(db, users["bob"], "alice", "eerste")
+    _send(db, users["bob"], "alice", "tweede")
+    _send(db, alice, "carol", "x" * 500)
+    last = _send(db, alice, "bob", "antwoord")
+    _send(db, users["dave"], "alice", json.dumps({"encrypted": True, "ciphertext": "..."}))
+
+    inbox = _inbox(db, alice)
+    assert [summary.peer_username for summary in inbox] == ["dave", "bob", "carol"]
+
+    dave, bob, carol = inbox
+    # Een eigen antwoord is het laatste bericht, maar telt niet als ongelezen
+    assert (bob.last_message_id, bob.last_message_snippet, bob.unread_count) == (last, "antwoord", 2)
+    assert carol.unread_count == 0
+    assert len(carol.last_message_snippet) < 500
+    # Versleutelde berichten krijgen geen preview
+    assert dave.last_message_snippet is None
+    assert dave.unread_count == 1
+
+    # Vanuit bob gezien: één gesprek, niets ongelezen (het antwoord van alice wel)
+    assert [(summary.peer_username, summary.unread_count) for summary in _inbox(db, users["bob"])] == [("alice", 1)]
+
+
+def test_inbox_pages_with_before(db, users):
+    alice = users["alice"]
+    for round_ in range(2):
+        for peer in PEERS:
+            _send(db, users[peer], "alice", f"{peer} {round_}")
+
+    seen = []
+    before = None
+    while True:
+        page = _inbox(db, alice, before=before, limit=2)
+        if not page:
+            break
+        assert len(page) <= 2
+        seen.extend(page)
+        before = page[-1].last_message_id
+
+    assert [summary.peer_username for summary in seen] == list(reversed(PEERS))
+    ids = [summary.last_message_id for summary in seen]
+    assert ids == sorted(ids, reverse=True)
+    assert all(summary.unread_count == 2 for summary in seen)
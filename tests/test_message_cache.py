@@ -0,0 +1,49 @@
+"""Berichtcache: berichten en gebeurtenissen van andere nodes (apply_remote)."""
+from datetime import datetime
+
+from app.api.schemas import MessageDisplay
+from app.services.message_cache import RecentMessageCache
+
+
+def _message(message_id: int) -> MessageDisplay:
+    return MessageDisplay(
+        id=message_id,
+        content=f"bericht {message_id}",
+        timestamp=datetime(2024, 1, 1),
+        username="alice",
+        room_slug="general",
+    )
+
+
+def _filled(*message_ids: int) -> RecentMessageCache:
+    cache = RecentMessageCache(window_size=10)
+    cache.fill("general", [_message(message_id) for message_id in message_ids], cache.version("general"))
+    return cache
+
+
+def test_remote_message_is_appended_once():
+    cache = _filled(1, 2)
+    frame = _message(3).model_dump_json()
+    cache.apply_remote("general", frame)
+    cache.apply_remote("general", frame)
+    assert [message.id for message in cache.get("general", 10)] == [1, 2, 3]
+
+
+def test_remote_event_about_a_message_invalidates_the_room():
+    cache = _filled(1, 2)
+    cache.apply_remote("general", '{"type": "attachment-updated", "message_id": 2}')
+    assert cache.get("general", 10) is None
+
+
+def test_other_remote_events_leave_the_room_cached():
+    cache = _filled(1, 2)
+    cache.apply_remote("general", '{"type": "system", "text": "bob is binnengekomen"}')
+    assert [message.id for message in cache.get("general", 10)] == [1, 2]
+
+
+def test_remote_frame_rejects_a_concurrent_fill():
+    cache = RecentMessageCache(window_size=10)
+    version = cache.version("general")
+    cache.apply_remote("general", _message(1).model_dump_json())
+    cache.fill("general", [], version)
+    assert cache.get("general", 10) is None
@@ -0,0 +1,74 @@
+"""
+Group commit (MessageWriteQueue): berichten uit één venster gaan in één
+batch; faalt de batch, dan worden ze los opnieuw geprobeerd zodat alleen
+het foute bericht faalt.
+"""
+import asyncio
+
+import pytest
+
+from app.services import message_writer
+from app.services.message_writer import MessageWriteQueue
+
+
+class FakeExecutor:
+    """Doet alsof save_messages_batch de hele batch terugdraait zodra er één bericht fout is."""
+    def __init__(self):
+        self.batches = []
+
+    async def run(self, fn, pending):
+        self.batches.append([item["content"] for item in pending])
+        if any(item["content"] == "fout" for item in pending):
+            raise RuntimeError("constraint failed")
+        return [f"opgeslagen: {item['content']}" for item in pending]
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    executor = FakeExecutor()
+    monkeypatch.setattr(message_writer, "db_executor", executor)
+    return executor
+
+
+def _submit_all(queue: MessageWriteQueue, contents):
+    async def run():
+        try:
+            return await asyncio.gather(
+                *(queue.submit("alice", "general", content) for content in contents),
+                return_exceptions=True
+            )
+        finally:
+            await queue.close()
+    return asyncio.run(run())
+
+
+def test_messages_in_one_window_share_a_batch(executor):
+    queue = MessageWriteQueue(flush_interval_ms=50)
+    results = _submit_all(queue, ["a", "b", "c"])
+
+    assert results == ["opgeslagen: a", "opgeslagen: b", "opgeslagen: c"]
+    assert executor.batches == [["a", "b", "c"]]
+    assert queue.stats()["batches"] == 1
+    assert queue.stats()["messages"] == 3
+
+
+def test_failed_batch_is_retried_one_by_one(executor):
+    queue = MessageWriteQueue(flush_interval_ms=50)
+    results = _submit_all(queue, ["a", "fout", "c"])
+
+    assert results[0] == "opgeslagen: a"
+    assert isinstance(results[1], RuntimeError)
+    assert results[2] == "opgeslagen: c"
+    assert executor.batches == [["a", "fout", "c"], ["a"], ["fout"], ["c"]]
+    # Alleen de gelukte losse commits tellen
+    assert queue.stats()["batches"] == 2
+    assert queue.stats()["messages"] == 2
+
+
+def test_batches_are_capped(executor):
+    queue = MessageWriteQueue(flush_interval_ms=50, max_batch_size=2)
+    results = _submit_all(queue, ["a", "b", "c", "d", "e"])
+
+    assert len(results) == 5
+    assert all(len(batch) <= 2 for batch in executor.batches)
+    assert [content for batch in executor.batches for content in batch] == ["a", "b", "c", "d", "e"]
@@ -0,0 +1,64 @@
+"""TokenCache: invalidatie per gebruiker via generaties, en de levensduur van entries."""
+import time
+
+from app.auth.token_cache import Principal, TokenCache
+
+
+def _principal(username: str, avatar_url: str = "/static/default-avatar.svg") -> Principal:
+    return Principal(1, username, avatar_url, True, "dark", True)
+
+
+def _cache_lookup(cache: TokenCache, token: str, principal: Principal, exp=None):
+    """Zoals resolve_principal: generatie vóór de database-lookup lezen, daarna put()."""
+    generation = cache.generation(principal.username)
+    cache.put(token, principal, exp, generation)
+
+
+def test_invalidate_user_drops_all_tokens_of_that_user():
+    cache = TokenCache()
+    _cache_lookup(cache, "a1", _principal("alice"))
+    _cache_lookup(cache, "a2", _principal("alice"))
+    _cache_lookup(cache, "b1", _principal("bob"))
+
+    cache.invalidate_user("alice")
+
+    assert cache.get("a1") is None
+    assert cache.get("a2") is None
+    assert cache.get("b1") == _principal("bob")
+
+
+def test_lookup_that_raced_an_invalidation_is_not_cached():
+    cache = TokenCache()
+    # Een lookup leest de generatie en haalt de (oude) gebruiker op ...
+    generation = cache.generation("alice")
+    stale = _principal("alice", "/static/oud.png")
+    # ... terwijl het profiel gewijzigd wordt
+    cache.invalidate_user("alice")
+    cache.put("a1", stale, None, generation)
+    assert cache.get("a1") is None
+
+    # De volgende lookup ziet de nieuwe generatie en mag wel cachen
+    fresh = _principal("alice", "/static/nieuw.png")
+    _cache_lookup(cache, "a1", fresh)
+    assert cache.get("a1") == fresh
+
+
+def test_entries_expire_at_token_exp_or_ttl():
+    cache = TokenCache(ttl=300)
+    _cache_lookup(cache, "expired", _principal("alice"), exp=time.time() - 1)
+    assert cache.get("expired") is None
+
+    cache = TokenCache(ttl=0)
+    _cache_lookup(cache, "ttl", _principal("alice"), exp=time.time() + 3600)
+    assert cache.get("ttl") is None
+
+
+def test_lru_eviction_forgets_the_user_index():
+    cache = TokenCache(max_size=2)
+    for token in ("a1", "a2", "a3"):
+        _cache_lookup(cache, token, _principal("alice"))
+
+    assert cache.get("a1") is None
+    assert cache.stats()["size"] == 2
+    cache.invalidate_user("alice")
+    assert cache.stats()["size"] == 0
@@ -0,0 +1,140 @@
+"""
+Leesstatus van directe berichten: de teller van ongelezen berichten, het
+watermerk (mark-read met en zonder `up_to`) en de `unread`-events.
+"""
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.api import direct_messages
+from app.auth.token_cache import Principal
+from app.database.database import Base
+from app.models.call_room import CallRoom  # noqa: F401 (mappers van User)
+from app.models.conversation import Conversation
+from app.models.direct_message import DirectMessage  # noqa: F401
+from app.models.file_attachment import FileAttachment  # noqa: F401
+from app.models.file_blob import FileBlob  # noqa: F401
+from app.models.message import Message  # noqa: F401
+from app.models.room import Room  # noqa: F401
+from app.models.room_member import RoomMember  # noqa: F401
+from app.models.user import User
+from app.services import chat_crud
+
+
+def _principal(user: User) -> Principal:
+    return Principal(user.id, user.username, None, True, "dark", True)
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'unread.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([User(username=name, hashed_password="x") for name in ("alice", "bob", "carol")])
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def users(db):
+    return {user.username: _principal(user) for user in db.query(User)}
+
+
+@pytest.fixture
+def events(monkeypatch, db):
+    """Draai de routes op de testsessie en vang wat ze naar gebruikers sturen."""
+    class Executor:
+        async def run(self, fn, *args):
+            return fn(db, *args)
+
+    sent = []
+
+    async def send_to_user(message, username, channel=None):
+        sent.append((username, channel, json.loads(message.text)))
+
+    monkeypatch.setattr(direct_messages, "db_executor", Executor())
+    monkeypatch.setattr(direct_messages.manager, "send_to_user", send_to_user)
+    return sent
+
+
+def _send(db, sender: Principal, receiver: str, content: str = "hoi") -> int:
+    message, _ = direct_messages._create_direct_message(db, sender, receiver, content)
+    return message.id
+
+
+def _conversation(db, owner: Principal, peer: Principal) -> Conversation:
+    db.expire_all()
+    return db.query(Conversation).filter_by(owner_id=owner.user_id, peer_id=peer.user_id).one()
+
+
+def test_new_messages_count_for_the_receiver_only(db, users):
+    alice, bob = users["alice"], users["bob"]
+    for _ in range(3):
+        _send(db, alice, "bob")
+
+    assert _conversation(db, bob, alice).unread_count == 3
+    assert _conversation(db, alice, bob).unread_count == 0
+    assert chat_crud.get_unread_counts(db, bob.user_id) == {"total": 3, "conversations": {"alice": 3}}
+    assert chat_crud.get_unread_counts(db, alice.user_id) == {"total": 0, "conversations": {}}
+
+
+def test_mark_read_up_to_moves_the_watermark_and_recounts(db, users):
+    alice, bob, carol = users["alice"], users["bob"], users["carol"]
+    ids = [_send(db, alice, "bob") for _ in range(4)]
+    _send(db, carol, "bob")
+
+    assert chat_crud.mark_conversation_read(db, bob.user_id, alice.user_id, up_to=ids[1])
+    db.commit()
+    conversation = _conversation(db, bob, alice)
+    assert (conversation.last_read_message_id, conversation.unread_count) == (ids[1], 2)
+    # Andere gesprekken blijven staan
+    assert chat_crud.get_unread_counts(db, bob.user_id) == {"total": 3, "conversations": {"alice": 2, "carol": 1}}
+
+    # Een ouder watermerk zet niets terug
+    assert not chat_crud.mark_conversation_read(db, bob.user_id, alice.user_id, up_to=ids[0])
+    assert _conversation(db, bob, alice).last_read_message_id == ids[1]
+
+    # Zonder up_to: alles van alice gelezen
+    assert chat_crud.mark_conversation_read(db, bob.user_id, alice.user_id)
+    db.commit()
+    conversation = _conversation(db, bob, alice)
+    assert (conversation.last_read_message_id, conversation.unread_count) == (ids[-1], 0)
+    assert not chat_crud.mark_conversation_read(db, bob.user_id, alice.user_id)
+
+
+def test_messages_after_the_watermark_count_again(db, users):
+    alice, bob = users["alice"], users["bob"]
+    _send(db, alice, "bob")
+    chat_crud.mark_conversation_read(db, bob.user_id, alice.user_id)
+    db.commit()
+
+    latest = _send(db, alice, "bob")
+    conversation = _conversation(db, bob, alice)
+    assert conversation.unread_count == 1
+    assert conversation.last_read_message_id < latest
+
+
+def test_unread_events(db, users, events):
+    alice, bob = users["alice"], users["bob"]
+    request = direct_messages.DirectMessageCreate(receiver_username="bob", content="hoi")
+    first, _, _ = [asyncio.run(direct_messages.send_direct_message(request, alice))["message_id"] for _ in range(3)]
+
+    unread = [event for username, channel, event in events if event["type"] == "unread"]
+    assert [(event["count"], event["total"]) for event in unread] == [(1, 1), (2, 2), (3, 3)]
+    assert all(event["peer"] == "alice" for event in unread)
+    assert {(username, channel) for username, channel, event in events if event["type"] == "unread"} == {("bob", "dm")}
+
+    events.clear()
+    result = asyncio.run(direct_messages.mark_conversation_read("alice", up_to=first, user=bob))
+    assert result == {"updated": True, "unread_count": 2, "total": 2}
+    assert events == [("bob", "dm", {"type": "unread", "peer": "alice", "count": 2, "total": 2})]
+
+    # Niets veranderd: geen event
+    events.clear()
+    assert asyncio.run(direct_messages.mark_conversation_read("alice", up_to=first, user=bob)) == {"updated": False}
+    assert events == []